@@ -0,0 +1,310 @@
+import contextlib
+import html
+import time
+from datetime import datetime
+from typing import List, Optional
+
+from aiogram import Dispatcher, F
+from aiogram.filters import Command, CommandObject, Filter
+from aiogram.types import BufferedInputFile, CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup, Message
+
+from config import get_settings
+from broadcast import Broadcaster
+from keyboards import SELECTED, UNSELECTED, broadcast_keyboard, pending_keyboard
+from orders import ACTIVATED, BROADCAST_RUNNING, PAID, Broadcast, Order, OrderRepository, OutgoingMessage
+from outbox import OutboxWorker
+from profiling import SamplingProfiler
+
+
+PAGE_SIZE = 10
+PROFILE_SECONDS, PROFILE_MAX_SECONDS = 10.0, 60.0
+# callback_data в Telegram ограничена 64 байтами
+CALLBACK_LIMIT = 64
+STATUS_LABELS = {
+    "created": "🆕 создан",
+    "invoiced": "🧾 счёт выставлен",
+    "paid": "💳 оплачен",
+    "activated": "✅ активирован",
+    "issue": "⚠️ проблема",
+    "canceled": "✖️ отменён",
+    "expired": "⌛ счёт истёк",
+}
+BROADCAST_LABELS = {
+    "draft": "черновик",
+    "running": "идёт",
+    "done": "завершена",
+    "canceled": "остановлена",
+}
+
+
+def activated_text(total: int | None) -> str:
+    return (
+        "🎉 <b>Подписка оформлена!</b>\n\n"
+        + (f"💰 Сумма: {total} ₽\n" if total else "")
+        + "Хорошего пользования! Если будут вопросы — отвечайте в этом чате."
+    )
+
+
+ISSUE_TEXT = (
+    "⚠️ <b>Возникла проблема с оформлением</b>\n\n"
+    "Пожалуйста, свяжитесь с менеджером, ответив в этом чате, — мы быстро поможем."
+)
+
+
+def activated_messages(order: Order) -> List[OutgoingMessage]:
+    recipient = order.chat_id or order.user_id
+    return [OutgoingMessage(recipient, activated_text(order.total_rub), parse_mode="HTML")] if recipient else []
+
+
+class AdminChat(Filter):
+    """Passes updates that come from the manager chat (numeric id or @username).
+
+    The chat is read from the current settings snapshot, so a reloaded
+    ``ADMIN_CHAT_ID`` applies without re-registering handlers.
+    """
+
+    async def __call__(self, event) -> bool:
+        message = event.message if isinstance(event, CallbackQuery) else event
+        chat = getattr(message, "chat", None)
+        if chat is None:
+            return False
+        admin_chat_id = get_settings().admin_chat_id
+        if str(chat.id) == admin_chat_id:
+            return True
+        return bool(chat.username) and f"@{chat.username}".lower() == admin_chat_id.lower()
+
+
+def format_order_line(order: Order) -> str:
+    when = datetime.fromtimestamp(order.paid_at or order.created_at).strftime("%d.%m %H:%M")
+    who = f"@{order.username}" if order.username else (order.user_id or "—")
+    return (
+        f"<b>#{order.id}</b> {STATUS_LABELS.get(order.status, order.status)} · {when}\n"
+        f"   {html.escape(order.service)} · {html.escape(order.login or '—')} · {order.total_rub} ₽ · {html.escape(str(who))}"
+    )
+
+
+def broadcast_status_text(broadcast: Broadcast) -> str:
+    return (
+        f"📣 <b>Рассылка #{broadcast.id}</b> — {BROADCAST_LABELS.get(broadcast.status, broadcast.status)}\n\n"
+        f"Доставлено: {broadcast.sent} из {broadcast.total}\n"
+        f"Заблокировали бота: {broadcast.blocked}\n"
+        f"Ошибок: {broadcast.failed}"
+    )
+
+
+def _find_callback(before_id: int, term: str) -> Optional[str]:
+    prefix = f"adm:find:{before_id}:"
+    encoded = term.encode()
+    if len(prefix.encode()) + len(encoded) > CALLBACK_LIMIT:
+        # Длинный запрос не влезает в кнопку — листать дальше нельзя
+        return None
+    return prefix + term
+
+
+async def _answer(call: CallbackQuery, text: Optional[str] = None, alert: bool = False) -> None:
+    with contextlib.suppress(Exception):
+        await call.answer(text, show_alert=alert)
+
+
+def register_admin_handlers(dp: Dispatcher) -> None:
+    """Dashboard commands of the manager chat: /pending, /find, /stats, /broadcast, /profile.
+
+    All lists are keyset-paginated (``id < last seen``) over indexed
+    columns, so a page costs the same with a hundred or a million orders.
+    Must be registered before the catch-all message handler.
+    """
+    admin = AdminChat()
+
+    async def pending_page(before_id: Optional[int], orders: OrderRepository):
+        page = await orders.by_status(PAID, before_id, PAGE_SIZE + 1)
+        next_before = page[PAGE_SIZE - 1].id if len(page) > PAGE_SIZE else None
+        page = page[:PAGE_SIZE]
+        if not page:
+            return "Оплаченных заказов, ожидающих активации, нет.", None
+        text = "💳 <b>Ждут активации</b>\n\n" + "\n".join(format_order_line(order) for order in page)
+        return text, pending_keyboard(page, next_before=next_before)
+
+    @dp.message(Command("pending"), admin)
+    async def pending_cmd(m: Message, orders: OrderRepository):
+        text, markup = await pending_page(None, orders)
+        await m.answer(text, reply_markup=markup, parse_mode="HTML")
+
+    @dp.callback_query(F.data.startswith("adm:pending:"), admin)
+    async def pending_next(call: CallbackQuery, orders: OrderRepository):
+        raw = call.data.rsplit(":", 1)[1]
+        text, markup = await pending_page(int(raw) if raw.isdigit() else None, orders)
+        await _answer(call)
+        await call.message.answer(text, reply_markup=markup, parse_mode="HTML")
+
+    @dp.callback_query(F.data.startswith("adm:sel:"), admin)
+    async def pending_toggle(call: CallbackQuery):
+        markup = call.message.reply_markup
+        if markup is None:
+            return await _answer(call)
+        rows = []
+        for row in markup.inline_keyboard:
+            buttons = []
+            for button in row:
+                if button.callback_data == call.data:
+                    mark = UNSELECTED if button.text.startswith(SELECTED) else SELECTED
+                    button = button.model_copy(update={"text": mark + button.text[1:]})
+                buttons.append(button)
+            rows.append(buttons)
+        await _answer(call)
+        with contextlib.suppress(Exception):
+            await call.message.edit_reply_markup(reply_markup=InlineKeyboardMarkup(inline_keyboard=rows))
+
+    @dp.callback_query(F.data == "adm:activate", admin)
+    async def pending_activate(call: CallbackQuery, orders: OrderRepository, outbox: OutboxWorker):
+        markup = call.message.reply_markup
+        selected = [
+            int(button.callback_data.rsplit(":", 1)[1])
+            for row in (markup.inline_keyboard if markup else [])
+            for button in row
+            if (button.callback_data or "").startswith("adm:sel:") and button.text.startswith(SELECTED)
+        ]
+        if not selected:
+            return await _answer(call, "Отметьте заказы в списке", alert=True)
+        # Одна транзакция на всю пачку; уведомления уходят через outbox с общим лимитом отправки
+        activated = await orders.transition_many(selected, ACTIVATED, activated_messages)
+        outbox.wake()
+        done = {order.id for order in activated}
+        await _answer(call, f"Активировано: {len(done)} из {len(selected)}")
+        rows = [
+            row for row in markup.inline_keyboard
+            if not any(button.callback_data in {f"adm:sel:{order_id}" for order_id in done} for button in row)
+        ]
+        status_line = f"\n\n✅ Активированы: {', '.join(f'#{order_id}' for order_id in sorted(done)) or '—'}"
+        with contextlib.suppress(Exception):
+            await call.message.edit_text(
+                (call.message.html_text or call.message.text or '') + status_line,
+                reply_markup=InlineKeyboardMarkup(inline_keyboard=rows),
+                parse_mode="HTML",
+            )
+
+    async def find_page(term: str, before_id: Optional[int], orders: OrderRepository):
+        page = await orders.find(term, before_id, PAGE_SIZE + 1)
+        has_next = len(page) > PAGE_SIZE
+        page = page[:PAGE_SIZE]
+        if not page:
+            return f"По запросу «{html.escape(term)}» ничего не найдено.", None
+        text = f"🔎 <b>{html.escape(term)}</b>\n\n" + "\n".join(format_order_line(order) for order in page)
+        callback = _find_callback(page[-1].id, term) if has_next else None
+        markup = None
+        if callback:
+            markup = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="Далее »", callback_data=callback)]])
+        return text, markup
+
+    @dp.message(Command("find"), admin)
+    async def find_cmd(m: Message, command: CommandObject, orders: OrderRepository):
+        term = (command.args or "").strip()
+        if not term:
+            await m.answer("Использование: /find &lt;логин, сервис или user id&gt;", parse_mode="HTML")
+            return
+        text, markup = await find_page(term, None, orders)
+        await m.answer(text, reply_markup=markup, parse_mode="HTML")
+
+    @dp.callback_query(F.data.startswith("adm:find:"), admin)
+    async def find_next(call: CallbackQuery, orders: OrderRepository):
+        _, _, raw, term = call.data.split(":", 3)
+        text, markup = await find_page(term, int(raw) if raw.isdigit() else None, orders)
+        await _answer(call)
+        await call.message.answer(text, reply_markup=markup, parse_mode="HTML")
+
+    @dp.message(Command("stats"), admin)
+    async def stats_cmd(m: Message, orders: OrderRepository):
+        now = time.time()
+        stats = await orders.stats([now - 86400, now - 7 * 86400])
+        (day_count, day_sum), (week_count, week_sum) = stats["paid"]
+        lines = ["📊 <b>Заказы</b>", ""]
+        lines += [f"{STATUS_LABELS.get(status, status)}: {count}" for status, count in sorted(stats["by_status"].items())]
+        lines += [
+            "",
+            f"Оплачено за 24 ч: {day_count} на {day_sum} ₽",
+            f"Оплачено за 7 дней: {week_count} на {week_sum} ₽",
+        ]
+        await m.answer("\n".join(lines), parse_mode="HTML")
+
+    @dp.message(Command("broadcast"), admin)
+    async def broadcast_cmd(m: Message, command: CommandObject, orders: OrderRepository):
+        text = (command.args or "").strip()
+        if not text:
+            latest = await orders.latest_broadcast()
+            if latest is None:
+                await m.answer(
+                    "Использование: /broadcast &lt;текст&gt; — сообщение всем клиентам, оформлявшим заказы.",
+                    parse_mode="HTML",
+                )
+                return
+            running = latest.status == BROADCAST_RUNNING
+            await m.answer(
+                broadcast_status_text(latest),
+                reply_markup=broadcast_keyboard(latest.id, running=True) if running else None,
+                parse_mode="HTML",
+            )
+            return
+        # Текст уходит как есть, без разметки — что видит менеджер, то получат клиенты
+        draft = await orders.create_broadcast(text)
+        await m.answer(f"Предпросмотр рассылки. Получателей: {draft.total}")
+        await m.answer(text, reply_markup=broadcast_keyboard(draft.id))
+
+    @dp.callback_query(F.data.startswith("adm:bc:"), admin)
+    async def broadcast_action(call: CallbackQuery, orders: OrderRepository, broadcaster: Broadcaster):
+        _, _, action, raw = call.data.split(":", 3)
+        broadcast_id = int(raw)
+        if action == "go":
+            broadcast = await orders.start_broadcast(broadcast_id)
+            if broadcast is None:
+                return await _answer(call, "Рассылка уже запущена или идёт другая — см. /broadcast", alert=True)
+            broadcaster.wake()
+            await _answer(call, "Рассылка запущена")
+            # Предпросмотр остаётся текстом рассылки, ход рассылки — отдельным сообщением
+            with contextlib.suppress(Exception):
+                await call.message.edit_reply_markup()
+            await call.message.answer(
+                broadcast_status_text(broadcast),
+                reply_markup=broadcast_keyboard(broadcast.id, running=True),
+                parse_mode="HTML",
+            )
+            return
+        if action == "drop":
+            await orders.cancel_broadcast(broadcast_id)
+            await _answer(call, "Рассылка отменена")
+            with contextlib.suppress(Exception):
+                await call.message.edit_reply_markup()
+            return
+        if action == "stop":
+            broadcast = await orders.cancel_broadcast(broadcast_id) or await orders.get_broadcast(broadcast_id)
+        else:
+            broadcast = await orders.get_broadcast(broadcast_id)
+        await _answer(call)
+        if broadcast is None:
+            return
+        running = broadcast.status == BROADCAST_RUNNING
+        with contextlib.suppress(Exception):
+            await call.message.edit_text(
+                broadcast_status_text(broadcast),
+                reply_markup=broadcast_keyboard(broadcast.id, running=True) if running else None,
+                parse_mode="HTML",
+            )
+
+    @dp.message(Command("profile"), admin)
+    async def profile_cmd(m: Message, command: CommandObject, profiler: SamplingProfiler):
+        raw = (command.args or "").strip().replace(",", ".")
+        try:
+            seconds = min(PROFILE_MAX_SECONDS, max(1.0, float(raw))) if raw else PROFILE_SECONDS
+        except ValueError:
+            await m.answer(f"Использование: /profile [секунд, до {PROFILE_MAX_SECONDS:.0f}]")
+            return
+        if profiler.busy:
+            await m.answer("Профиль уже снимается — дождитесь файла.")
+            return
+        await m.answer(f"⏱ Снимаю профиль {seconds:g} с…")
+        folded, counts = await profiler.profile(seconds)
+        await m.answer_document(
+            BufferedInputFile(folded.encode(), filename=f"profile-{time.strftime('%Y%m%d-%H%M%S')}.folded"),
+            caption=(
+                f"CPU-сэмплов: {counts['cpu']}, снимков задач: {counts['await']}.\n"
+                "Откройте в speedscope.app или flamegraph.pl: [cpu] — где занят цикл событий, [await] — где ждут задачи."
+            ),
+        )
@@ -0,0 +1,215 @@
+import asyncio
+import logging
+import re
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, Message
+
+from instrumentation import Counter
+from orders import OutboxItem
+from sender import PRIORITY_ADMIN, SendQueue
+
+
+log = logging.getLogger(__name__)
+
+ADMIN_FEED_TOTAL = Counter(
+    "bot_admin_feed_total",
+    "Admin chat notifications (entries) and the Telegram calls they took (messages, edits).",
+    ("kind",),
+)
+
+# Telegram режет текст после 4096 символов; HTML-разметка тоже занимает место
+MAX_DIGEST_CHARS = 3800
+_LABEL = re.compile(r"^(\d+)\. ")
+
+Rows = List[List[InlineKeyboardButton]]
+
+
+def _rows(markup: Optional[InlineKeyboardMarkup]) -> Rows:
+    return [list(row) for row in markup.inline_keyboard] if markup else []
+
+
+def render_digest(entries: List[OutboxItem]) -> Tuple[str, Rows]:
+    """One admin message for several notifications; buttons keep each entry's number."""
+    if len(entries) == 1:
+        entry = entries[0]
+        return entry.text, _rows(InlineKeyboardMarkup.model_validate(entry.reply_markup) if entry.reply_markup else None)
+    sections: List[str] = [f"📬 <b>Новых уведомлений: {len(entries)}</b>"]
+    rows: Rows = []
+    for number, entry in enumerate(entries, 1):
+        sections.append(f"<b>{number}.</b> {entry.text}")
+        markup = InlineKeyboardMarkup.model_validate(entry.reply_markup) if entry.reply_markup else None
+        for row in _rows(markup):
+            rows.append([button.model_copy(update={"text": f"{number}. {button.text}"}) for button in row])
+    return "\n\n".join(sections), rows
+
+
+def resolve_entry(text: str, rows: Rows, data: str, status_line: str) -> Optional[Tuple[str, Rows]]:
+    """Mark the entry whose button sent ``data`` as done: status line in, its buttons out.
+
+    None when the button is already gone (a second press before the edit landed).
+    """
+    pressed = next((button for row in rows for button in row if button.callback_data == data), None)
+    if pressed is None:
+        return None
+    match = _LABEL.match(pressed.text)
+    label = match.group(1) if match else None
+    if label is None:
+        # Одиночное уведомление: как раньше — строка статуса и без кнопок
+        return f"{text}\n\n{status_line}", []
+    prefix = f"{label}. "
+    remaining = [row for row in rows if not all(button.text.startswith(prefix) for button in row)]
+    return f"{text}\n\n{label}. {status_line}", remaining
+
+
+class AdminFeed:
+    """Coalesces admin chat notifications into digest messages.
+
+    The outbox hands over keyed admin messages (paid orders, payments from
+    the web app); everything submitted within ``window`` seconds goes out as
+    one message with every entry's action buttons, numbered. A submitted
+    future resolves when its digest is delivered, so the outbox marks the
+    entries sent only then and retries them on failure.
+
+    Button presses on a digest (activated, issue) become ``edit_message_text``
+    calls; several presses on one message within ``edit_window`` are
+    applied in a single edit.
+    """
+
+    # Сколько последних отрисованных сообщений помнить: нажатие могло прийти со старой копией
+    RENDERED_CACHE = 512
+
+    def __init__(
+        self,
+        sender: SendQueue,
+        bot: Bot,
+        admin_chat_id: str,
+        window: float = 3.0,
+        edit_window: float = 1.0,
+        max_entries: int = 10,
+    ) -> None:
+        self.sender = sender
+        self.bot = bot
+        self.admin_chat_id = str(admin_chat_id)
+        self.window = window
+        self.edit_window = edit_window
+        self.max_entries = max_entries
+        self._pending: List[Tuple[OutboxItem, asyncio.Future]] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._edits: Dict[Tuple[int, int], Tuple[str, Rows]] = {}
+        self._edit_task: Optional[asyncio.Task] = None
+        self._rendered: "OrderedDict[Tuple[int, int], Tuple[str, Rows]]" = OrderedDict()
+        self._sends: set = set()
+
+    def accepts(self, item: OutboxItem) -> bool:
+        return item.dedup_key is not None and str(item.chat_id) == self.admin_chat_id
+
+    # --- digests ---
+
+    def submit(self, item: OutboxItem) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+        ADMIN_FEED_TOTAL.inc("entries")
+        if self.window <= 0:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.window, self._flush)
+        return future
+
+    def _chunks(self) -> List[List[Tuple[OutboxItem, asyncio.Future]]]:
+        chunks: List[List[Tuple[OutboxItem, asyncio.Future]]] = []
+        size = 0
+        for pending in self._pending:
+            length = len(pending[0].text) + 16
+            if chunks and len(chunks[-1]) < self.max_entries and size + length <= MAX_DIGEST_CHARS:
+                chunks[-1].append(pending)
+                size += length
+            else:
+                chunks.append([pending])
+                size = length
+        return chunks
+
+    def _flush(self) -> None:
+        self._flush_handle = None
+        chunks, self._pending = self._chunks(), []
+        for chunk in chunks:
+            task = asyncio.create_task(self._send_digest(chunk))
+            self._sends.add(task)
+            task.add_done_callback(self._sends.discard)
+
+    async def _send_digest(self, chunk: List[Tuple[OutboxItem, asyncio.Future]]) -> None:
+        text, rows = render_digest([item for item, _ in chunk])
+        markup = InlineKeyboardMarkup(inline_keyboard=rows) if rows else None
+        parse_mode = "HTML" if len(chunk) > 1 else chunk[0][0].parse_mode
+        try:
+            message = await self.sender.send(
+                self.admin_chat_id, text, PRIORITY_ADMIN, parse_mode=parse_mode, reply_markup=markup
+            )
+        except Exception as exc:  # noqa: BLE001
+            for _, future in chunk:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        ADMIN_FEED_TOTAL.inc("messages")
+        if len(chunk) > 1:
+            log.info("Admin digest sent", extra={"entries": len(chunk), "message_id": message.message_id})
+        for _, future in chunk:
+            if not future.done():
+                future.set_result(message)
+
+    # --- edits ---
+
+    def _remember(self, key: Tuple[int, int], state: Tuple[str, Rows]) -> None:
+        self._rendered[key] = state
+        self._rendered.move_to_end(key)
+        while len(self._rendered) > self.RENDERED_CACHE:
+            self._rendered.popitem(last=False)
+
+    def resolve(self, message: Message, data: str, status_line: str) -> None:
+        """Apply a button press on an admin message: the status line goes in on the next edit."""
+        key = (message.chat.id, message.message_id)
+        state = self._edits.get(key) or self._rendered.get(key)
+        if state is None:
+            state = (message.html_text or message.text or "", _rows(message.reply_markup))
+        resolved = resolve_entry(*state, data, status_line)
+        if resolved is None:
+            return
+        self._edits[key] = resolved
+        if self._edit_task is None or self._edit_task.done():
+            self._edit_task = asyncio.create_task(self._apply_edits())
+
+    async def _apply_edits(self) -> None:
+        await asyncio.sleep(self.edit_window)
+        edits, self._edits = self._edits, {}
+        for (chat_id, message_id), (text, rows) in edits.items():
+            self._remember((chat_id, message_id), (text, rows))
+            try:
+                await self.bot.edit_message_text(
+                    text=text,
+                    chat_id=chat_id,
+                    message_id=message_id,
+                    parse_mode="HTML",
+                    reply_markup=InlineKeyboardMarkup(inline_keyboard=rows) if rows else None,
+                )
+            except Exception as exc:  # noqa: BLE001
+                log.warning("Admin message edit failed", extra={"message_id": message_id, "error": repr(exc)})
+                continue
+            ADMIN_FEED_TOTAL.inc("edits")
+        # Нажатия, пришедшие во время правок, — следующим заходом
+        if self._edits:
+            self._edit_task = asyncio.create_task(self._apply_edits())
+
+    # --- lifecycle ---
+
+    async def stop(self, timeout: float = 5.0) -> None:
+        # Отправляем накопленное сразу: outbox отметит доставку, а не повторит после рестарта
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+        if self._pending:
+            self._flush()
+        tasks = [task for task in (*self._sends, self._edit_task) if task is not None and not task.done()]
+        if tasks:
+            await asyncio.wait(tasks, timeout=timeout)
@@ -0,0 +1,149 @@
+import asyncio
+import contextlib
+import logging
+from typing import List, Optional
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+
+from orders import BROADCAST_CANCELED, BROADCAST_RUNNING, Broadcast, OrderRepository, OutgoingMessage
+from outbox import OutboxWorker
+from sender import PRIORITY_BULK, SendQueue, TokenBucket
+
+
+log = logging.getLogger(__name__)
+
+
+def _unreachable(exc: BaseException) -> bool:
+    # Бот заблокирован, аккаунт удалён или чат недоступен — повторять бессмысленно
+    if isinstance(exc, TelegramForbiddenError):
+        return True
+    return isinstance(exc, TelegramBadRequest) and "chat not found" in str(exc).lower()
+
+
+def broadcast_summary(broadcast: Broadcast) -> str:
+    head = "⏹ Рассылка остановлена" if broadcast.status == BROADCAST_CANCELED else "📣 Рассылка завершена"
+    return (
+        f"{head} (#{broadcast.id})\n\n"
+        f"Доставлено: {broadcast.sent} из {broadcast.total}\n"
+        f"Заблокировали бота: {broadcast.blocked}\n"
+        f"Ошибок: {broadcast.failed}"
+    )
+
+
+class Broadcaster:
+    """Sends admin announcements to every customer in the orders database.
+
+    Recipients are read in chunks of ``chunk_size`` by customer id, so a
+    broadcast to 100k chats holds one chunk in memory. Messages go through
+    the send queue's bulk lane (customers' order messages go first) at no
+    more than ``rate`` per second. After each chunk the cursor, counters and
+    chats that blocked the bot are saved in one transaction: after a crash or
+    redeploy the broadcast resumes from the last saved chunk, so at most one
+    chunk can be sent twice. A lease lets only one process (shard) run it.
+    """
+
+    def __init__(
+        self,
+        sender: SendQueue,
+        orders: OrderRepository,
+        outbox: OutboxWorker,
+        admin_chat_id: str,
+        rate: float = 20.0,
+        chunk_size: int = 100,
+        lease: float = 120.0,
+        idle_interval: float = 30.0,
+    ) -> None:
+        self.sender = sender
+        self.orders = orders
+        self.outbox = outbox
+        self.admin_chat_id = str(admin_chat_id)
+        self.bucket = TokenBucket(rate, 1)
+        self.chunk_size = chunk_size
+        self.lease = lease
+        self.idle_interval = idle_interval
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._task: Optional[asyncio.Task] = None
+
+    def wake(self) -> None:
+        self._wakeup.set()
+
+    async def _send_chunk(self, broadcast: Broadcast, recipients: List[int]):
+        futures = []
+        for chat_id in recipients:
+            delay = self.bucket.delay()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.bucket.take()
+            futures.append(self.sender.submit(chat_id, broadcast.text, PRIORITY_BULK))
+        results = await asyncio.gather(*futures, return_exceptions=True)
+        sent, failed, blocked = 0, 0, {}
+        for chat_id, result in zip(recipients, results):
+            if not isinstance(result, BaseException):
+                sent += 1
+            elif _unreachable(result):
+                blocked[chat_id] = str(result)[:200]
+            else:
+                failed += 1
+        return sent, failed, blocked
+
+    async def _deliver(self, broadcast: Broadcast) -> None:
+        log.info("Broadcast resumed" if broadcast.cursor else "Broadcast started", extra={
+            "broadcast_id": broadcast.id, "cursor": broadcast.cursor, "total": broadcast.total,
+        })
+        while not self._stopping:
+            recipients = await self.orders.broadcast_recipients(broadcast.cursor, self.chunk_size)
+            sent, failed, blocked = (0, 0, {}) if not recipients else await self._send_chunk(broadcast, recipients)
+            finished = not recipients or len(recipients) < self.chunk_size
+            broadcast = await self.orders.checkpoint_broadcast(
+                broadcast.id,
+                recipients[-1] if recipients else broadcast.cursor,
+                sent,
+                failed,
+                blocked,
+                self.lease,
+            )
+            if broadcast.status != BROADCAST_RUNNING or finished:
+                broadcast = await self.orders.checkpoint_broadcast(
+                    broadcast.id, broadcast.cursor, lease=0,
+                    finish=[OutgoingMessage(self.admin_chat_id, broadcast_summary(broadcast))],
+                )
+                self.outbox.wake()
+                log.info("Broadcast finished", extra={
+                    "broadcast_id": broadcast.id, "status": broadcast.status,
+                    "sent": broadcast.sent, "blocked": broadcast.blocked, "failed": broadcast.failed,
+                })
+                return
+        # Остановка процесса: снимаем аренду, чтобы после перезапуска продолжить сразу
+        await self.orders.checkpoint_broadcast(broadcast.id, broadcast.cursor, lease=0)
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            self._wakeup.clear()
+            try:
+                broadcast = await self.orders.claim_broadcast(self.lease)
+                if broadcast is not None:
+                    await self._deliver(broadcast)
+                    continue
+            except Exception:  # noqa: BLE001
+                log.exception("Broadcast worker error")
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wakeup.wait(), self.idle_interval)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        # Даём досылать текущую пачку, чтобы сохранить её прогресс
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        done, _ = await asyncio.wait([self._task], timeout=timeout)
+        if not done:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+        self._task = None
@@ -0,0 +1,288 @@
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import re
+import unicodedata
+from collections import defaultdict
+from dataclasses import dataclass
+from itertools import chain
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+
+log = logging.getLogger(__name__)
+
+DEFAULT_FIELDS = ("login", "password", "creator")
+_NOT_ALNUM = re.compile(r"[\W_]+")
+
+
+def normalize(text: str) -> str:
+    """Lookup form of a name: case, spaces and punctuation do not matter.
+
+    "ChatGPT Plus", "chat gpt plus" and "Chat-GPT+" all become "chatgptplus".
+    """
+    text = unicodedata.normalize("NFKC", text).casefold().replace("ё", "е")
+    return _NOT_ALNUM.sub("", text)
+
+
+def _words(text: str) -> List[str]:
+    text = unicodedata.normalize("NFKC", text).casefold().replace("ё", "е")
+    return [word for word in _NOT_ALNUM.split(text) if word]
+
+
+def _trigrams(key: str) -> set:
+    padded = f"  {key} "
+    return {padded[index:index + 3] for index in range(len(padded) - 2)}
+
+
+@dataclass(frozen=True, slots=True)
+class Service:
+    """A catalog entry: canonical name, spellings customers use and defaults for the wizard."""
+
+    id: str
+    name: str
+    aliases: Tuple[str, ...] = ()
+    price_usd: Optional[float] = None
+    url: Optional[str] = None
+    fields: Tuple[str, ...] = DEFAULT_FIELDS
+
+    def asks(self, field: str) -> bool:
+        return field in self.fields
+
+    @classmethod
+    def from_dict(cls, raw: Dict[str, Any]) -> "Service":
+        name = str(raw["name"]).strip()
+        # id уходит в callback_data (до 64 байт) — короткий и без двоеточий
+        service_id = normalize(str(raw.get("id") or name))[:32]
+        if not name or not service_id:
+            raise ValueError(f"service without a name: {raw!r}")
+        price = raw.get("price_usd")
+        return cls(
+            id=service_id,
+            name=name,
+            aliases=tuple(str(alias) for alias in raw.get("aliases") or ()),
+            price_usd=float(price) if price else None,
+            url=raw.get("url") or None,
+            fields=tuple(raw.get("fields") or DEFAULT_FIELDS),
+        )
+
+
+class _Node:
+    __slots__ = ("children", "top")
+
+    def __init__(self) -> None:
+        self.children: Dict[str, "_Node"] = {}
+        self.top: List[int] = []
+
+
+class ServiceIndex:
+    """Immutable lookup structures over a list of services.
+
+    * exact: normalized name or alias → service;
+    * prefix trie over the normalized name, aliases and every word start
+      in them ("gpt" finds "ChatGPT Plus"); each node keeps its best
+      ``top`` services, so a prefix lookup costs the length of the query;
+    * trigram index for typos ("chatgtp", "mijdourney"), scored by the
+      Dice coefficient; candidates come from the rarer trigrams of the
+      query only, which keeps a lookup well under a millisecond with
+      thousands of services.
+
+    Services are ranked by their order in the catalog file.
+    """
+
+    def __init__(self, services: Iterable[Service], top: int = 20) -> None:
+        self.services: List[Service] = []
+        self.top = top
+        self._by_id: Dict[str, int] = {}
+        self._exact: Dict[str, int] = {}
+        self._root = _Node()
+        self._keys: List[Tuple[int, frozenset]] = []
+        self._trigrams: Dict[str, List[int]] = defaultdict(list)
+        for service in services:
+            if service.id in self._by_id:
+                log.warning("Duplicate service id in catalog", extra={"service_id": service.id})
+                continue
+            rank = len(self.services)
+            self.services.append(service)
+            self._by_id[service.id] = rank
+            for spelling in (service.name, *service.aliases):
+                key = normalize(spelling)
+                if not key:
+                    continue
+                self._exact.setdefault(key, rank)
+                words = _words(spelling)
+                for start in range(len(words)):
+                    self._insert("".join(words[start:]), rank)
+                self._add_trigrams(key, rank)
+        self._trigrams = dict(self._trigrams)
+
+    def __len__(self) -> int:
+        return len(self.services)
+
+    def _insert(self, key: str, rank: int) -> None:
+        node = self._root
+        for char in key:
+            node = node.children.setdefault(char, _Node())
+            if len(node.top) < self.top and rank not in node.top:
+                node.top.append(rank)
+
+    def _add_trigrams(self, key: str, rank: int) -> None:
+        key_id = len(self._keys)
+        grams = frozenset(_trigrams(key))
+        self._keys.append((rank, grams))
+        for gram in grams:
+            self._trigrams[gram].append(key_id)
+
+    def get(self, service_id: str) -> Optional[Service]:
+        rank = self._by_id.get(service_id)
+        return None if rank is None else self.services[rank]
+
+    def match(self, text: str) -> Optional[Service]:
+        """Service whose name or alias is ``text`` up to case, spaces and punctuation."""
+        rank = self._exact.get(normalize(text))
+        return None if rank is None else self.services[rank]
+
+    def _prefix(self, key: str) -> List[int]:
+        node = self._root
+        for char in key:
+            node = node.children.get(char)
+            if node is None:
+                return []
+        return node.top
+
+    def _similar(self, key: str, min_score: float) -> List[int]:
+        grams = _trigrams(key)
+        postings = [posting for posting in (self._trigrams.get(gram) for gram in grams) if posting]
+        if not postings:
+            return []
+        # Кандидаты — только по редким триграммам: частые («pro», «pre», «ium») дают тысячи
+        # ключей, а совпадение по целому слову и так находит префиксное дерево
+        common = max(64, len(self._keys) // 64)
+        rare = [posting for posting in postings if len(posting) <= common] or [min(postings, key=len)]
+        best: Dict[int, float] = {}
+        for key_id in set(chain.from_iterable(rare)):
+            rank, key_grams = self._keys[key_id]
+            score = 2 * len(grams & key_grams) / (len(grams) + len(key_grams))
+            if score >= min_score and score > best.get(rank, 0.0):
+                best[rank] = score
+        return sorted(best, key=lambda rank: (-best[rank], rank))
+
+    def search(self, query: str, limit: int = 10, min_score: float = 0.35) -> List[Service]:
+        """Services for an autocomplete query: prefix matches first, then similar spellings."""
+        key = normalize(query)
+        if not key:
+            return self.services[:limit]
+        ranks = list(self._prefix(key)[:limit])
+        # Одна-две буквы — только префикс: у коротких строк триграммы совпадают случайно
+        if len(ranks) < limit and len(key) >= 3:
+            seen = set(ranks)
+            ranks.extend(rank for rank in self._similar(key, min_score) if rank not in seen)
+        return [self.services[rank] for rank in ranks[:limit]]
+
+
+def load_services(path: str) -> List[Service]:
+    with open(path, encoding="utf-8") as fh:
+        raw = json.load(fh)
+    return [Service.from_dict(entry) for entry in (raw["services"] if isinstance(raw, dict) else raw)]
+
+
+class ServiceCatalog:
+    """The service catalog loaded from a JSON file, reloaded when the file changes.
+
+    A new :class:`ServiceIndex` is built in a worker thread and replaces the
+    current one in a single assignment, so lookups never see a half-built
+    index; a broken file keeps the previous catalog. An empty catalog (no
+    file) turns suggestions off and the wizard accepts free text as before.
+    """
+
+    def __init__(self, path: str, interval: float = 5.0) -> None:
+        self.path = path
+        self.interval = interval
+        self.index = ServiceIndex(())
+        self._mtime: Optional[int] = None
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._subscribers: List[Callable[["ServiceCatalog"], Any]] = []
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __bool__(self) -> bool:
+        # Компонент есть и без файла каталога: пустой не должен быть «ложным» из-за __len__
+        return True
+
+    def subscribe(self, callback: Callable[["ServiceCatalog"], Any]) -> None:
+        """Call ``callback(catalog)`` whenever a new catalog replaces the current one."""
+        self._subscribers.append(callback)
+
+    def _notify(self) -> None:
+        for callback in self._subscribers:
+            try:
+                callback(self)
+            except Exception:  # noqa: BLE001
+                log.exception("Service catalog subscriber failed")
+
+    def prices(self) -> List[float]:
+        return [service.price_usd for service in self.index.services if service.price_usd]
+
+    def get(self, service_id: str) -> Optional[Service]:
+        return self.index.get(service_id)
+
+    def match(self, text: Optional[str]) -> Optional[Service]:
+        return self.index.match(text) if text else None
+
+    def search(self, query: str, limit: int = 10) -> List[Service]:
+        return self.index.search(query, limit)
+
+    def _stat(self) -> Optional[int]:
+        if not self.path:
+            return None
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def load(self) -> bool:
+        """Re-read the file if it changed; True if the catalog was replaced."""
+        mtime = self._stat()
+        if mtime == self._mtime:
+            return False
+        self._mtime = mtime
+        if mtime is None:
+            if self.path:
+                log.warning("Service catalog not found", extra={"path": self.path})
+            self.index = ServiceIndex(())
+            return True
+        try:
+            index = ServiceIndex(load_services(self.path))
+        except Exception:  # noqa: BLE001
+            log.exception("Service catalog reload failed, keeping the current catalog", extra={"path": self.path})
+            return False
+        self.index = index
+        log.info("Service catalog loaded", extra={"path": self.path, "services": len(index)})
+        return True
+
+    def wake(self) -> None:
+        self._wakeup.set()
+
+    async def _run(self) -> None:
+        while True:
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wakeup.wait(), self.interval or None)
+            self._wakeup.clear()
+            if await asyncio.to_thread(self.load):
+                self._notify()
+
+    def start(self) -> None:
+        if self.load():
+            self._notify()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
@@ -1,10 +1,19 @@
+import asyncio
+import contextlib
+import inspect
+import logging
 import os
-from dataclasses import dataclass
-from dotenv import load_dotenv
+import signal
+from dataclasses import dataclass, fields
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import urlsplit
 
-load_dotenv()
+from dotenv import dotenv_values, find_dotenv
 
-@dataclass
+
+log = logging.getLogger(__name__)
+
+@dataclass(frozen=True)
 class Settings:
     bot_token: str
     admin_chat_id: str  # allow @channelusername or numeric id
@@ -13,24 +22,224 @@ class Settings:
     payments_base_url: str
     support_url: str | None
     privacy_url: str
+    rate_ttl: float
+    rate_max_staleness: float
+    rate_hedge_delay: float
+    rate_urls: tuple[str, ...]
+    usd_rub_rate_fallback: float | None
+    http_max_connections: int
+    http_max_keepalive: int
+    http_keepalive_expiry: float
+    payment_poll_first_delay: float
+    payment_poll_max_delay: float
+    payment_poll_max_age: float
+    payment_poll_concurrency: int
+    payment_status_batch: bool
+    bot_events_token: str
+    bot_events_host: str
+    bot_events_port: int
+    payment_event_deadline: float
+    fsm_storage: str
+    fsm_sqlite_path: str
+    redis_url: str
+    fsm_ttl: float | None
+    secret_ttl: float
+    orders_db_path: str
+    service_catalog_path: str
+    tg_global_rate: float
+    tg_chat_rate: float
+    tg_group_rate: float
+    broadcast_rate: float
+    admin_digest_window: float
+    renewal_remind_days: float
+    bot_mode: str
+    webhook_url: str
+    webhook_path: str
+    webhook_secret: str
+    webhook_host: str
+    webhook_port: int
+    webhook_workers: int
+    webhook_queue_size: int
+    pricing_delta_rate: float
+    pricing_fixed_fee: float
+    pricing_base_commission: float
+    pricing_commission_per_usd: float
+    log_level: str
+    log_sample_rate: float
+    slow_span_seconds: float
+    loop_lag_threshold: float
+    profile_dir: str
+    metrics_host: str
+    metrics_port: int
+    throttle_rate: float
+    throttle_burst: float
+    shutdown_timeout: float
+    payment_resume_rate: float
+    bot_shards: int
+    shard_index: int | None
+    shard_base_port: int
+    shard_token: str
+    settings_reload_interval: float
+
+
+# Применяются только при перезапуске: на них построены соединения, серверы и хранилища
+RESTART_FIELDS = frozenset({
+    "bot_token", "http_max_connections", "http_max_keepalive", "http_keepalive_expiry",
+    "payment_poll_concurrency", "bot_events_token", "bot_events_host", "bot_events_port",
+    "fsm_storage", "fsm_sqlite_path", "redis_url", "fsm_ttl", "orders_db_path",
+    "tg_global_rate", "tg_chat_rate", "tg_group_rate", "bot_mode", "webhook_url", "webhook_path",
+    "webhook_secret", "webhook_host", "webhook_port", "webhook_workers", "webhook_queue_size",
+    "metrics_host", "metrics_port", "payment_resume_rate", "bot_shards", "shard_index",
+    "shard_base_port", "shard_token", "settings_reload_interval", "rate_urls",
+})
+
+_env_path: Optional[str] = None
+_current: Optional[Settings] = None
+# .env, каким он был при первом чтении: по нему видно, какие переменные окружения пришли из файла
+_startup_dotenv: Optional[Dict[str, str]] = None
+
+
+def env_path() -> str:
+    """The .env file: ``ENV_FILE`` or the nearest one found from this directory up."""
+    global _env_path
+    if _env_path is None:
+        _env_path = os.environ.get("ENV_FILE") or find_dotenv()
+    return _env_path
+
+
+def _environ() -> Dict[str, str]:
+    """Process environment over the .env file, as ``load_dotenv()`` would do it.
+
+    A variable whose value the environment got from the .env file itself
+    (``env_file`` in docker-compose copies the file into the environment
+    at start) does not count as an override: on reload it follows the
+    file, including being dropped when the file no longer sets it.
+    """
+    global _startup_dotenv
+    path = env_path()
+    values = {key: value for key, value in dotenv_values(path).items() if value is not None} if path else {}
+    if _startup_dotenv is None:
+        _startup_dotenv = dict(values)
+    for key, value in os.environ.items():
+        if _startup_dotenv.get(key) == value:
+            continue
+        values[key] = value
+    return values
 
 
 def get_settings() -> Settings:
-    token = os.getenv("BOT_TOKEN", "")
-    admin = os.getenv("ADMIN_CHAT_ID", "").strip()
-    webapp = os.getenv("NEXT_PUBLIC_WEBAPP_URL", "http://localhost:3000/tg")
-    start_image = os.getenv("START_CARD_IMAGE_URL") or None
-    payments_base = (os.getenv("PAYMENTS_API_BASE", "http://localhost:3000").rstrip('/'))
+    """Current settings snapshot; the environment is read once, not on every call."""
+    global _current
+    if _current is None:
+        _current = load_settings()
+    return _current
+
+
+def load_settings() -> Settings:
+    env = _environ()
+    token = env.get("BOT_TOKEN", "")
+    admin = env.get("ADMIN_CHAT_ID", "").strip()
+    webapp = env.get("NEXT_PUBLIC_WEBAPP_URL", "http://localhost:3000/tg")
+    start_image = env.get("START_CARD_IMAGE_URL") or None
+    payments_base = (env.get("PAYMENTS_API_BASE", "http://localhost:3000").rstrip('/'))
     # Support link: explicit SUPPORT_URL or derive from @username in ADMIN_CHAT_ID
-    support_env = os.getenv("SUPPORT_URL", "").strip()
+    support_env = env.get("SUPPORT_URL", "").strip()
     # При отсутствии явного SUPPORT_URL пытаемся построить из @username,
     # иначе используем дефолт на @aibazaru
     support_url = support_env or (f"https://t.me/{admin[1:]}" if admin.startswith('@') else "https://t.me/aibazaru")
     # Privacy URL: explicit PRIVACY_URL or derive from webapp base
-    from urllib.parse import urlsplit
     ws = urlsplit(webapp)
     base = f"{ws.scheme}://{ws.netloc}" if ws.scheme and ws.netloc else payments_base
-    privacy_url = os.getenv("PRIVACY_URL", "").strip() or f"{base}/privacy"
+    privacy_url = env.get("PRIVACY_URL", "").strip() or f"{base}/privacy"
+    # Кэш курса USD/RUB: свежий в течение RATE_TTL, допустимый для расчёта до RATE_MAX_STALENESS
+    rate_ttl = float(env.get("RATE_TTL", "300"))
+    rate_max_staleness = float(env.get("RATE_MAX_STALENESS", "3600"))
+    # Через сколько секунд без ответа запрашивать курс у следующего провайдера
+    rate_hedge_delay = float(env.get("RATE_HEDGE_DELAY", "0.5"))
+    # Свои источники курса через запятую (пусто — встроенный список)
+    rate_urls = tuple(url.strip() for url in env.get("RATE_URLS", "").split(",") if url.strip())
+    # Курс на случай недоступности всех провайдеров (та же переменная, что у веб-приложения)
+    usd_rub_rate_fallback = float(env.get("USD_RUB_RATE_FALLBACK") or 0) or None
+    # Пул соединений общего HTTP-клиента бота
+    http_max_connections = int(env.get("HTTP_MAX_CONNECTIONS", "100"))
+    http_max_keepalive = int(env.get("HTTP_MAX_KEEPALIVE", "20"))
+    http_keepalive_expiry = float(env.get("HTTP_KEEPALIVE_EXPIRY", "30"))
+    # Общий планировщик проверки статусов платежей ЮKassa
+    payment_poll_first_delay = float(env.get("PAYMENT_POLL_FIRST_DELAY", "3"))
+    payment_poll_max_delay = float(env.get("PAYMENT_POLL_MAX_DELAY", "60"))
+    payment_poll_max_age = float(env.get("PAYMENT_POLL_MAX_AGE", "900"))
+    payment_poll_concurrency = int(env.get("PAYMENT_POLL_CONCURRENCY", "8"))
+    payment_status_batch = env.get("PAYMENT_STATUS_BATCH", "1") == "1"
+    # Канал событий оплаты от вебхука веб-приложения; без токена слушатель не запускается
+    bot_events_token = env.get("BOT_EVENTS_TOKEN", "").strip()
+    bot_events_host = env.get("BOT_EVENTS_HOST", "0.0.0.0")
+    bot_events_port = int(env.get("BOT_EVENTS_PORT", "8081"))
+    # Сколько ждать события до первого опроса статуса
+    payment_event_deadline = float(env.get("PAYMENT_EVENT_DEADLINE", "30"))
+    # Хранилище диалога оформления заказа: memory | sqlite | redis
+    fsm_storage = env.get("FSM_STORAGE", "sqlite").strip().lower()
+    fsm_sqlite_path = env.get("FSM_SQLITE_PATH", "data/fsm.sqlite3")
+    redis_url = env.get("REDIS_URL", "redis://localhost:6379/0")
+    # Брошенные незавершённые заказы удаляются через FSM_TTL секунд (0 — не удалять)
+    fsm_ttl = float(env.get("FSM_TTL", "86400")) or None
+    # Сколько пароль из диалога живёт в памяти до оплаты (секунды): минуты, а не срок всей сессии
+    secret_ttl = float(env.get("SECRET_TTL") or 1800)
+    # База заказов и очереди уведомлений (outbox)
+    orders_db_path = env.get("ORDERS_DB_PATH", "data/orders.sqlite3")
+    # Каталог сервисов для подсказок в диалоге (перечитывается при изменении файла; пусто — без каталога)
+    service_catalog_path = env.get("SERVICE_CATALOG_PATH", "services.json").strip()
+    # Лимиты исходящих сообщений Telegram (сообщений в секунду)
+    tg_global_rate = float(env.get("TG_GLOBAL_RATE", "30"))
+    tg_chat_rate = float(env.get("TG_CHAT_RATE", "1"))
+    tg_group_rate = float(env.get("TG_GROUP_RATE_PER_MIN", "20")) / 60
+    # Рассылки /broadcast идут не быстрее этого (сообщений в секунду), остаток лимита — заказам
+    broadcast_rate = float(env.get("BROADCAST_RATE", "20"))
+    # Уведомления об оплатах за это окно (секунды) уходят менеджеру одним сообщением (0 — каждое сразу)
+    admin_digest_window = float(env.get("ADMIN_DIGEST_WINDOW", "3"))
+    # За сколько дней до окончания подписки напомнить о продлении (0 — не напоминать)
+    renewal_remind_days = float(env.get("RENEWAL_REMIND_DAYS", "3"))
+    # Режим получения обновлений: polling (по умолчанию) или webhook
+    bot_mode = env.get("BOT_MODE", "polling").strip().lower()
+    webhook_url = env.get("WEBHOOK_URL", "").strip()
+    webhook_path = env.get("WEBHOOK_PATH", "/bot/webhook")
+    webhook_secret = env.get("WEBHOOK_SECRET", "").strip()
+    webhook_host = env.get("WEBHOOK_HOST", "0.0.0.0")
+    webhook_port = int(env.get("WEBHOOK_PORT", "8080"))
+    webhook_workers = int(env.get("WEBHOOK_WORKERS", "16"))
+    webhook_queue_size = int(env.get("WEBHOOK_QUEUE_SIZE", "256"))
+    if bot_mode == "webhook" and not (webhook_url and webhook_secret):
+        raise RuntimeError("WEBHOOK_URL and WEBHOOK_SECRET are required for BOT_MODE=webhook")
+    # Параметры формулы цены — те же переменные читает веб-приложение (lib/pricing.ts)
+    pricing_delta_rate = float(env.get("PRICING_DELTA_RATE") or 4)
+    pricing_fixed_fee = float(env.get("PRICING_FIXED_FEE") or 750)
+    pricing_base_commission = float(env.get("PRICING_BASE_COMMISSION") or 0.03)
+    pricing_commission_per_usd = float(env.get("PRICING_COMMISSION_PER_USD") or 0.001)
+    # Структурные логи: уровень и доля успешных спанов в логе (ошибки и медленные — всегда)
+    log_level = env.get("LOG_LEVEL", "INFO").strip().upper()
+    log_sample_rate = float(env.get("LOG_SAMPLE_RATE", "0.1"))
+    slow_span_seconds = float(env.get("SLOW_SPAN_SECONDS", "1"))
+    # Задержка цикла событий, после которой в лог пишется, чей код его держал (0 — не писать)
+    loop_lag_threshold = float(env.get("LOOP_LAG_THRESHOLD", "0.1"))
+    # Куда писать профили, снятые по SIGUSR1
+    profile_dir = env.get("PROFILE_DIR", "data/profiles")
+    # Эндпоинт Prometheus /metrics (0 — не запускать)
+    metrics_host = env.get("METRICS_HOST", "0.0.0.0")
+    metrics_port = int(env.get("METRICS_PORT", "9102"))
+    # Антифлуд: сколько апдейтов в секунду (и пачкой) принимаем от одного пользователя
+    throttle_rate = float(env.get("THROTTLE_RATE", "2"))
+    throttle_burst = float(env.get("THROTTLE_BURST", "5"))
+    # Сколько ждать завершения обработчиков и очередей при остановке (SIGTERM)
+    shutdown_timeout = float(env.get("SHUTDOWN_TIMEOUT", "20"))
+    # Скорость возобновления проверок неоплаченных счетов после рестарта (счетов в секунду)
+    payment_resume_rate = float(env.get("PAYMENT_RESUME_RATE", "20"))
+    # Шардирование: BOT_SHARDS > 1 — intake-процесс и столько же воркеров, апдейты по user id
+    bot_shards = max(1, int(env.get("BOT_SHARDS", "1")))
+    shard_index_env = env.get("BOT_SHARD_INDEX", "").strip()
+    shard_index = int(shard_index_env) if shard_index_env else None
+    shard_base_port = int(env.get("BOT_SHARD_PORT", "8100"))
+    shard_token = env.get("BOT_SHARD_TOKEN", "").strip()
+    # Как часто проверять изменение .env (0 — только по SIGHUP)
+    settings_reload_interval = float(env.get("SETTINGS_RELOAD_INTERVAL", "5"))
     if not token:
         raise RuntimeError("BOT_TOKEN is required")
     if not admin:
@@ -44,4 +253,147 @@ def get_settings() -> Settings:
         payments_base_url=payments_base,
         support_url=support_url,
         privacy_url=privacy_url,
+        rate_ttl=rate_ttl,
+        rate_max_staleness=rate_max_staleness,
+        rate_hedge_delay=rate_hedge_delay,
+        rate_urls=rate_urls,
+        usd_rub_rate_fallback=usd_rub_rate_fallback,
+        http_max_connections=http_max_connections,
+        http_max_keepalive=http_max_keepalive,
+        http_keepalive_expiry=http_keepalive_expiry,
+        payment_poll_first_delay=payment_poll_first_delay,
+        payment_poll_max_delay=payment_poll_max_delay,
+        payment_poll_max_age=payment_poll_max_age,
+        payment_poll_concurrency=payment_poll_concurrency,
+        payment_status_batch=payment_status_batch,
+        bot_events_token=bot_events_token,
+        bot_events_host=bot_events_host,
+        bot_events_port=bot_events_port,
+        payment_event_deadline=payment_event_deadline,
+        fsm_storage=fsm_storage,
+        fsm_sqlite_path=fsm_sqlite_path,
+        redis_url=redis_url,
+        fsm_ttl=fsm_ttl,
+        secret_ttl=secret_ttl,
+        orders_db_path=orders_db_path,
+        service_catalog_path=service_catalog_path,
+        tg_global_rate=tg_global_rate,
+        tg_chat_rate=tg_chat_rate,
+        tg_group_rate=tg_group_rate,
+        broadcast_rate=broadcast_rate,
+        admin_digest_window=admin_digest_window,
+        renewal_remind_days=renewal_remind_days,
+        bot_mode=bot_mode,
+        webhook_url=webhook_url,
+        webhook_path=webhook_path,
+        webhook_secret=webhook_secret,
+        webhook_host=webhook_host,
+        webhook_port=webhook_port,
+        webhook_workers=webhook_workers,
+        webhook_queue_size=webhook_queue_size,
+        pricing_delta_rate=pricing_delta_rate,
+        pricing_fixed_fee=pricing_fixed_fee,
+        pricing_base_commission=pricing_base_commission,
+        pricing_commission_per_usd=pricing_commission_per_usd,
+        log_level=log_level,
+        log_sample_rate=log_sample_rate,
+        slow_span_seconds=slow_span_seconds,
+        loop_lag_threshold=loop_lag_threshold,
+        profile_dir=profile_dir,
+        metrics_host=metrics_host,
+        metrics_port=metrics_port,
+        throttle_rate=throttle_rate,
+        throttle_burst=throttle_burst,
+        shutdown_timeout=shutdown_timeout,
+        payment_resume_rate=payment_resume_rate,
+        bot_shards=bot_shards,
+        shard_index=shard_index,
+        shard_base_port=shard_base_port,
+        shard_token=shard_token,
+        settings_reload_interval=settings_reload_interval,
     )
+
+
+SettingsCallback = Callable[[Settings], Any]
+
+
+class SettingsWatcher:
+    """Reloads the settings snapshot on SIGHUP or when the .env file changes.
+
+    A new snapshot is built completely before it replaces the current one,
+    so a broken .env keeps the old settings. Subscribers (cached keyboards,
+    HTTP client, limits) get the new snapshot; fields in ``RESTART_FIELDS``
+    are only logged, the process must be restarted for them.
+    """
+
+    def __init__(self, interval: float = 5.0) -> None:
+        self.interval = interval
+        self._subscribers: List[SettingsCallback] = []
+        self._signal = asyncio.Event()
+        self._mtime = self._stat()
+        self._task: Optional[asyncio.Task] = None
+
+    def subscribe(self, callback: SettingsCallback) -> None:
+        self._subscribers.append(callback)
+
+    @staticmethod
+    def _stat() -> Optional[int]:
+        path = env_path()
+        if not path:
+            return None
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    async def reload(self) -> bool:
+        """Re-read the environment; True if the snapshot changed."""
+        global _current
+        old = get_settings()
+        try:
+            new = load_settings()
+        except Exception:  # noqa: BLE001
+            log.exception("Settings reload failed, keeping the current settings")
+            return False
+        changed = [field.name for field in fields(Settings) if getattr(old, field.name) != getattr(new, field.name)]
+        if not changed:
+            return False
+        _current = new
+        log.info("Settings reloaded", extra={"changed": changed})
+        restart = sorted(RESTART_FIELDS.intersection(changed))
+        if restart:
+            log.warning("Changed settings take effect after a restart", extra={"fields": restart})
+        for callback in self._subscribers:
+            try:
+                result = callback(new)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception:  # noqa: BLE001
+                log.exception("Settings subscriber failed")
+        return True
+
+    async def _run(self) -> None:
+        while True:
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._signal.wait(), self.interval or None)
+            signaled = self._signal.is_set()
+            self._signal.clear()
+            mtime = self._stat()
+            if signaled or mtime != self._mtime:
+                self._mtime = mtime
+                await self.reload()
+
+    def start(self) -> None:
+        with contextlib.suppress(NotImplementedError):
+            asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, self._signal.set)
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        with contextlib.suppress(NotImplementedError, AttributeError):
+            asyncio.get_running_loop().remove_signal_handler(signal.SIGHUP)
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
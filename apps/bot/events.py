@@ -0,0 +1,91 @@
+import hmac
+from typing import Any, Callable, Dict, Optional
+
+from aiohttp import web
+
+from orders import EXPIRED, InvalidTransition, Order, OrderRepository, OutgoingMessage
+from outbox import OutboxWorker
+from payments import FINAL_STATUSES, PaymentPoller, StatusHandler
+
+
+EVENTS_TOKEN_HEADER = "X-Bot-Events-Token"
+
+
+def build_events_app(
+    poller: PaymentPoller,
+    token: str,
+    orders: OrderRepository,
+    outbox: OutboxWorker,
+    payment_handler: Callable[[Order], StatusHandler],
+) -> web.Application:
+    """Local push channel: the web app's YooKassa webhook forwards payment
+    events here so the pending payment resolves without waiting for a poll.
+
+    ``/events/payment`` responds ``{"handled": true}`` when the bot owned the
+    payment and has notified the customer and admin itself; that includes
+    orders whose polling already gave up (``expired``), which are finished
+    through ``payment_handler``. Payments the bot
+    does not own are posted to ``/events/admin``: the admin message joins the
+    bot's digest, once per payment id (``{"duplicate": true}`` if the bot
+    already has a notification for it).
+    """
+
+    def authorized(request: web.Request) -> bool:
+        return hmac.compare_digest(request.headers.get(EVENTS_TOKEN_HEADER, ""), token)
+
+    async def read_object(request: web.Request) -> Optional[Dict[str, Any]]:
+        try:
+            body = await request.json()
+        except ValueError:
+            return None
+        return body if isinstance(body, dict) else None
+
+    async def payment_event(request: web.Request) -> web.Response:
+        if not authorized(request):
+            return web.json_response({"error": "unauthorized"}, status=401)
+        body = await read_object(request)
+        if body is None:
+            return web.json_response({"error": "bad json"}, status=400)
+        payment_id = str(body.get("paymentId") or "")
+        status = body.get("status")
+        if not payment_id or status not in FINAL_STATUSES:
+            return web.json_response({"handled": False})
+        handled = await poller.resolve(payment_id, status)
+        if not handled:
+            # Опрос мог сдаться раньше, чем пришла оплата: такой заказ ждёт в EXPIRED
+            order = await orders.by_payment(payment_id)
+            if order is not None and order.status == EXPIRED:
+                try:
+                    await payment_handler(order)(status)
+                    handled = True
+                except InvalidTransition:
+                    # Другой воркер уже перевёл заказ по тому же событию
+                    pass
+        return web.json_response({"handled": handled})
+
+    async def admin_event(request: web.Request) -> web.Response:
+        if not authorized(request):
+            return web.json_response({"error": "unauthorized"}, status=401)
+        body = await read_object(request)
+        if body is None:
+            return web.json_response({"error": "bad json"}, status=400)
+        payment_id = str(body.get("paymentId") or "")
+        text = body.get("text")
+        if not payment_id or not isinstance(text, str) or not text:
+            return web.json_response({"error": "paymentId and text are required"}, status=400)
+        queued = await orders.enqueue([OutgoingMessage(
+            outbox.admin_chat_id,
+            text,
+            parse_mode="HTML",
+            reply_markup=body.get("replyMarkup") or None,
+            dedup_key=f"payment:{payment_id}",
+        )])
+        if queued:
+            outbox.wake()
+        return web.json_response({"queued": True, "duplicate": not queued})
+
+    app = web.Application()
+    app.router.add_post("/events/payment", payment_event)
+    app.router.add_post("/events/admin", admin_event)
+    return app
+
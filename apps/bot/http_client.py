@@ -0,0 +1,45 @@
+import importlib.util
+
+import httpx
+
+from instrumentation import InstrumentedTransport
+
+
+# Таймауты по эндпоинтам: создание счёта ходит в ЮKassa и может быть долгим,
+# проверка статуса и курс должны отвечать быстро.
+TIMEOUTS = {
+    "create": httpx.Timeout(15.0, connect=5.0),
+    "status": httpx.Timeout(10.0, connect=3.0),
+    "rates": httpx.Timeout(5.0, connect=3.0),
+}
+
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+def build_http_client(settings) -> httpx.AsyncClient:
+    """Long-lived keep-alive client shared by every bot → web API call.
+
+    Relative URLs resolve against ``settings.payments_base_url``; absolute
+    URLs (exchange-rate providers) go through the same connection pool.
+    Every request is timed into ``bot_http_request_seconds``.
+    """
+    limits = httpx.Limits(
+        max_connections=settings.http_max_connections,
+        max_keepalive_connections=settings.http_max_keepalive,
+        keepalive_expiry=settings.http_keepalive_expiry,
+    )
+    transport = httpx.AsyncHTTPTransport(limits=limits, http2=HTTP2_AVAILABLE)
+    return httpx.AsyncClient(
+        base_url=settings.payments_base_url,
+        timeout=TIMEOUTS["status"],
+        transport=InstrumentedTransport(transport, httpx.URL(settings.payments_base_url).host),
+        headers={"Content-Type": "application/json"},
+    )
+
+
+def retarget_http_client(client: httpx.AsyncClient, base_url: str) -> None:
+    """Point an existing client at a new web API base without dropping its pool."""
+    client.base_url = base_url
+    transport = client._transport  # у httpx нет публичного доступа к транспорту
+    if isinstance(transport, InstrumentedTransport):
+        transport.base_host = httpx.URL(base_url).host
@@ -0,0 +1,308 @@
+import bisect
+import contextlib
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import httpx
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiohttp import web
+
+
+log = logging.getLogger("bot.spans")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Доля успешных спанов, попадающих в лог; ошибки и медленные спаны пишутся всегда
+SAMPLE_RATE = 1.0
+SLOW_SECONDS = 1.0
+
+# --- logging ---
+
+_RECORD_ATTRS = set(logging.LogRecord("", 0, "", 0, "", None, None).__dict__) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; ``extra={...}`` fields become top-level keys."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def setup_logging(level: str = "INFO", sample_rate: float = 1.0, slow_seconds: float = 1.0) -> logging.handlers.QueueListener:
+    """Route all logging through an in-memory queue to a stdout writer thread.
+
+    The event loop only appends records to the queue; formatting and the
+    blocking write happen in the listener thread. Call ``stop()`` on the
+    returned listener at shutdown to flush what is left.
+    """
+    records: queue.SimpleQueue = queue.SimpleQueue()
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(JsonFormatter())
+    listener = logging.handlers.QueueListener(records, stream)
+    logging.getLogger().handlers = [logging.handlers.QueueHandler(records)]
+    configure_logging(level, sample_rate, slow_seconds)
+    listener.start()
+    return listener
+
+
+def configure_logging(level: str = "INFO", sample_rate: float = 1.0, slow_seconds: float = 1.0) -> None:
+    """Level and span sampling; safe to call again when settings are reloaded."""
+    global SAMPLE_RATE, SLOW_SECONDS
+    SAMPLE_RATE = sample_rate
+    SLOW_SECONDS = slow_seconds
+    root = logging.getLogger()
+    root.setLevel(level.upper())
+    # Построчные логи каждого запроса/апдейта заменены спанами с семплированием
+    for noisy in ("httpx", "aiogram.event"):
+        logging.getLogger(noisy).setLevel(max(logging.WARNING, root.level))
+
+
+# --- metrics ---
+
+
+def _labels(names: Sequence[str], values: Sequence[Any]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[Any, ...], float] = {}
+        REGISTRY.append(self)
+
+    def inc(self, *labels: Any, amount: float = 1.0) -> None:
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in self._values.items():
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [счётчики по корзинам (+Inf последней), сумма]
+        self._series: Dict[Tuple[Any, ...], List[Any]] = {}
+        REGISTRY.append(self)
+
+    def observe(self, value: float, *labels: Any) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        names = self.labelnames + ("le",)
+        for labels, (counts, total) in self._series.items():
+            cumulative = 0
+            for le, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(names, labels + (le,))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+REGISTRY: List[Any] = []
+# По имени: повторная сборка приложения заменяет коллектор, а не дублирует серии
+COLLECTORS: Dict[str, Callable[[], List[str]]] = {}
+
+HANDLER_SECONDS = Histogram(
+    "bot_handler_seconds",
+    "Update handler latency by handler (order funnel step) and outcome.",
+    ("handler", "outcome"),
+)
+SPAN_SECONDS = Histogram("bot_span_seconds", "Timed operations inside handlers.", ("span", "outcome"))
+HTTP_SECONDS = Histogram("bot_http_request_seconds", "Outgoing HTTP requests by endpoint.", ("endpoint", "status"))
+TELEGRAM_SECONDS = Histogram("bot_telegram_request_seconds", "Telegram Bot API calls by method.", ("method", "outcome"))
+FUNNEL_TOTAL = Counter("bot_order_funnel_total", "Orders reaching each funnel step.", ("step",))
+
+
+def render_metrics() -> str:
+    lines: List[str] = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    for collect in COLLECTORS.values():
+        lines.extend(collect())
+    return "\n".join(lines) + "\n"
+
+
+def register_collector(name: str, collect: Callable[[], List[str]]) -> None:
+    """Add a text-format collector, replacing the one already registered under ``name``."""
+    COLLECTORS[name] = collect
+
+
+def _finish_span(histogram: Histogram, name: str, started: float, error: Optional[BaseException], **fields: Any) -> None:
+    elapsed = time.perf_counter() - started
+    outcome = "error" if error is not None else "ok"
+    histogram.observe(elapsed, name, outcome)
+    if error is not None:
+        log.warning("%s failed", name, extra={"span": name, "duration": round(elapsed, 4), "error": repr(error), **fields})
+    elif elapsed >= SLOW_SECONDS or random.random() < SAMPLE_RATE:
+        log.info("%s", name, extra={"span": name, "duration": round(elapsed, 4), **fields})
+
+
+@contextlib.contextmanager
+def span(name: str, **fields: Any) -> Iterator[None]:
+    """Time a block into ``bot_span_seconds{span=name}`` and log it (sampled)."""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception as exc:
+        _finish_span(SPAN_SECONDS, name, started, exc, **fields)
+        raise
+    _finish_span(SPAN_SECONDS, name, started, None, **fields)
+
+
+class HandlerTimingMiddleware(BaseMiddleware):
+    """Inner middleware: one histogram series per handler, i.e. per wizard step."""
+
+    async def __call__(
+        self,
+        handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+        event: Any,
+        data: Dict[str, Any],
+    ) -> Any:
+        handler_obj = data.get("handler")
+        name = getattr(getattr(handler_obj, "callback", None), "__name__", "unknown")
+        started = time.perf_counter()
+        try:
+            result = await handler(event, data)
+        except Exception as exc:
+            _finish_span(HANDLER_SECONDS, name, started, exc)
+            raise
+        _finish_span(HANDLER_SECONDS, name, started, None)
+        return result
+
+
+class TelegramTimingMiddleware(BaseRequestMiddleware):
+    """Bot session middleware timing every Bot API call (sendMessage, answerCallbackQuery, ...)."""
+
+    async def __call__(self, make_request, bot, method):
+        name = type(method).__name__
+        started = time.perf_counter()
+        try:
+            result = await make_request(bot, method)
+        except Exception as exc:
+            _finish_span(TELEGRAM_SECONDS, name, started, exc)
+            raise
+        _finish_span(TELEGRAM_SECONDS, name, started, None)
+        return result
+
+
+def endpoint_label(request: httpx.Request, base_host: str) -> str:
+    """Low-cardinality label: path for our web API (ids collapsed), host otherwise."""
+    if request.url.host != base_host:
+        return request.url.host
+    parts = [
+        "{id}" if any(ch.isdigit() for ch in part) or len(part) >= 20 else part
+        for part in request.url.path.split("/")
+    ]
+    return "/".join(parts)
+
+
+class InstrumentedTransport(httpx.AsyncBaseTransport):
+    """Wraps the pool transport to time each request, including failed ones."""
+
+    def __init__(self, inner: httpx.AsyncBaseTransport, base_host: str) -> None:
+        self.inner = inner
+        self.base_host = base_host
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        endpoint = endpoint_label(request, self.base_host)
+        started = time.perf_counter()
+        try:
+            response = await self.inner.handle_async_request(request)
+        except Exception as exc:
+            _finish_span(HTTP_SECONDS, endpoint, started, exc, method=request.method)
+            raise
+        # Статус вместо outcome: 4xx/5xx видны в метрике, а не только в логах
+        elapsed = time.perf_counter() - started
+        HTTP_SECONDS.observe(elapsed, endpoint, response.status_code)
+        if response.status_code >= 500 or elapsed >= SLOW_SECONDS or random.random() < SAMPLE_RATE:
+            log.info(
+                "%s %s",
+                request.method,
+                endpoint,
+                extra={"span": "http", "status": response.status_code, "duration": round(elapsed, 4)},
+            )
+        return response
+
+    async def aclose(self) -> None:
+        await self.inner.aclose()
+
+
+def sender_collector(sender) -> Callable[[], List[str]]:
+    """Exposes ``SendQueue.metrics()`` in the Prometheus text format."""
+    from sender import LATENCY_BUCKETS
+
+    def collect() -> List[str]:
+        stats = sender.metrics()
+        lines = ["# TYPE bot_send_total counter"]
+        for result in ("sent", "failed", "retry_after"):
+            lines.append(f'bot_send_total{{result="{result}"}} {stats[result]}')
+        lines.append("# TYPE bot_send_queue_seconds histogram")
+        cumulative = 0
+        for le, count in zip(LATENCY_BUCKETS + ("+Inf",), stats["latency_buckets"]):
+            cumulative += count
+            lines.append(f'bot_send_queue_seconds_bucket{{le="{le}"}} {cumulative}')
+        lines.append(f"bot_send_queue_seconds_sum {stats['latency_sum']}")
+        lines.append(f"bot_send_queue_seconds_count {cumulative}")
+        lines.append("# TYPE bot_send_queue_depth gauge")
+        for lane, depth in stats["depth"].items():
+            lines.append(f'bot_send_queue_depth{{lane="{lane}"}} {depth}')
+        lines.append("# TYPE bot_send_inflight gauge")
+        lines.append(f"bot_send_inflight {stats['inflight']}")
+        return lines
+
+    return collect
+
+
+def build_metrics_app() -> web.Application:
+    async def metrics(request: web.Request) -> web.Response:
+        return web.Response(text=render_metrics(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", metrics)
+    return app
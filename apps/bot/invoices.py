@@ -0,0 +1,114 @@
+import asyncio
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+
+import httpx
+
+from http_client import TIMEOUTS
+from instrumentation import span
+from orders import Order
+
+
+# ЮKassa помнит ключ идемпотентности 24 часа — кэш живёт чуть меньше
+KEY_TTL = 23 * 3600
+KEY_NAMESPACE = uuid.UUID("5b0f3c4e-8a61-4f0e-9d43-6f1c2a7e9b10")
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+
+
+def invoice_key(order: Order) -> str:
+    """Stable per-order idempotency key: the same order always maps to the same payment."""
+    return str(uuid.uuid5(KEY_NAMESPACE, f"order:{order.id}:{order.created_at}"))
+
+
+@dataclass(frozen=True)
+class Invoice:
+    payment_id: str
+    confirmation_url: str
+
+
+class InvoiceError(RuntimeError):
+    pass
+
+
+class InvoiceClient:
+    """Creates YooKassa invoices through ``/api/yookassa/create`` exactly once per key.
+
+    The key is sent with every attempt, so retries after a timeout or a 5xx
+    return the payment YooKassa already created. Results are cached by key,
+    and concurrent calls with the same key share one upstream request.
+    At most ``concurrency`` requests are in flight; the rest wait here rather
+    than in the httpx pool queue, whose scheduling cost grows with its length.
+    """
+
+    def __init__(self, http: httpx.AsyncClient, attempts: int = 3, max_entries: int = 10000, concurrency: int = 50) -> None:
+        self.http = http
+        self.attempts = attempts
+        self.max_entries = max_entries
+        self._sem = asyncio.Semaphore(concurrency)
+        self._cache: "OrderedDict[str, Tuple[Invoice, float]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    def cached(self, key: str) -> Optional[Invoice]:
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        invoice, expires_at = entry
+        if expires_at <= time.time():
+            del self._cache[key]
+            return None
+        return invoice
+
+    async def create(self, key: str, order: Dict[str, Any]) -> Invoice:
+        invoice = self.cached(key)
+        if invoice is not None:
+            return invoice
+        future = self._inflight.get(key)
+        if future is None:
+            future = self._inflight[key] = asyncio.ensure_future(self._create(key, order))
+            future.add_done_callback(lambda f: self._done(key, f))
+        # shield: отмена одного ожидающего не отменяет общий запрос
+        return await asyncio.shield(future)
+
+    def _done(self, key: str, future: asyncio.Future) -> None:
+        self._inflight.pop(key, None)
+        if future.cancelled() or future.exception() is not None:
+            return
+        self._cache[key] = (future.result(), time.time() + KEY_TTL)
+        if len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+
+    async def _create(self, key: str, order: Dict[str, Any]) -> Invoice:
+        last_error: Exception = InvoiceError('Не удалось создать платёж')
+        for attempt in range(self.attempts):
+            if attempt:
+                await asyncio.sleep(min(2 ** attempt, 5))
+            try:
+                async with self._sem:
+                    with span("invoice.create", attempt=attempt):
+                        resp = await self.http.post(
+                            "/api/yookassa/create",
+                            json={"order": order, "idempotencyKey": key},
+                            headers={IDEMPOTENCY_HEADER: key},
+                            timeout=TIMEOUTS["create"],
+                        )
+            except httpx.TransportError as exc:
+                last_error = exc
+                continue
+            try:
+                data = resp.json()
+            except ValueError:
+                data = {}
+            if resp.status_code >= 500:
+                last_error = InvoiceError(data.get('error') or 'Не удалось создать платёж')
+                continue
+            if resp.status_code >= 400:
+                raise InvoiceError(data.get('error') or 'Не удалось создать платёж')
+            payment_id = data.get('paymentId')
+            confirmation_url = data.get('confirmationUrl')
+            if not payment_id or not confirmation_url:
+                raise InvoiceError('Некорректный ответ ЮKassa')
+            return Invoice(payment_id, confirmation_url)
+        raise last_error
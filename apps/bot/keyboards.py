@@ -0,0 +1,204 @@
+import functools
+import time
+from typing import Optional
+
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, Message, WebAppInfo
+
+
+PLAN_CHOICES = [
+    ("1m", "1 месяц"),
+    ("3m", "3 месяца"),
+    ("9m", "9 месяцев"),
+    ("12m", "12 месяцев"),
+]
+
+START_TEXT = (
+    "<b>BazarPaySub</b>\n"
+    "Анонимная оплата подписок на зарубежные сервисы сервисы."
+    "\n\nВыберите, как оформить заказ."
+)
+
+
+def build_main_menu(webapp_url: str, support_url: str | None = None, privacy_url: str | None = None) -> InlineKeyboardMarkup:
+    buttons = []
+    if webapp_url.startswith("https://"):
+        buttons.append([
+            InlineKeyboardButton(
+                text="Мини‑приложение", web_app=WebAppInfo(url=webapp_url)
+            )
+        ])
+    else:
+        buttons.append([
+            InlineKeyboardButton(text="Мини‑приложение", url=webapp_url)
+        ])
+    buttons.append([
+        InlineKeyboardButton(text="Оформить в чате", callback_data="chat:start")
+    ])
+    if support_url:
+        buttons.append([InlineKeyboardButton(text="Поддержка", url=support_url)])
+    else:
+        buttons.append([InlineKeyboardButton(text="Поддержка", callback_data="support:open")])
+    if privacy_url:
+        buttons.append([InlineKeyboardButton(text="Политика конфиденциальности", url=privacy_url)])
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+
+@functools.cache
+def plan_keyboard() -> InlineKeyboardMarkup:
+    rows = [
+        [InlineKeyboardButton(text=label, callback_data=f"chat:plan:{value}")]
+        for value, label in PLAN_CHOICES
+    ]
+    rows.append([InlineKeyboardButton(text="Отмена", callback_data="chat:cancel")])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+
+@functools.cache
+def confirm_keyboard() -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            [InlineKeyboardButton(text="Подтвердить", callback_data="chat:confirm")],
+            [InlineKeyboardButton(text="Изменить", callback_data="chat:restart")],
+            [InlineKeyboardButton(text="Отмена", callback_data="chat:cancel")],
+        ]
+    )
+
+
+@functools.cache
+def payment_keyboard() -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            [InlineKeyboardButton(text="Оплатить через ЮKassa", callback_data="chat:payment:yookassa")],
+            [InlineKeyboardButton(text="Отмена", callback_data="chat:cancel")],
+        ]
+    )
+
+
+def order_actions_keyboard(order_id: int) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            [InlineKeyboardButton(text="✅ Подписка активирована", callback_data=f"order:activate:{order_id}")],
+            [InlineKeyboardButton(text="⚠️ Возникли проблемы", callback_data=f"order:issue:{order_id}")],
+        ]
+    )
+
+
+def _url_keyboard(text: str, url: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text=text, url=url)]])
+
+
+class RenderCache:
+    """Markups and the start card, built once per settings snapshot.
+
+    ``refresh(settings)`` rebuilds everything when a new snapshot arrives.
+    The start-card photo is uploaded by URL once; afterwards the Telegram
+    ``file_id`` is reused, and a failing URL is not retried on every /start.
+    """
+
+    PHOTO_RETRY_AFTER = 600.0
+
+    def __init__(self, settings) -> None:
+        self.refresh(settings)
+
+    def refresh(self, settings) -> None:
+        self.settings = settings
+        self.main_menu = build_main_menu(settings.webapp_url, settings.support_url, settings.privacy_url)
+        if settings.support_url:
+            # Если есть прямая ссылка — сразу открываем чат менеджера через URL‑кнопку.
+            self.support_menu = _url_keyboard("Написать менеджеру", settings.support_url)
+        else:
+            # Иначе — покажем callback, который отправит инструкцию.
+            self.support_menu = InlineKeyboardMarkup(
+                inline_keyboard=[[InlineKeyboardButton(text="Написать менеджеру", callback_data="support:open")]]
+            )
+        self.support_chat_menu = _url_keyboard("Открыть чат менеджера", settings.support_url or "https://t.me/aibazaru")
+        self.privacy_menu = _url_keyboard("Открыть политику", settings.privacy_url)
+        self.start_photo: Optional[str] = settings.start_card_image_url
+        self._photo_failed_at = 0.0
+
+    async def send_start_card(self, message: Message) -> None:
+        photo = self.start_photo
+        if photo and time.monotonic() - self._photo_failed_at >= self.PHOTO_RETRY_AFTER:
+            try:
+                sent = await message.answer_photo(
+                    photo,
+                    caption=START_TEXT,
+                    reply_markup=self.main_menu,
+                    parse_mode="HTML",
+                )
+                if sent.photo and self.start_photo == photo:
+                    self.start_photo = sent.photo[-1].file_id
+                return
+            except Exception:  # noqa: BLE001
+                self._photo_failed_at = time.monotonic()
+        await message.answer(START_TEXT, reply_markup=self.main_menu, parse_mode="HTML")
+
+
+SELECTED, UNSELECTED = "☑", "☐"
+
+
+def pending_keyboard(orders, selected=frozenset(), next_before: Optional[int] = None) -> InlineKeyboardMarkup:
+    """Paid orders with toggles; the selection lives in the button texts, not on the server."""
+    rows = [
+        [
+            InlineKeyboardButton(
+                text=f"{SELECTED if order.id in selected else UNSELECTED} #{order.id} {order.service} · {order.total_rub} ₽",
+                callback_data=f"adm:sel:{order.id}",
+            )
+        ]
+        for order in orders
+    ]
+    footer = [InlineKeyboardButton(text="✅ Активировать выбранные", callback_data="adm:activate")]
+    if next_before is not None:
+        footer.append(InlineKeyboardButton(text="Далее »", callback_data=f"adm:pending:{next_before}"))
+    rows.append(footer)
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+
+def broadcast_keyboard(broadcast_id: int, running: bool = False) -> InlineKeyboardMarkup:
+    """Confirm/cancel under a draft broadcast; refresh/stop while it is running."""
+    if running:
+        buttons = [
+            InlineKeyboardButton(text="🔄 Обновить", callback_data=f"adm:bc:status:{broadcast_id}"),
+            InlineKeyboardButton(text="⏹ Остановить", callback_data=f"adm:bc:stop:{broadcast_id}"),
+        ]
+    else:
+        buttons = [
+            InlineKeyboardButton(text="📣 Отправить всем", callback_data=f"adm:bc:go:{broadcast_id}"),
+            InlineKeyboardButton(text="✖️ Отмена", callback_data=f"adm:bc:drop:{broadcast_id}"),
+        ]
+    return InlineKeyboardMarkup(inline_keyboard=[buttons])
+
+
+@functools.cache
+def service_search_keyboard() -> InlineKeyboardMarkup:
+    # Открывает инлайн-поиск по каталогу прямо в поле ввода: «@bot <запрос>»
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="🔎 Выбрать из каталога", switch_inline_query_current_chat="")],
+    ])
+
+
+def service_suggestions_keyboard(services, typed: str) -> InlineKeyboardMarkup:
+    """Catalog services similar to what the customer typed, plus keeping the typed name."""
+    rows = [
+        [InlineKeyboardButton(text=service.name, callback_data=f"chat:svc:{service.id}")]
+        for service in services
+    ]
+    shown = typed if len(typed) <= 30 else typed[:29] + "…"
+    rows.append([InlineKeyboardButton(text=f"✏️ Оставить «{shown}»", callback_data="chat:svc:-")])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+
+def price_keyboard(price: float, total_rub: Optional[int] = None) -> InlineKeyboardMarkup:
+    text = f"{price:g} USD — обычная цена"
+    if total_rub:
+        text += f" (≈ {total_rub} ₽)"
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=text, callback_data=f"chat:price:{price:g}")],
+    ])
+
+
+def renewal_keyboard(order_id: int) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="🔁 Продлить", callback_data=f"renew:{order_id}")],
+    ])
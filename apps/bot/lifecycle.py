@@ -0,0 +1,90 @@
+import asyncio
+import inspect
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+
+
+log = logging.getLogger(__name__)
+
+Hook = Optional[Callable[[], Any]]
+
+
+class InflightTracker(BaseMiddleware):
+    """Outer ``update`` middleware counting updates that are being handled."""
+
+    def __init__(self) -> None:
+        self.count = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        self.count += 1
+        self._idle.clear()
+        try:
+            return await handler(event, data)
+        finally:
+            self.count -= 1
+            if not self.count:
+                self._idle.set()
+
+    async def drain(self, timeout: float) -> bool:
+        """Wait for running handlers; False if some were still running at the deadline."""
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+class Lifecycle:
+    """Starts components in order and stops them in reverse within one deadline.
+
+    Shutdown first waits for in-flight update handlers, so a customer who
+    just pressed "Оплатить" still gets the invoice; components that do not
+    stop before the deadline are abandoned with a warning, never block exit.
+    """
+
+    def __init__(self, timeout: float = 20.0) -> None:
+        self.timeout = timeout
+        self.tracker = InflightTracker()
+        self._components: List[Tuple[str, Hook, Hook]] = []
+        self._started: List[Tuple[str, Hook, Hook]] = []
+
+    def add(self, name: str, start: Hook = None, stop: Hook = None) -> None:
+        self._components.append((name, start, stop))
+
+    async def start(self) -> None:
+        for component in self._components:
+            name, start, _ = component
+            if start is not None:
+                result = start()
+                if inspect.isawaitable(result):
+                    await result
+            self._started.append(component)
+
+    async def shutdown(self) -> None:
+        deadline = time.monotonic() + self.timeout
+        if not await self.tracker.drain(self.timeout):
+            log.warning("Shutdown deadline hit with handlers running", extra={"handlers": self.tracker.count})
+        while self._started:
+            name, _, stop = self._started.pop()
+            if stop is None:
+                continue
+            try:
+                result = stop()
+                if inspect.isawaitable(result):
+                    # Каждому компоненту — остаток общего дедлайна, но не меньше секунды
+                    await asyncio.wait_for(result, max(1.0, deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                log.warning("Component did not stop before the deadline", extra={"component": name})
+            except Exception:  # noqa: BLE001
+                log.exception("Component failed to stop", extra={"component": name})
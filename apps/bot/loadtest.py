@@ -0,0 +1,1002 @@
+"""Offline load test of the chat order funnel.
+
+Drives the Dispatcher from ``main.build_app`` with synthetic Telegram
+updates. The Bot API is replaced by an in-process session and the web
+app's ``/api/yookassa/*`` routes and the exchange-rate provider by a local
+aiohttp stub, so nothing leaves the machine.
+
+    python loadtest.py --users 1,10,100,1000,10000 --save loadtest-baseline.json
+    python loadtest.py --users 1,100,1000 --compare loadtest-baseline.json
+    python loadtest.py --sessions 100000
+    python loadtest.py --start-allocs 1000
+    python loadtest.py --cold-start 5 --max-seconds 3
+    python loadtest.py --shards 1,2,4 --users 1000 --tg-latency 0.05
+    python loadtest.py --users 100 --settle 3 [--no-keepalive]
+
+Every run reports how many TCP connections the web API stub accepted per
+order; ``--no-keepalive`` turns off connection reuse for a baseline.
+``--sessions`` skips the funnel and measures how many bytes one open order
+session (FSM state and data, plus the password vault entry) keeps in memory.
+"""
+import argparse
+import asyncio
+import contextlib
+import dataclasses
+import gc
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import random
+import secrets
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import typing
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+import httpx
+from aiohttp import web
+
+os.environ.setdefault("BOT_TOKEN", "123456:LOADTEST")
+os.environ.setdefault("ADMIN_CHAT_ID", "-100")
+
+from aiogram import Bot  # noqa: E402
+from aiogram.client.session.base import BaseSession  # noqa: E402
+from aiogram.fsm.storage.base import StorageKey  # noqa: E402
+from aiogram.fsm.storage.memory import MemoryStorage  # noqa: E402
+from aiogram.methods import GetMe, GetUpdates  # noqa: E402
+from aiogram.types import Message, Update  # noqa: E402
+
+from config import load_settings  # noqa: E402
+from main import OrderForm, build_app  # noqa: E402
+from middlewares import UPDATES_DROPPED  # noqa: E402
+from server import AppServer  # noqa: E402
+from sharding import UPDATE_PATH, ShardRouter  # noqa: E402
+from webhook import SECRET_HEADER, WebhookIntake  # noqa: E402
+from pricing import PLAN_MONTHS, PricingParams, QuoteTable, calc_totals, price_batch  # noqa: E402
+from sessions import SecretVault, session_key  # noqa: E402
+from storage import MemoryOrderStorage  # noqa: E402
+
+
+log = logging.getLogger("loadtest")
+
+BOT_ID = 123456
+USER_BASE = 10_000_000
+# Шаги воронки: (имя, тип апдейта, текст сообщения или callback_data)
+FUNNEL = [
+    ("start", "message", "/start"),
+    ("chat_start", "callback", "chat:start"),
+    ("service", "message", "Patreon"),
+    ("login", "message", "user@example.com"),
+    ("password", "message", "secret"),
+    ("creator", "message", "https://example.com/creator"),
+    ("plan", "callback", "chat:plan:3m"),
+    ("price", "message", "9.99"),
+    ("notes", "message", "-"),
+    ("confirm", "callback", "chat:confirm"),
+    ("payment", "callback", "chat:payment:yookassa"),
+]
+# Память меряем, когда у всех пользователей открыт диалог (перед оплатой)
+HOLD_BEFORE = "payment"
+
+
+class FakeSession(BaseSession):
+    """Bot API session that answers every method locally after ``latency`` seconds."""
+
+    def __init__(self, latency: float = 0.0) -> None:
+        super().__init__()
+        self.latency = latency
+        self.calls: Dict[str, int] = {}
+        # Фото, которые Telegram пришлось бы скачивать по URL (а не слать по file_id)
+        self.photo_urls = 0
+        self._message_ids = itertools.count(1)
+        # Очередь для getUpdates: режим polling в --intake
+        self.updates: asyncio.Queue = asyncio.Queue()
+
+    async def _get_updates(self, method: GetUpdates) -> List[Dict[str, Any]]:
+        with contextlib.suppress(asyncio.TimeoutError):
+            first = await asyncio.wait_for(self.updates.get(), method.timeout or None)
+            batch = [first]
+            while len(batch) < (method.limit or 100) and not self.updates.empty():
+                batch.append(self.updates.get_nowait())
+            return [update.model_dump(mode="json", exclude_unset=True, by_alias=True) for update in batch]
+        return []
+
+    def _result(self, method) -> Any:
+        if isinstance(method, GetMe):
+            return {"id": BOT_ID, "is_bot": True, "first_name": "Bot", "username": "loadtest_bot"}
+        returning = method.__returning__
+        if returning is not Message and Message not in typing.get_args(returning):
+            return True
+        chat_id = getattr(method, "chat_id", None) or BOT_ID
+        result: Dict[str, Any] = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id if isinstance(chat_id, int) else -100, "type": "private"},
+            "text": getattr(method, "text", None) or "",
+        }
+        if hasattr(method, "photo"):
+            if isinstance(method.photo, str) and method.photo.startswith("http"):
+                self.photo_urls += 1
+            result["photo"] = [{"file_id": "photo", "file_unique_id": "photo", "width": 1, "height": 1}]
+        return result
+
+    async def make_request(self, bot: Bot, method, timeout: Optional[int] = None) -> Any:
+        name = type(method).__name__
+        self.calls[name] = self.calls.get(name, 0) + 1
+        # getUpdates отвечает, как только появились апдейты; задержка — на доставку ответа
+        result = await self._get_updates(method) if isinstance(method, GetUpdates) else self._result(method)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        content = json.dumps({"ok": True, "result": result})
+        return self.check_response(bot, method, 200, content).result
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def close(self) -> None:
+        pass
+
+
+def build_fake_web(paid_after: float) -> web.Application:
+    """Stub of the web app: invoices, batched and single status checks, USD/RUB rate."""
+    payments: Dict[str, float] = {}
+    by_key: Dict[str, str] = {}
+    # create — запросы на создание, payments — созданные платежи (разные ключи)
+    counters = {"create": 0, "payments": 0, "status": 0, "connections": 0}
+    transports: set = set()
+
+    @web.middleware
+    async def count_connections(request: web.Request, handler):
+        # Новое TCP-соединение — новый транспорт; keep-alive переиспользует прежний
+        if request.transport not in transports:
+            transports.add(request.transport)
+            counters["connections"] += 1
+        return await handler(request)
+
+    def status(payment_id: str) -> Dict[str, str]:
+        created = payments.get(payment_id)
+        if created is None:
+            return {"error": "not found"}
+        return {"status": "succeeded" if time.monotonic() - created >= paid_after else "pending"}
+
+    async def create(request: web.Request) -> web.Response:
+        counters["create"] += 1
+        body = await request.json()
+        key = body.get("idempotencyKey") or f"anon-{counters['create']}"
+        payment_id = by_key.get(key)
+        if payment_id is None:
+            payment_id = by_key[key] = f"pay-{len(by_key) + 1}"
+            payments[payment_id] = time.monotonic()
+            counters["payments"] += 1
+        return web.json_response({"paymentId": payment_id, "confirmationUrl": f"https://yookassa.test/{payment_id}"})
+
+    async def status_batch(request: web.Request) -> web.Response:
+        counters["status"] += 1
+        ids = (await request.json()).get("ids") or []
+        return web.json_response({"payments": {payment_id: status(payment_id) for payment_id in ids}})
+
+    async def status_one(request: web.Request) -> web.Response:
+        counters["status"] += 1
+        return web.json_response(status(request.match_info["payment_id"]))
+
+    async def rates(request: web.Request) -> web.Response:
+        return web.json_response({"rates": {"RUB": 90.0}})
+
+    async def stats(request: web.Request) -> web.Response:
+        # Сами запросы статистики — из отдельного клиента, в счёт не идут
+        transports.discard(request.transport)
+        return web.json_response(counters)
+
+    app = web.Application(middlewares=[count_connections])
+    app.router.add_post("/api/yookassa/create", create)
+    app.router.add_post("/api/yookassa/status", status_batch)
+    app.router.add_get("/api/yookassa/{payment_id}", status_one)
+    app.router.add_get("/rates", rates)
+    app.router.add_get("/_stats", stats)
+    return app
+
+
+def _serve_fake_web(port: int, paid_after: float) -> None:
+    web.run_app(build_fake_web(paid_after), host="127.0.0.1", port=port, print=None, handle_signals=False)
+
+
+async def start_fake_web(port: int, paid_after: float) -> multiprocessing.Process:
+    # Отдельный процесс: заглушка не отнимает у бота цикл событий и GIL
+    process = multiprocessing.get_context("spawn").Process(target=_serve_fake_web, args=(port, paid_after), daemon=True)
+    process.start()
+    async with httpx.AsyncClient() as client:
+        for _ in range(300):
+            try:
+                await client.get(f"http://127.0.0.1:{port}/_stats")
+                return process
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"Fake web app did not start on port {port}")
+
+
+def _serve_fake_redis(port: int) -> None:
+    from fakeredis import TcpFakeServer
+
+    TcpFakeServer(("127.0.0.1", port)).serve_forever()
+
+
+async def start_fake_redis(port: int) -> multiprocessing.Process:
+    """Redis-protocol stand-in (fakeredis) for ``--fsm-storage redis`` without a server."""
+    process = multiprocessing.get_context("spawn").Process(target=_serve_fake_redis, args=(port,), daemon=True)
+    process.start()
+    for _ in range(300):
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+        except OSError:
+            await asyncio.sleep(0.1)
+            continue
+        writer.close()
+        return process
+    process.kill()
+    raise RuntimeError(f"Redis stand-in did not start on port {port}")
+
+
+def _update(update_id: int, user_id: int, kind: str, value: str) -> Update:
+    user = {"id": user_id, "is_bot": False, "first_name": f"User {user_id}", "username": f"user{user_id}"}
+    chat = {"id": user_id, "type": "private"}
+    now = int(time.time())
+    if kind == "message":
+        message = {"message_id": update_id, "date": now, "chat": chat, "from": user, "text": value}
+        if value.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(value)}]
+        return Update.model_validate({"update_id": update_id, "message": message})
+    bot_message = {
+        "message_id": update_id,
+        "date": now,
+        "chat": chat,
+        "from": {"id": BOT_ID, "is_bot": True, "first_name": "Bot"},
+        "text": "…",
+    }
+    return Update.model_validate({
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": user,
+            "chat_instance": str(user_id),
+            "message": bot_message,
+            "data": value,
+        },
+    })
+
+
+def _rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # Не Linux: только пиковое значение, оценка памяти на сессию будет грубой
+        import resource
+
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _percentiles(samples: List[float]) -> Dict[str, float]:
+    if not samples:
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0}
+    ordered = sorted(samples)
+
+    def at(q: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 3)
+
+    return {"p50": at(0.50), "p95": at(0.95), "p99": at(0.99)}
+
+
+def bench_settings(args: argparse.Namespace, tmp: str, redis_url: Optional[str] = None):
+    """Settings of a bot under test: local stubs, no listeners, no rate limits."""
+    base = f"http://127.0.0.1:{args.web_port}"
+    settings = dataclasses.replace(
+        load_settings(),
+        payments_base_url=base,
+        rate_urls=(f"{base}/rates",),
+        start_card_image_url=None,
+        fsm_storage=args.fsm_storage,
+        fsm_sqlite_path=os.path.join(tmp, "fsm.sqlite3"),
+        redis_url=redis_url or "",
+        orders_db_path=os.path.join(tmp, "orders.sqlite3"),
+        bot_events_token="",
+        metrics_port=0,
+        # Синтетические пользователи не ждут между шагами — антифлуд их не режет
+        throttle_rate=1e9,
+        throttle_burst=1e9,
+        tg_global_rate=1e9,
+        tg_group_rate=1e9,
+        tg_chat_rate=1e9,
+        bot_shards=1,
+        shard_index=None,
+        settings_reload_interval=0,
+    )
+    if args.no_keepalive:
+        # Каждое обращение к веб-API в новом соединении — как до общего клиента с пулом
+        settings = dataclasses.replace(settings, http_max_keepalive=0)
+    return settings
+
+
+async def run_level(users: int, args: argparse.Namespace) -> Dict[str, Any]:
+    """One sweep point: ``users`` concurrent customers walk the funnel up to the invoice."""
+    web_process = await start_fake_web(args.web_port, args.paid_after)
+    redis_process = None
+    redis_url = args.redis_url
+    if args.fsm_storage == "redis" and not redis_url:
+        redis_process = await start_fake_redis(args.web_port + 1)
+        redis_url = f"redis://127.0.0.1:{args.web_port + 1}/0"
+    with tempfile.TemporaryDirectory() as tmp:
+        settings = bench_settings(args, tmp, redis_url)
+        session = FakeSession(args.tg_latency)
+        bot = Bot(settings.bot_token, session=session)
+        dp, lifecycle = build_app(settings, bot)
+        await lifecycle.start()
+
+        update_ids = itertools.count(1)
+        latencies: Dict[str, List[float]] = {name: [] for name, _, _ in FUNNEL}
+        errors: Dict[str, int] = {}
+        gate = asyncio.Semaphore(args.max_inflight) if args.max_inflight else None
+
+        async def step(user_id: int, name: str, kind: str, value: str) -> None:
+            update = _update(next(update_ids), user_id, kind, value)
+            started = time.perf_counter()
+            try:
+                if gate is None:
+                    await dp.feed_update(bot, update)
+                else:
+                    async with gate:
+                        await dp.feed_update(bot, update)
+            except Exception as exc:  # noqa: BLE001
+                errors[type(exc).__name__] = errors.get(type(exc).__name__, 0) + 1
+            latencies[name].append(time.perf_counter() - started)
+
+        async def walk(user_id: int, steps) -> None:
+            for name, kind, value in steps:
+                await step(user_id, name, kind, value)
+
+        hold = next(index for index, (name, _, _) in enumerate(FUNNEL) if name == HOLD_BEFORE)
+        # Прогрев без оплаты (заказ не создаётся): ленивая инициализация aiogram не попадает в замеры
+        await walk(USER_BASE - 1, FUNNEL[:hold])
+        for samples in latencies.values():
+            samples.clear()
+        errors.clear()
+        user_ids = [USER_BASE + index for index in range(users)]
+        dropped_before = sum(UPDATES_DROPPED._values.values())
+
+        gc.collect()
+        rss_before = _rss_bytes()
+        started = time.perf_counter()
+        await asyncio.gather(*(walk(user_id, FUNNEL[:hold]) for user_id in user_ids))
+        gc.collect()
+        rss_held = _rss_bytes()
+        await asyncio.gather(*(walk(user_id, FUNNEL[hold:]) for user_id in user_ids))
+        elapsed = time.perf_counter() - started
+
+        orders = dp["orders"]
+        if args.settle:
+            await asyncio.sleep(args.settle)
+        stats = await orders.stats([0.0])
+        await lifecycle.shutdown()
+    async with httpx.AsyncClient() as client:
+        counters = (await client.get(f"http://127.0.0.1:{args.web_port}/_stats")).json()
+    web_process.kill()
+    web_process.join()
+    if redis_process is not None:
+        redis_process.kill()
+        redis_process.join()
+
+    total_updates = users * len(FUNNEL)
+    return {
+        "users": users,
+        "updates": total_updates,
+        "seconds": round(elapsed, 3),
+        "updates_per_second": round(total_updates / elapsed, 1),
+        "funnels_per_second": round(users / elapsed, 1),
+        "steps_ms": {name: _percentiles(samples) for name, samples in latencies.items()},
+        "memory_per_session_kb": round(max(0, rss_held - rss_before) / users / 1024, 2),
+        "errors": errors,
+        "dropped": sum(UPDATES_DROPPED._values.values()) - dropped_before,
+        "orders": stats["by_status"],
+        "invoice_requests": counters["create"],
+        "status_requests": counters["status"],
+        "web_connections": counters["connections"],
+        "connections_per_order": round(counters["connections"] / max(1, counters["create"]), 2),
+        "bot_api_calls": sum(session.calls.values()),
+    }
+
+
+async def run_intake(mode: str, users: int, args: argparse.Namespace) -> Dict[str, Any]:
+    """Replay the funnel (up to the invoice) through one intake mode.
+
+    Latency of an update runs from the moment it is available to the bot —
+    queued for getUpdates (polling) or POSTed to the webhook — until the
+    dispatcher has finished with it. The webhook client runs in the same
+    process and takes its share of the CPU.
+    """
+    web_process = await start_fake_web(args.web_port, args.paid_after)
+    with tempfile.TemporaryDirectory() as tmp:
+        settings = bench_settings(args, tmp)
+        session = FakeSession(args.tg_latency)
+        bot = Bot(settings.bot_token, session=session)
+        dp, lifecycle = build_app(settings, bot)
+        finished: Dict[int, asyncio.Future] = {}
+
+        async def mark_finished(handler, event, data):
+            try:
+                return await handler(event, data)
+            finally:
+                future = finished.pop(event.update_id, None)
+                if future is not None and not future.done():
+                    future.set_result(None)
+
+        dp.update.outer_middleware(mark_finished)
+        await lifecycle.start()
+
+        intake: Optional[WebhookIntake] = None
+        server: Optional[AppServer] = None
+        polling: Optional[asyncio.Task] = None
+        http = httpx.AsyncClient(limits=httpx.Limits(max_connections=256), timeout=30.0)
+        webhook_url = f"http://127.0.0.1:{args.web_port + 2}/webhook"
+        if mode == "webhook":
+            intake = WebhookIntake(
+                dp, bot, "loadtest", workers=settings.webhook_workers, queue_size=settings.webhook_queue_size
+            )
+            server = AppServer(intake.build_app("/webhook"), "127.0.0.1", args.web_port + 2)
+            intake.start()
+            await server.start()
+        else:
+            polling = asyncio.create_task(dp.start_polling(bot, handle_signals=False, close_bot_session=False))
+
+        update_ids = itertools.count(1)
+        latencies: List[float] = []
+        rejected = 0
+
+        async def deliver(update: Update) -> None:
+            nonlocal rejected
+            if mode == "polling":
+                session.updates.put_nowait(update)
+                return
+            body = update.model_dump(mode="json", exclude_unset=True, by_alias=True)
+            while (await http.post(webhook_url, json=body, headers={SECRET_HEADER: "loadtest"})).status_code == 503:
+                # Очередь воркера полна — Telegram повторил бы доставку позже
+                rejected += 1
+                await asyncio.sleep(0.05)
+
+        async def walk(user_id: int, record: bool) -> None:
+            for name, kind, value in FUNNEL:
+                if name == HOLD_BEFORE:
+                    return
+                update = _update(next(update_ids), user_id, kind, value)
+                done = finished[update.update_id] = asyncio.get_running_loop().create_future()
+                started = time.perf_counter()
+                await deliver(update)
+                await done
+                if record:
+                    latencies.append(time.perf_counter() - started)
+
+        await walk(USER_BASE - 1, record=False)
+        started = time.perf_counter()
+        await asyncio.gather(*(walk(USER_BASE + index, record=True) for index in range(users)))
+        elapsed = time.perf_counter() - started
+
+        if polling is not None:
+            await dp.stop_polling()
+            await polling
+        if server is not None and intake is not None:
+            await server.stop()
+            await intake.stop()
+        await http.aclose()
+        await lifecycle.shutdown()
+    web_process.kill()
+    web_process.join()
+    return {
+        "mode": mode,
+        "users": users,
+        "updates": len(latencies),
+        "updates_per_second": round(len(latencies) / elapsed, 1),
+        "latency_ms": _percentiles(latencies),
+        "rejected": rejected,
+    }
+
+
+def print_intake(runs: List[Dict[str, Any]]) -> None:
+    print(f"\n  {'mode':<10}{'users':>7}{'updates/s':>12}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'503s':>7}")
+    for run in runs:
+        latency = run["latency_ms"]
+        print(
+            f"  {run['mode']:<10}{run['users']:>7}{run['updates_per_second']:>12}"
+            f"{latency['p50']:>10.2f}{latency['p95']:>10.2f}{latency['p99']:>10.2f}{run['rejected']:>7}"
+        )
+
+
+def _serve_shard_worker(index: int, shards: int, args: argparse.Namespace, tmp: str, token: str) -> None:
+    logging.basicConfig(level=args.log_level.upper())
+    asyncio.run(_shard_worker(index, shards, args, tmp, token))
+
+
+async def _shard_worker(index: int, shards: int, args: argparse.Namespace, tmp: str, token: str) -> None:
+    """A shard worker as ``main.py`` runs it (``BOT_SHARD_INDEX``), plus a counter of finished updates."""
+    settings = dataclasses.replace(bench_settings(args, tmp), bot_shards=shards, shard_index=index, shard_token=token)
+    bot = Bot(settings.bot_token, session=FakeSession(args.tg_latency))
+    dp, lifecycle = build_app(settings, bot)
+    finished = {"updates": 0}
+
+    async def count_finished(handler, event, data):
+        try:
+            return await handler(event, data)
+        finally:
+            finished["updates"] += 1
+
+    async def stats(request: web.Request) -> web.Response:
+        return web.json_response(finished)
+
+    dp.update.outer_middleware(count_finished)
+    intake = WebhookIntake(dp, bot, token, workers=settings.webhook_workers, queue_size=settings.webhook_queue_size)
+    app = intake.build_app(UPDATE_PATH)
+    app.router.add_get("/_stats", stats)
+    await lifecycle.start()
+    intake.start()
+    await AppServer(app, "127.0.0.1", args.shard_port + index).start()
+    # Процесс останавливает родитель
+    await asyncio.Event().wait()
+
+
+async def run_shards(shards: int, users: int, args: argparse.Namespace) -> Dict[str, Any]:
+    """``users`` customers walk the funnel through ``ShardRouter`` and ``shards`` worker processes.
+
+    All updates are queued at the intake at once; throughput is counted
+    until every worker has finished its share. Orders created equal
+    ``users`` only if each user's steps were handled in order.
+    """
+    web_process = await start_fake_web(args.web_port, args.paid_after)
+    token = secrets.token_urlsafe(16)
+    urls = [f"http://127.0.0.1:{args.shard_port + index}" for index in range(shards)]
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as tmp:
+        workers = [
+            context.Process(target=_serve_shard_worker, args=(index, shards, args, tmp, token), daemon=True)
+            for index in range(shards)
+        ]
+        for worker in workers:
+            worker.start()
+        async with httpx.AsyncClient() as client:
+
+            async def finished() -> Optional[int]:
+                try:
+                    replies = await asyncio.gather(*(client.get(url + "/_stats") for url in urls))
+                except httpx.TransportError:
+                    return None
+                return sum(reply.json()["updates"] for reply in replies)
+
+            deadline = time.monotonic() + 60
+            while await finished() is None:
+                if time.monotonic() > deadline:
+                    raise RuntimeError("Shard workers did not start")
+                await asyncio.sleep(0.2)
+
+            bot = Bot(load_settings().bot_token, session=FakeSession())
+            router = ShardRouter(bot, urls, token, lanes=args.shard_lanes)
+            router.start()
+            update_ids = itertools.count(1)
+            total = users * len(FUNNEL)
+            started = time.perf_counter()
+            for _, kind, value in FUNNEL:
+                for index in range(users):
+                    await router.put(_update(next(update_ids), USER_BASE + index, kind, value))
+            done = 0
+            deadline = time.monotonic() + args.shard_timeout
+            while done < total and time.monotonic() < deadline:
+                await asyncio.sleep(0.02)
+                done = await finished() or done
+            elapsed = time.perf_counter() - started
+            await router.stop(5)
+        for worker in workers:
+            worker.kill()
+            worker.join()
+        with contextlib.closing(sqlite3.connect(os.path.join(tmp, "orders.sqlite3"))) as db:
+            orders = db.execute("SELECT COUNT(*) FROM orders").fetchone()[0]
+    web_process.kill()
+    web_process.join()
+    return {
+        "shards": shards,
+        "users": users,
+        "updates": total,
+        "finished": done,
+        "seconds": round(elapsed, 3),
+        "updates_per_second": round(done / elapsed, 1),
+        "orders": orders,
+    }
+
+
+def print_shards(runs: List[Dict[str, Any]]) -> None:
+    print(f"\n  CPUs: {os.cpu_count()}")
+    print(f"  {'shards':<8}{'users':>7}{'updates':>10}{'seconds':>10}{'updates/s':>12}{'scaling':>9}{'orders':>8}")
+    first: Dict[int, float] = {}
+    for run in runs:
+        base = first.setdefault(run["users"], run["updates_per_second"] / run["shards"])
+        updates = f"{run['finished']}" if run["finished"] == run["updates"] else f"{run['finished']}/{run['updates']}"
+        print(
+            f"  {run['shards']:<8}{run['users']:>7}{updates:>10}{run['seconds']:>10}{run['updates_per_second']:>12}"
+            f"{run['updates_per_second'] / base:>8.2f}x{run['orders']:>8}"
+        )
+
+
+def print_run(run: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None) -> None:
+    def delta(value: float, old: Optional[float]) -> str:
+        if not old:
+            return ""
+        return f" ({(value - old) / old * 100:+.0f}%)"
+
+    old_steps = (baseline or {}).get("steps_ms", {})
+    print(
+        f"\n{run['users']} users: {run['updates_per_second']} updates/s"
+        f"{delta(run['updates_per_second'], (baseline or {}).get('updates_per_second'))}, "
+        f"{run['memory_per_session_kb']} KB/session"
+        f"{delta(run['memory_per_session_kb'], (baseline or {}).get('memory_per_session_kb'))}, "
+        f"errors {sum(run['errors'].values())}, dropped {run['dropped']}, orders {run['orders']}"
+    )
+    print(
+        f"  web API: {run['invoice_requests']} invoices, {run['status_requests']} status checks, "
+        f"{run['web_connections']} connections ({run['connections_per_order']} per order)"
+    )
+    print(f"  {'step':<12}{'p50 ms':>14}{'p95 ms':>14}{'p99 ms':>14}")
+    for name, values in run["steps_ms"].items():
+        old = old_steps.get(name, {})
+        cells = "".join(f"{values[q]:>8.2f}{delta(values[q], old.get(q)):>6}" for q in ("p50", "p95", "p99"))
+        print(f"  {name:<12}{cells}")
+
+
+def _session_data(index: int) -> Dict[str, Any]:
+    return {
+        "service": ("Netflix", "Patreon", "Chatgpt", "Lovable")[index % 4],
+        "login": f"user{index}@example.com",
+        "creator": f"https://example.com/creator/{index}",
+        "plan": "3m",
+        "price": 9.99 + index % 100,
+        "notes": "",
+    }
+
+
+async def _fill_legacy(count: int) -> MemoryStorage:
+    # Прежний формат: aiogram MemoryStorage, пароль и расчёт целиком в data
+    storage = MemoryStorage()
+    params = PricingParams()
+    for index in range(count):
+        key = StorageKey(bot_id=BOT_ID, chat_id=USER_BASE + index, user_id=USER_BASE + index)
+        data = _session_data(index)
+        data["password"] = f"secret-{index}"
+        data["calc"] = calc_totals(data["price"], data["plan"], 92.5, params)
+        await storage.set_state(key, OrderForm.payment)
+        await storage.set_data(key, data)
+    return storage
+
+
+async def _fill_compact(count: int) -> tuple[MemoryOrderStorage, SecretVault]:
+    # Короткий TTL хранилища секретов — чтобы после замера проверить их вычистку
+    storage, vault = MemoryOrderStorage(ttl=3600), SecretVault(ttl=1)
+    for index in range(count):
+        key = StorageKey(bot_id=BOT_ID, chat_id=USER_BASE + index, user_id=USER_BASE + index)
+        vault.put(session_key(key), f"secret-{index}")
+        await storage.advance(key, OrderForm.payment, {**_session_data(index), "rate": 92.5})
+    return storage, vault
+
+
+async def session_memory(count: int) -> Dict[str, Any]:
+    """Bytes retained per open order session, old and current layout."""
+    result: Dict[str, Any] = {"sessions": count}
+    for name, fill in (("legacy", _fill_legacy), ("compact", _fill_compact)):
+        gc.collect()
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        kept = await fill(count)
+        gc.collect()
+        used = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        result[f"{name}_bytes_per_session"] = round(used / count)
+        if name == "compact":
+            storage, vault = kept
+            storage.ttl = 1e-9
+            await asyncio.sleep(1)
+            started = time.perf_counter()
+            evicted = storage.sweep() + vault.sweep()
+            result["sweep_ms"] = round((time.perf_counter() - started) * 1000, 1)
+            result["swept"] = evicted
+            result["left_after_sweep"] = len(storage) + len(vault)
+        del kept
+    return result
+
+
+def print_sessions(result: Dict[str, Any]) -> None:
+    legacy, compact = result["legacy_bytes_per_session"], result["compact_bytes_per_session"]
+    print(f"\n=== {result['sessions']} open sessions ===")
+    print(f"  legacy (MemoryStorage, password and calc in data): {legacy} B/session")
+    print(f"  compact (MemoryOrderStorage + vault entry):        {compact} B/session ({(compact - legacy) / legacy:+.0%})")
+    print(f"  sweep of all idle sessions: {result['sweep_ms']} ms, evicted {result['swept']}, left {result['left_after_sweep']}")
+
+
+async def start_allocations(count: int, args: argparse.Namespace) -> Dict[str, Any]:
+    """Cost of one /start with the render cache and without it.
+
+    ``rebuilt`` refreshes the cache before every /start: the menu is built
+    again and the start card goes out by URL, as before the cache existed.
+    Time comes from a plain pass, allocations from a second pass under
+    tracemalloc (the peak above the level before the update).
+    """
+    web_process = await start_fake_web(args.web_port, args.paid_after)
+    result: Dict[str, Any] = {"starts": count}
+    with tempfile.TemporaryDirectory() as tmp:
+        settings = dataclasses.replace(bench_settings(args, tmp), start_card_image_url="https://example.com/card.png")
+        session = FakeSession()
+        bot = Bot(settings.bot_token, session=session)
+        dp, lifecycle = build_app(settings, bot)
+        await lifecycle.start()
+        render = dp["render"]
+        update_ids = itertools.count(1)
+        # Первый /start загружает карточку по URL — дальше она идёт по file_id
+        await dp.feed_update(bot, _update(next(update_ids), USER_BASE, "message", "/start"))
+        for name, rebuild in (("cached", False), ("rebuilt", True)):
+            photo_urls = session.photo_urls
+            updates = [_update(next(update_ids), USER_BASE + index, "message", "/start") for index in range(count)]
+            started = time.perf_counter()
+            for update in updates:
+                if rebuild:
+                    render.refresh(render.settings)
+                await dp.feed_update(bot, update)
+            elapsed = time.perf_counter() - started
+            # Второй проход — под tracemalloc: он замедляет всё в разы, время берём из первого
+            updates = [_update(next(update_ids), USER_BASE + index, "message", "/start") for index in range(count)]
+            peaks = []
+            gc.collect()
+            tracemalloc.start()
+            for update in updates:
+                before = tracemalloc.get_traced_memory()[0]
+                tracemalloc.reset_peak()
+                if rebuild:
+                    render.refresh(render.settings)
+                await dp.feed_update(bot, update)
+                peaks.append(tracemalloc.get_traced_memory()[1] - before)
+            tracemalloc.stop()
+            peaks.sort()
+            result[name] = {
+                "us_per_start": round(elapsed / count * 1e6, 1),
+                "bytes_p50": peaks[len(peaks) // 2],
+                "bytes_mean": round(sum(peaks) / len(peaks)),
+                "photo_by_url": (session.photo_urls - photo_urls) // 2,
+            }
+        await lifecycle.shutdown()
+    web_process.kill()
+    web_process.join()
+    return result
+
+
+def print_start_allocations(result: Dict[str, Any]) -> None:
+    cached, rebuilt = result["cached"], result["rebuilt"]
+    print(f"\n=== {result['starts']} x /start ===")
+    for name, run in (("render cache", cached), ("menu rebuilt", rebuilt)):
+        print(f"  {name}: {run['us_per_start']} us, peak p50 {run['bytes_p50']} B / mean {run['bytes_mean']} B"
+              f" allocated per /start, start card by URL {run['photo_by_url']} times")
+    print(f"  cache: {(cached['us_per_start'] - rebuilt['us_per_start']) / rebuilt['us_per_start']:+.0%} time,"
+          f" {cached['bytes_mean'] - rebuilt['bytes_mean']:+} B per /start")
+
+
+# Холодный старт в отдельном интерпретаторе: импорт aiogram, импорт main, сборка диспетчера
+COLD_START_SCRIPT = """
+import time
+started = time.perf_counter()
+import asyncio, dataclasses, json, sys
+import aiogram
+aiogram_at = time.perf_counter()
+import main
+main_at = time.perf_counter()
+
+async def build():
+    settings = dataclasses.replace(
+        main.get_settings(),
+        orders_db_path=sys.argv[1] + "/orders.sqlite3",
+        fsm_sqlite_path=sys.argv[1] + "/fsm.sqlite3",
+    )
+    main.build_app(settings, aiogram.Bot(settings.bot_token))
+
+asyncio.run(build())
+built_at = time.perf_counter()
+print(json.dumps({
+    "import_aiogram": aiogram_at - started,
+    "import_main": main_at - aiogram_at,
+    "build_app": built_at - main_at,
+}))
+"""
+
+
+def cold_start(runs: int) -> Dict[str, Any]:
+    """Median cold start of the bot over ``runs`` fresh interpreters, by phase."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    samples: Dict[str, List[float]] = {"process": [], "import_aiogram": [], "import_main": [], "build_app": []}
+    for _ in range(runs):
+        with tempfile.TemporaryDirectory() as tmp:
+            started = time.perf_counter()
+            output = subprocess.run(
+                [sys.executable, "-c", COLD_START_SCRIPT, tmp],
+                cwd=here,
+                env={**os.environ, "PYTHONDONTWRITEBYTECODE": "1"},
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout
+            samples["process"].append(time.perf_counter() - started)
+        for phase, seconds in json.loads(output.strip().splitlines()[-1]).items():
+            samples[phase].append(seconds)
+    return {
+        "runs": runs,
+        **{f"{phase}_seconds": round(sorted(values)[len(values) // 2], 3) for phase, values in samples.items()},
+    }
+
+
+def print_cold_start(result: Dict[str, Any]) -> None:
+    print(f"\n=== cold start, median of {result['runs']} runs ===")
+    print(f"  import aiogram: {result['import_aiogram_seconds']:.3f} s")
+    print(f"  import main:    {result['import_main_seconds']:.3f} s")
+    print(f"  build_app:      {result['build_app_seconds']:.3f} s (handlers and components)")
+    print(f"  whole process:  {result['process_seconds']:.3f} s")
+
+
+def pricing_throughput(count: int) -> Dict[str, Any]:
+    """Quotes per second: one calc_totals call per pair, one price_batch pass, QuoteTable lookups."""
+    rng = random.Random(42)
+    plans = list(PLAN_MONTHS)
+    prices = [round(rng.uniform(1, 500), 2) for _ in range(count)]
+    chosen = [rng.choice(plans) for _ in range(count)]
+    rate = 92.5
+    price_batch([1.0], ["1m"], rate)  # импорт NumPy — не в замере
+
+    started = time.perf_counter()
+    scalar = [calc_totals(price, plan, rate)["total_rub"] for price, plan in zip(prices, chosen)]
+    scalar_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    batch = price_batch(prices, chosen, rate).tolist()
+    batch_seconds = time.perf_counter() - started
+
+    # Таблица — по сетке «типичных» цен, как у каталога; поиск итога вместо формулы
+    grid = sorted(set(prices[:1000]))
+    started = time.perf_counter()
+    table = QuoteTable(rate, grid)
+    table_seconds = time.perf_counter() - started
+    in_grid = set(grid)
+    lookups = [(price, plan) for price, plan in zip(prices, chosen) if price in in_grid]
+    started = time.perf_counter()
+    for price, plan in lookups:
+        table.total(price, plan, rate)
+    lookup_seconds = time.perf_counter() - started
+    return {
+        "pairs": count,
+        "identical": scalar == batch,
+        "scalar_per_second": round(count / scalar_seconds),
+        "batch_per_second": round(count / batch_seconds),
+        "table_prices": len(grid),
+        "table_build_ms": round(table_seconds * 1000, 2),
+        "lookups_per_second": round(len(lookups) / lookup_seconds) if lookups else 0,
+    }
+
+
+def print_pricing(result: Dict[str, Any]) -> None:
+    print(f"\n=== {result['pairs']} (price, plan) pairs ===")
+    print(f"  calc_totals one by one: {result['scalar_per_second']:>12,} quotes/s")
+    print(f"  price_batch (NumPy):    {result['batch_per_second']:>12,} quotes/s"
+          f" (x{result['batch_per_second'] / result['scalar_per_second']:.1f}), identical: {result['identical']}")
+    print(f"  QuoteTable of {result['table_prices']} prices x {len(PLAN_MONTHS)} plans: built in {result['table_build_ms']} ms,"
+          f" {result['lookups_per_second']:,} lookups/s")
+
+
+async def amain(args: argparse.Namespace) -> None:
+    if args.cold_start:
+        result = cold_start(args.cold_start)
+        print_cold_start(result)
+        if args.save:
+            with open(args.save, "w") as fh:
+                json.dump(result, fh, indent=2)
+            print(f"\nSaved to {args.save}")
+        if args.max_seconds and result["process_seconds"] > args.max_seconds:
+            raise SystemExit(f"Cold start {result['process_seconds']} s is over the {args.max_seconds} s budget")
+        return
+    if args.start_allocs:
+        result = await start_allocations(args.start_allocs, args)
+        print_start_allocations(result)
+        return
+    if args.pricing:
+        result = pricing_throughput(args.pricing)
+        print_pricing(result)
+        if not result["identical"]:
+            raise SystemExit("price_batch differs from calc_totals")
+        return
+    if args.sessions:
+        result = await session_memory(args.sessions)
+        print_sessions(result)
+        if args.save:
+            with open(args.save, "w") as fh:
+                json.dump(result, fh, indent=2)
+            print(f"\nSaved to {args.save}")
+        return
+    if args.shards:
+        runs = [await run_shards(shards, users, args) for users in args.users for shards in args.shards]
+        print_shards(runs)
+        if args.save:
+            with open(args.save, "w") as fh:
+                json.dump({"cpus": os.cpu_count(), "tg_latency": args.tg_latency, "runs": runs}, fh, indent=2)
+            print(f"\nSaved to {args.save}")
+        return
+    if args.intake:
+        runs = [await run_intake(mode, users, args) for users in args.users for mode in args.intake]
+        print_intake(runs)
+        if args.save:
+            with open(args.save, "w") as fh:
+                json.dump({"tg_latency": args.tg_latency, "runs": runs}, fh, indent=2)
+            print(f"\nSaved to {args.save}")
+        return
+    baseline_runs: Dict[int, Dict[str, Any]] = {}
+    if args.compare:
+        with open(args.compare) as fh:
+            baseline_runs = {run["users"]: run for run in json.load(fh)["runs"]}
+    runs = []
+    for users in args.users:
+        run = await run_level(users, args)
+        print_run(run, baseline_runs.get(users))
+        runs.append(run)
+    if args.save:
+        result = {
+            "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "fsm_storage": args.fsm_storage,
+            "tg_latency": args.tg_latency,
+            "runs": runs,
+        }
+        with open(args.save, "w") as fh:
+            json.dump(result, fh, ensure_ascii=False, indent=2)
+        print(f"\nSaved to {args.save}")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", default="1,10,100,1000", help="comma-separated concurrency levels (up to 10000)")
+    parser.add_argument("--fsm-storage", default="memory", choices=("memory", "sqlite", "redis"))
+    parser.add_argument("--redis-url", help="Redis-protocol server for --fsm-storage redis (default: fakeredis stand-in)")
+    parser.add_argument("--tg-latency", type=float, default=0.0, help="simulated Bot API latency, seconds")
+    parser.add_argument("--max-inflight", type=int, default=0, help="cap on updates handled at once (0 — no cap)")
+    parser.add_argument("--paid-after", type=float, default=1.0, help="stub marks invoices paid after N seconds")
+    parser.add_argument("--settle", type=float, default=0.0, help="wait N seconds for payment checks after the run")
+    parser.add_argument("--no-keepalive", action="store_true", help="new web API connection per request (baseline)")
+    parser.add_argument("--web-port", type=int, default=18300)
+    parser.add_argument("--log-level", default="ERROR", help="bot log level during the run")
+    parser.add_argument("--save", help="write results as JSON (baseline)")
+    parser.add_argument("--compare", help="baseline JSON to compare against")
+    parser.add_argument("--sessions", type=int, default=0, help="measure memory of N open order sessions instead")
+    parser.add_argument("--start-allocs", type=int, default=0, help="measure bytes allocated per /start over N updates instead")
+    parser.add_argument("--pricing", type=int, default=0, help="benchmark pricing of N (price, plan) pairs instead")
+    parser.add_argument("--intake", default="", help="compare update intake modes instead, e.g. polling,webhook")
+    parser.add_argument("--cold-start", type=int, default=0, help="time N cold starts of the bot instead")
+    parser.add_argument("--max-seconds", type=float, default=0.0, help="with --cold-start: fail if the median is over this")
+    parser.add_argument("--shards", default="", help="compare sharded runs instead, e.g. 1,2,4 worker processes")
+    parser.add_argument("--shard-port", type=int, default=18310, help="first shard worker port for --shards")
+    parser.add_argument("--shard-lanes", type=int, default=16, help="intake lanes of the shard router")
+    parser.add_argument("--shard-timeout", type=float, default=300.0, help="give up waiting for a --shards run after N seconds")
+    args = parser.parse_args()
+    args.shards = [int(value) for value in args.shards.split(",") if value.strip()]
+    args.intake = [mode for mode in args.intake.split(",") if mode.strip()]
+    if any(mode not in ("polling", "webhook") for mode in args.intake):
+        parser.error("--intake takes polling and/or webhook")
+    args.users = [int(value) for value in args.users.split(",") if value.strip()]
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    logging.basicConfig(level=args.log_level.upper())
+    asyncio.run(amain(args))
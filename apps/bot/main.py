@@ -1,9 +1,15 @@
+import time
+
+# До импорта aiogram: время импортов попадает в лог запуска
+STARTED_AT = time.perf_counter()
+
 import asyncio
 import contextlib
+import logging
 import math
-from typing import Any, Dict, Union
+from types import SimpleNamespace
+from typing import Any, Dict, Optional, Tuple, Union
 
-import httpx
 from aiogram import Bot, Dispatcher, F
 from aiogram.filters import Command, CommandStart
 from aiogram.fsm.context import FSMContext
@@ -12,14 +18,65 @@ from aiogram.types import (
     CallbackQuery,
     InlineKeyboardButton,
     InlineKeyboardMarkup,
+    InlineQuery,
+    InlineQueryResultArticle,
+    InputTextMessageContent,
     Message,
-    WebAppInfo,
 )
 
-from config import get_settings
-
-
-pending_payments: Dict[str, asyncio.Task] = {}
+from admin import ISSUE_TEXT, activated_text, register_admin_handlers
+from adminfeed import AdminFeed
+from broadcast import Broadcaster
+from catalog import ServiceCatalog
+from config import Settings, SettingsWatcher, get_settings
+from events import build_events_app
+from http_client import build_http_client, retarget_http_client
+from instrumentation import (
+    HandlerTimingMiddleware,
+    TelegramTimingMiddleware,
+    build_metrics_app,
+    configure_logging,
+    register_collector,
+    sender_collector,
+    setup_logging,
+)
+from invoices import InvoiceClient, invoice_key
+from lifecycle import Lifecycle
+from keyboards import (
+    RenderCache,
+    confirm_keyboard,
+    order_actions_keyboard,
+    payment_keyboard,
+    plan_keyboard,
+    price_keyboard,
+    service_search_keyboard,
+    service_suggestions_keyboard,
+)
+from middlewares import DedupMiddleware, UserGuardMiddleware
+from orders import (
+    ACTIVATED,
+    CANCELED,
+    EXPIRED,
+    INVOICED,
+    ISSUE,
+    PAID,
+    InvalidTransition,
+    Order,
+    OrderRepository,
+    OutgoingMessage,
+)
+from outbox import SECRET_MARK, OutboxWorker, secret_key
+from payments import PAID_STATUSES, PaymentPoller, StatusHandler, resume_pending
+from pricing import PricingParams, QuoteBook
+from profiling import LoopLagMonitor, SamplingProfiler
+from sender import PRIORITY_ADMIN, PRIORITY_CUSTOMER, SendQueue
+from server import AppServer
+from sharding import HashRing, run_shard_worker, run_sharded
+from webhook import run_webhook
+from rates import RATE_URLS, RateCache, RateProviders
+from renewals import DAY, RenewalScheduler
+from sessions import OrderDraft, SecretVault, Sweeper, session_key
+from storage import advance, build_storage
 
 
 PLAN_LABELS = {
@@ -28,14 +85,10 @@ PLAN_LABELS = {
     "9m": "9 месяцев",
     "12m": "12 месяцев",
 }
-PLAN_CHOICES = [
-    ("1m", "1 месяц"),
-    ("3m", "3 месяца"),
-    ("9m", "9 месяцев"),
-    ("12m", "12 месяцев"),
-]
 COMMISSION_PCT = 0.25  # legacy, not used in new formula
 
+log = logging.getLogger("bot")
+
 
 class OrderForm(StatesGroup):
     service = State()
@@ -47,110 +100,8 @@ class OrderForm(StatesGroup):
     payment = State()
     notes = State()
     confirm = State()
-
-
-def build_main_menu(webapp_url: str, support_url: str | None = None, privacy_url: str | None = None) -> InlineKeyboardMarkup:
-    buttons = []
-    if webapp_url.startswith("https://"):
-        buttons.append([
-            InlineKeyboardButton(
-                text="Мини‑приложение", web_app=WebAppInfo(url=webapp_url)
-            )
-        ])
-    else:
-        buttons.append([
-            InlineKeyboardButton(text="Мини‑приложение", url=webapp_url)
-        ])
-    buttons.append([
-        InlineKeyboardButton(text="Оформить в чате", callback_data="chat:start")
-    ])
-    if support_url:
-        buttons.append([InlineKeyboardButton(text="Поддержка", url=support_url)])
-    else:
-        buttons.append([InlineKeyboardButton(text="Поддержка", callback_data="support:open")])
-    if privacy_url:
-        buttons.append([InlineKeyboardButton(text="Политика конфиденциальности", url=privacy_url)])
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
-
-
-def plan_keyboard() -> InlineKeyboardMarkup:
-    rows = [
-        [InlineKeyboardButton(text=label, callback_data=f"chat:plan:{value}")]
-        for value, label in PLAN_CHOICES
-    ]
-    rows.append([InlineKeyboardButton(text="Отмена", callback_data="chat:cancel")])
-    return InlineKeyboardMarkup(inline_keyboard=rows)
-
-
-def confirm_keyboard() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text="Подтвердить", callback_data="chat:confirm")],
-            [InlineKeyboardButton(text="Изменить", callback_data="chat:restart")],
-            [InlineKeyboardButton(text="Отмена", callback_data="chat:cancel")],
-        ]
-    )
-
-
-def payment_keyboard() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text="Оплатить через ЮKassa", callback_data="chat:payment:yookassa")],
-            [InlineKeyboardButton(text="Отмена", callback_data="chat:cancel")],
-        ]
-    )
-
-
-async def fetch_usd_rub_rate() -> float:
-    urls = [
-        "https://api.exchangerate.host/latest?base=USD&symbols=RUB",
-        "https://open.er-api.com/v6/latest/USD",
-    ]
-    async with httpx.AsyncClient(timeout=10) as client:
-        last_error: Exception | None = None
-        for url in urls:
-            try:
-                res = await client.get(url)
-                res.raise_for_status()
-                data = res.json()
-                if "rates" in data and "RUB" in data["rates"]:
-                    rate = float(data["rates"]["RUB"])
-                else:
-                    rate = float(data.get("result"))
-                if rate > 0:
-                    return rate
-            except Exception as exc:  # noqa: BLE001
-                last_error = exc
-        raise RuntimeError(f"Не удалось получить курс USD/RUB: {last_error}")
-
-
-def calc_totals(price_usd: float, plan: str, rate: float) -> Dict[str, float]:
-    """Replicates mini-app pricing:
-    final = ceil( ( usd * (fx + 4) * (1 + 0.03 + 0.001*usd) + 750 ) / 10 ) * 10
-    where usd is total USD for the chosen plan (price_usd * months).
-    """
-    months_num = {
-        "1m": 1,
-        "3m": 3,
-        "9m": 9,
-        "12m": 12,
-    }.get(plan, 1)
-    total_usd = max(0.0, price_usd) * months_num
-    delta_rate = 4
-    fixed_fee = 750
-    commission = 0.03 + 0.001 * total_usd
-    base_rub = total_usd * (rate + delta_rate)
-    price_with_commission = base_rub * (1.0 + commission)
-    final_rub = math.ceil((price_with_commission + fixed_fee) / 10.0) * 10
-    commission_rub = max(0, int(final_rub - base_rub))
-    return {
-        "months": months_num,
-        "rate": rate,
-        "base_usd": total_usd,
-        "base_rub": base_rub,
-        "commission_rub": commission_rub,
-        "total_rub": int(final_rub),
-    }
+    # Продление: всё, кроме пароля, берётся из прошлого заказа
+    renewal_password = State()
 
 
 def format_user_summary(data: Dict[str, Any], calc: Dict[str, Any]) -> str:
@@ -205,7 +156,8 @@ def build_paid_message(order: Dict[str, Any], calc: Dict[str, Any], tg_user) ->
         f"<b>🛒 Сервис:</b> {order['service']}",
         order.get('creator') and f"<b>🔗 Автор:</b> <code>{order['creator']}</code>",
         f"<b>📧 Логин:</b> <code>{order['login']}</code>",
-        f"<b>🔐 Пароль:</b> <code>{order['password']}</code>",
+        f"<b>🔐 Пароль:</b> <code>{order['password']}</code>" if order.get('password')
+        else "<b>🔐 Пароль:</b> не сохраняется ботом — см. метаданные платежа в ЮKassa",
         f"<b>📅 Тариф:</b> {plan_text}",
         f"<b>💵 Цена/мес:</b> {order['price']} USD",
         f"<b>🧮 Расчёт:</b> база {fmt(base_rub)}₽ + {fmt(commission_rub)}₽ комиссия ({commission_pct}%)",
@@ -218,41 +170,137 @@ def build_paid_message(order: Dict[str, Any], calc: Dict[str, Any], tg_user) ->
     return "\n".join([line for line in lines if line])
 
 
-async def send_start_card(message: Message, settings) -> None:
-    menu = build_main_menu(settings.webapp_url, settings.support_url, settings.privacy_url)
-    text = (
-        "<b>BazarPaySub</b>\n"
-        "Анонимная оплата подписок на зарубежные сервисы сервисы."
-        "\n\nВыберите, как оформить заказ."
+def order_fields(order: Order, password: Optional[str] = None) -> Tuple[Dict[str, Any], Any]:
+    """Order row → (order dict, user) in the shape ``build_paid_message`` expects."""
+    fields = {
+        "service": order.service,
+        "login": order.login,
+        "password": password,
+        "creator": order.creator,
+        "plan": order.plan,
+        "price": order.price_usd,
+        "payment": order.payment_method,
+        "notes": order.notes,
+    }
+    user = SimpleNamespace(id=order.user_id, full_name=order.full_name or 'неизвестен', username=order.username)
+    return fields, user
+
+
+def build_app(settings: Settings, bot: Bot) -> Tuple[Dispatcher, Lifecycle]:
+    """Dispatcher with all handlers and middlewares, and the lifecycle of the
+    components behind it (not started). Shared by ``main`` and ``loadtest``."""
+    render = RenderCache(settings)
+    storage = build_storage(settings)
+    dp = Dispatcher(storage=storage)
+    dp["render"] = render
+    lifecycle = Lifecycle(settings.shutdown_timeout)
+    dp.update.outer_middleware(lifecycle.tracker)
+    dp.update.outer_middleware(DedupMiddleware())
+    guard = UserGuardMiddleware(settings.throttle_rate, settings.throttle_burst)
+    dp.message.outer_middleware(guard)
+    dp.callback_query.outer_middleware(guard)
+    dp.message.middleware(HandlerTimingMiddleware())
+    dp.callback_query.middleware(HandlerTimingMiddleware())
+    http = build_http_client(settings)
+    dp["http"] = http
+    dp["invoices"] = InvoiceClient(http, concurrency=settings.http_max_connections)
+    poller = PaymentPoller(
+        http,
+        first_delay=settings.payment_poll_first_delay,
+        max_delay=settings.payment_poll_max_delay,
+        max_age=settings.payment_poll_max_age,
+        concurrency=settings.payment_poll_concurrency,
+        use_batch=settings.payment_status_batch,
     )
-    if settings.start_card_image_url:
-        try:
-            await message.answer_photo(
-                settings.start_card_image_url,
-                caption=text,
-                reply_markup=menu,
-                parse_mode="HTML",
-            )
-            return
-        except Exception:  # noqa: BLE001
-            pass
-    await message.answer(text, reply_markup=menu, parse_mode="HTML")
-
-
-async def main():
-    settings = get_settings()
-    bot = Bot(settings.bot_token)
-    dp = Dispatcher()
+    dp["poller"] = poller
+    # Лимиты Telegram общие на бота — в шардированном режиме делим их между воркерами
+    shards = settings.bot_shards if settings.shard_index is not None else 1
+    sender = SendQueue(
+        bot,
+        global_rate=settings.tg_global_rate / shards,
+        chat_rate=settings.tg_chat_rate,
+        group_rate=settings.tg_group_rate / shards,
+    )
+    dp["sender"] = sender
+    register_collector("sender", sender_collector(sender))
+    orders = OrderRepository(settings.orders_db_path)
+    # Уведомления об оплатах менеджеру копятся в окне и уходят одним сообщением
+    admin_feed = AdminFeed(sender, bot, settings.admin_chat_id, window=settings.admin_digest_window)
+    dp["admin_feed"] = admin_feed
+    # Пароль из диалога не пишется ни в FSM-хранилище, ни в outbox — живёт только здесь
+    vault = SecretVault(settings.secret_ttl)
+    outbox = OutboxWorker(sender, orders, settings.admin_chat_id, feed=admin_feed, secrets=vault)
+    dp["orders"] = orders
+    dp["outbox"] = outbox
+    broadcaster = Broadcaster(sender, orders, outbox, settings.admin_chat_id, rate=settings.broadcast_rate)
+    dp["broadcaster"] = broadcaster
+    renewals = RenewalScheduler(orders, outbox, lead=settings.renewal_remind_days * DAY)
+    loop_monitor = LoopLagMonitor(settings.loop_lag_threshold)
+    profiler = SamplingProfiler(settings.profile_dir)
+    dp["profiler"] = profiler
+    pricing = PricingParams(
+        delta_rate=settings.pricing_delta_rate,
+        fixed_fee=settings.pricing_fixed_fee,
+        base_commission=settings.pricing_base_commission,
+        commission_per_usd=settings.pricing_commission_per_usd,
+    )
+    providers = RateProviders(http, settings.rate_urls or RATE_URLS, hedge_delay=settings.rate_hedge_delay)
+    rate_cache = RateCache(
+        providers.fetch,
+        ttl=settings.rate_ttl,
+        max_staleness=settings.rate_max_staleness,
+        fallback=settings.usd_rub_rate_fallback,
+    )
+    catalog = ServiceCatalog(settings.service_catalog_path, settings.settings_reload_interval)
+    dp["catalog"] = catalog
+    # Итоги по типичным ценам каталога для всех сроков — пересчитываются с каждым новым курсом
+    quotes = QuoteBook(pricing)
+    rate_cache.subscribe(lambda rate: quotes.update(rate=rate))
+    catalog.subscribe(lambda changed: quotes.update(prices=changed.prices()))
+
+    def payment_handler(order: Order, password: Optional[str] = None) -> StatusHandler:
+        """Final-status callback for an invoiced order; works from the stored row,
+        so invoices resumed after a restart notify the customer and admin too."""
+        fields, user = order_fields(order, password)
+        chat_id = order.chat_id or order.user_id
+
+        async def on_payment_final(status: str):
+            if status in PAID_STATUSES:
+                messages = [
+                    OutgoingMessage(
+                        settings.admin_chat_id,
+                        build_paid_message(fields, order.calc, user),
+                        parse_mode="HTML",
+                        reply_markup=order_actions_keyboard(order.id).model_dump(exclude_none=True),
+                        dedup_key=f"payment:{order.payment_id}",
+                    ),
+                    OutgoingMessage(chat_id, "✅ Оплата получена!\nВ течение 15–60 минут мы оформим подписку."),
+                ]
+                await orders.transition(order.id, PAID, messages=messages)
+            elif status == 'canceled':
+                await orders.transition(order.id, CANCELED, messages=[OutgoingMessage(
+                    chat_id, "Платёж отменён. Если хотите попробовать снова, создайте заказ заново."
+                )])
+            else:
+                # Останавливаем опрос — решение придёт через вебхук
+                await orders.transition(order.id, EXPIRED, messages=[OutgoingMessage(
+                    chat_id, "ℹ️ Статус оплаты обновится через несколько минут автоматически."
+                )])
+            outbox.wake()
+
+        return on_payment_final
+
+    dp["payment_handler"] = payment_handler
 
     @dp.message(CommandStart())
     async def start(m: Message, state: FSMContext):
         await state.clear()
-        await send_start_card(m, settings)
+        await render.send_start_card(m)
 
     @dp.message(Command("help"))
     async def help_cmd(m: Message, state: FSMContext):
         await state.clear()
-        await send_start_card(m, settings)
+        await render.send_start_card(m)
 
     @dp.message(Command("support", "поддержка"))
     async def support_cmd(m: Message, state: FSMContext):
@@ -261,13 +309,7 @@ async def main():
             "Поддержка\n\n"
             "Если у вас возникли вопросы по оплате или оформлению подписки — воспользуйтесь кнопкой ниже."
         )
-        # Если есть прямая ссылка — сразу открываем чат менеджера через URL‑кнопку.
-        if settings.support_url:
-            kb = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="Написать менеджеру", url=settings.support_url)]])
-        else:
-            # Иначе — покажем callback, который отправит инструкцию.
-            kb = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="Написать менеджеру", callback_data="support:open")]])
-        await m.answer(text, reply_markup=kb)
+        await m.answer(text, reply_markup=render.support_menu)
 
     # Команда политики конфиденциальности
     @dp.message(Command("privacy", "policy", "политика"))
@@ -277,39 +319,34 @@ async def main():
             "Политика конфиденциальности\n\n"
             "Подробно о том, какие данные мы обрабатываем и как защищаем — по ссылке ниже."
         )
-        kb = InlineKeyboardMarkup(
-            inline_keyboard=[[InlineKeyboardButton(text="Открыть политику", url=settings.privacy_url)]]
-        )
-        await m.answer(text, reply_markup=kb)
+        await m.answer(text, reply_markup=render.privacy_menu)
 
     # Открыть поддержку (фолбэк для случаев без прямой ссылки)
     @dp.callback_query(F.data == "support:open")
     async def support_open(call: CallbackQuery):
         await call.answer()
-        url = settings.support_url or "https://t.me/aibazaru"
-        kb = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="Открыть чат менеджера", url=url)]])
-        await call.message.answer("Свяжитесь с менеджером по кнопке ниже:", reply_markup=kb)
+        await call.message.answer("Свяжитесь с менеджером по кнопке ниже:", reply_markup=render.support_chat_menu)
 
     # Совместимость со старым callback (если остался где‑то в истории)
     @dp.callback_query(F.data == "support:contact")
     async def support_contact(call: CallbackQuery):
         await call.answer()
-        url = settings.support_url or "https://t.me/aibazaru"
-        kb = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="Открыть чат менеджера", url=url)]])
-        await call.message.answer("Свяжитесь с менеджером по кнопке ниже:", reply_markup=kb)
+        await call.message.answer("Свяжитесь с менеджером по кнопке ниже:", reply_markup=render.support_chat_menu)
 
     @dp.message(Command("cancel"))
     async def cancel_cmd(m: Message, state: FSMContext):
         await state.clear()
-        await m.answer("Заявка отменена. Чтобы начать заново, выберите вариант ниже.", reply_markup=build_main_menu(settings.webapp_url, settings.support_url, settings.privacy_url))
+        vault.discard(session_key(state.key))
+        await m.answer("Заявка отменена. Чтобы начать заново, выберите вариант ниже.", reply_markup=render.main_menu)
 
     @dp.callback_query(F.data == "chat:cancel")
     async def cancel_cb(call: CallbackQuery, state: FSMContext):
         await call.answer("Заявка отменена", show_alert=False)
         await state.clear()
+        vault.discard(session_key(state.key))
         with contextlib.suppress(Exception):
             await call.message.edit_reply_markup()
-        await call.message.answer("Заявка отменена. Вы можете начать заново.", reply_markup=build_main_menu(settings.webapp_url, settings.support_url, settings.privacy_url))
+        await call.message.answer("Заявка отменена. Вы можете начать заново.", reply_markup=render.main_menu)
 
     @dp.callback_query(F.data == "chat:restart")
     async def restart_cb(call: CallbackQuery, state: FSMContext):
@@ -321,9 +358,11 @@ async def main():
 
     async def start_chat_flow(call: CallbackQuery, state: FSMContext):
         await state.clear()
+        vault.discard(session_key(state.key))
         await state.set_state(OrderForm.service)
         await call.message.answer(
-            "Давайте оформим заказ в чате.\nВведите сервис (например: Chatgpt, Patreon, Lovable).\n\nМожно отменить в любой момент командой /cancel."
+            "Давайте оформим заказ в чате.\nВведите сервис (например: Chatgpt, Patreon, Lovable).\n\nМожно отменить в любой момент командой /cancel.",
+            reply_markup=service_search_keyboard() if len(catalog) else None,
         )
 
     @dp.callback_query(F.data == "chat:start")
@@ -331,12 +370,53 @@ async def main():
         await call.answer()
         await start_chat_flow(call, state)
 
+    async def choose_service(m: Message, state: FSMContext, service: str) -> None:
+        await advance(state, OrderForm.login, service=service)
+        await m.answer("Введите логин, под которым оформлена подписка:")
+
     @dp.message(OrderForm.service)
     async def service_step(m: Message, state: FSMContext):
-        service = m.text.strip()
-        await state.update_data(service=service)
-        await state.set_state(OrderForm.login)
-        await m.answer("Введите логин, под которым оформлена подписка:")
+        text = m.text.strip()
+        service = catalog.match(text)
+        if service is not None:
+            # Любое написание из каталога («chat gpt», «Чатгпт») сводится к одному названию
+            await choose_service(m, state, service.name)
+            return
+        suggestions = catalog.search(text, 5)
+        if not suggestions:
+            await choose_service(m, state, text)
+            return
+        # Введённое название ждёт в сессии, пока клиент не выберет вариант
+        await state.update_data(service=text)
+        await m.answer(
+            "Уточните сервис — выберите из каталога или оставьте, как написали:",
+            reply_markup=service_suggestions_keyboard(suggestions, text),
+        )
+
+    @dp.callback_query(OrderForm.service, F.data.startswith("chat:svc:"))
+    async def service_choice(call: CallbackQuery, state: FSMContext):
+        await call.answer()
+        service = catalog.get(call.data.split(":", 2)[2])
+        name = service.name if service is not None else (await state.get_data()).get("service")
+        if not name:
+            await call.message.answer("Введите сервис (например: Chatgpt, Patreon, Lovable):")
+            return
+        with contextlib.suppress(Exception):
+            await call.message.edit_reply_markup()
+        await choose_service(call.message, state, name)
+
+    @dp.inline_query()
+    async def service_inline(query: InlineQuery):
+        results = [
+            InlineQueryResultArticle(
+                id=service.id,
+                title=service.name,
+                description=f"≈ {service.price_usd:g} USD/мес" if service.price_usd else None,
+                input_message_content=InputTextMessageContent(message_text=service.name),
+            )
+            for service in catalog.search(query.query, 20)
+        ]
+        await query.answer(results, cache_time=60, is_personal=False)
 
     @dp.message(OrderForm.login)
     async def login_step(m: Message, state: FSMContext):
@@ -344,8 +424,7 @@ async def main():
         if not login:
             await m.answer("Введите логин")
             return
-        await state.update_data(login=login)
-        await state.set_state(OrderForm.password)
+        await advance(state, OrderForm.password, login=login)
         await m.answer("Введите пароль от аккаунта (используется только для оплаты, не хранится):")
 
     @dp.message(OrderForm.password)
@@ -354,31 +433,52 @@ async def main():
         if not password:
             await m.answer("Пароль не может быть пустым")
             return
-        await state.update_data(password=password)
-        await state.set_state(OrderForm.creator)
+        vault.put(session_key(state.key), password)
+        data = await state.get_data()
+        if data.get("reenter_password"):
+            # Пароль запрошен повторно на шаге оплаты — остальное уже введено, сразу к сводке
+            await show_summary(m, state, data)
+            return
+        service = catalog.match(data.get("service"))
+        if service is not None and not service.asks("creator"):
+            # Ссылка на сервис известна из каталога — шаг с автором пропускаем
+            await advance(state, OrderForm.plan, creator=service.url or service.name)
+            await m.answer("Выберите срок подписки:", reply_markup=plan_keyboard())
+            return
+        await advance(state, OrderForm.creator)
         await m.answer("Пришлите ссылку на сервив / автора, на который оформляем подписку:")
 
     @dp.message(OrderForm.creator)
     async def creator_step(m: Message, state: FSMContext):
         creator = m.text.strip()
-        await state.update_data(creator=creator)
-        await state.set_state(OrderForm.plan)
+        await advance(state, OrderForm.plan, creator=creator)
         await m.answer("Выберите срок подписки:", reply_markup=plan_keyboard())
 
     @dp.callback_query(OrderForm.plan, F.data.startswith("chat:plan:"))
     async def plan_choice(call: CallbackQuery, state: FSMContext):
         await call.answer()
         plan = call.data.split(":")[-1]
-        await state.update_data(plan=plan)
-        await state.set_state(OrderForm.price)
+        await advance(state, OrderForm.price, plan=plan)
         with contextlib.suppress(Exception):
             await call.message.edit_reply_markup()
+        service = catalog.match((await state.get_data()).get("service"))
+        if service is not None and service.price_usd:
+            await call.message.answer(
+                f"Введите стоимость подписки в месяц (USD).\nОбычно {service.name} стоит {service.price_usd:g} USD — "
+                "можно выбрать кнопкой.",
+                reply_markup=price_keyboard(service.price_usd, quotes.total(service.price_usd, plan)),
+            )
+            return
         await call.message.answer("Введите стоимость подписки в месяц (USD):")
 
     @dp.message(OrderForm.plan)
     async def plan_text_prompt(m: Message):
         await m.answer("Пожалуйста, выберите срок подписки с помощью кнопок ниже.", reply_markup=plan_keyboard())
 
+    async def set_price(m: Message, state: FSMContext, price: float) -> None:
+        await advance(state, OrderForm.notes, price=price)
+        await m.answer("Дополнительная информация (если нет — отправьте '-'):")
+
     @dp.message(OrderForm.price)
     async def price_step(m: Message, state: FSMContext):
         text = m.text.replace(',', '.').strip()
@@ -390,205 +490,172 @@ async def main():
         if price <= 0:
             await m.answer("Стоимость должна быть больше 0")
             return
-        await state.update_data(price=price)
-        await state.set_state(OrderForm.notes)
-        await m.answer("Дополнительная информация (если нет — отправьте '-'):")
+        await set_price(m, state, price)
 
+    @dp.callback_query(OrderForm.price, F.data.startswith("chat:price:"))
+    async def price_choice(call: CallbackQuery, state: FSMContext):
+        await call.answer()
+        with contextlib.suppress(Exception):
+            await call.message.edit_reply_markup()
+        await set_price(call.message, state, float(call.data.split(":")[-1]))
 
-    @dp.message(OrderForm.notes)
-    async def notes_step(m: Message, state: FSMContext):
-        notes_raw = m.text.strip()
-        notes = '' if notes_raw in {'-', 'нет', 'Нет', 'no', 'No'} else notes_raw
-        await state.update_data(notes=notes)
 
-        data = await state.get_data()
+    async def show_summary(m: Message, state: FSMContext, data: Dict[str, Any]) -> None:
+        """Quote the order at the current rate and ask for confirmation."""
         try:
-            rate = await fetch_usd_rub_rate()
+            rate = await rate_cache.get()
         except Exception as exc:  # noqa: BLE001
             await m.answer(f"Не удалось получить курс USD/RUB: {exc}. Попробуйте позже.")
             await state.clear()
+            vault.discard(session_key(state.key))
             return
 
-        calc = calc_totals(data['price'], data['plan'], rate)
-        await state.update_data(calc=calc)
-        await state.set_state(OrderForm.confirm)
+        # В сессии храним только курс — расчёт детерминирован и повторяется при оплате
+        await advance(state, OrderForm.confirm, notes=data.get('notes') or '', rate=rate)
+        draft = OrderDraft.from_data({**data, "rate": rate})
         summary = format_user_summary(
-            {
-                "service": data['service'],
-                "login": data['login'],
-                "password": data['password'],
-                "creator": data['creator'],
-                "plan": data['plan'],
-                "price": data['price'],
-                "payment": 'yookassa',  # По умолчанию ЮKassa
-                "notes": notes,
-            },
-            calc,
+            # По умолчанию ЮKassa
+            draft.as_order('yookassa', vault.peek(session_key(state.key)) or data.get('password')),
+            draft.calc(pricing, quotes.table),
         )
         await m.answer(summary, reply_markup=confirm_keyboard())
 
+    @dp.message(OrderForm.notes)
+    async def notes_step(m: Message, state: FSMContext):
+        notes_raw = m.text.strip()
+        notes = '' if notes_raw in {'-', 'нет', 'Нет', 'no', 'No'} else notes_raw
+        data = await state.get_data()
+        await show_summary(m, state, {**data, "notes": notes})
+
+    @dp.callback_query(F.data.startswith("renew:"))
+    async def renew_cb(call: CallbackQuery, state: FSMContext, orders: OrderRepository):
+        raw_id = call.data.split(":", 1)[1]
+        order = await orders.get(int(raw_id)) if raw_id.isdigit() else None
+        if order is None or order.user_id != call.from_user.id:
+            with contextlib.suppress(Exception):
+                await call.answer("Заказ не найден", show_alert=True)
+            return
+        await call.answer()
+        await state.clear()
+        vault.discard(session_key(state.key))
+        await advance(
+            state,
+            OrderForm.renewal_password,
+            service=order.service,
+            login=order.login or '',
+            creator=order.creator or '',
+            plan=order.plan,
+            price=order.price_usd,
+            notes='',
+        )
+        await call.message.answer(
+            f"Продлеваем {order.service} для {order.login or 'прежнего аккаунта'}.\n"
+            "Введите пароль от аккаунта (используется только для оплаты, не хранится):"
+        )
+
+    @dp.message(OrderForm.renewal_password)
+    async def renewal_password_step(m: Message, state: FSMContext):
+        password = m.text.strip()
+        if not password:
+            await m.answer("Пароль не может быть пустым")
+            return
+        vault.put(session_key(state.key), password)
+        await show_summary(m, state, await state.get_data())
+
     @dp.callback_query(OrderForm.confirm, F.data == "chat:confirm")
     async def confirm_order(call: CallbackQuery, state: FSMContext):
         await call.answer()
-        data = await state.get_data()
-        calc = data['calc']
         await state.set_state(OrderForm.payment)
         with contextlib.suppress(Exception):
             await call.message.edit_reply_markup()
         await call.message.answer("Отлично! Теперь выберите способ оплаты:", reply_markup=payment_keyboard())
 
     @dp.callback_query(OrderForm.payment, F.data.startswith("chat:payment:"))
-    async def payment_step(call: CallbackQuery, state: FSMContext):
+    async def payment_step(
+        call: CallbackQuery,
+        state: FSMContext,
+        invoices: InvoiceClient,
+        poller: PaymentPoller,
+        orders: OrderRepository,
+        outbox: OutboxWorker,
+    ):
         await call.answer()
         payment = call.data.split(":")[-1]
         data = await state.get_data()
-        order = {
-            "service": data['service'],
-            "login": data['login'],
-            "password": data['password'],
-            "creator": data['creator'],
-            "plan": data['plan'],
-            "price": data['price'],
-            "payment": payment,
-            "notes": data.get('notes') or '',
-        }
-        calc = data['calc']
+        # Сессии, начатые до обновления, ещё держат пароль в data
+        password = vault.take(session_key(state.key)) or data.get('password')
+        if not password:
+            # Пароль живёт только в памяти процесса: после перезапуска или SECRET_TTL спрашиваем его снова
+            await advance(state, OrderForm.password, reenter_password=True)
+            with contextlib.suppress(Exception):
+                await call.message.edit_reply_markup()
+            await call.message.answer(
+                "Пароль не сохранился: бот перезапускался или прошло слишком много времени. "
+                "Введите пароль от аккаунта ещё раз, остальные данные заказа сохранены:"
+            )
+            return
+        draft = OrderDraft.from_data(data)
+        order = draft.as_order(payment, password)
+        calc = draft.calc(pricing, quotes.table)
         await state.clear()
         with contextlib.suppress(Exception):
             await call.message.edit_reply_markup()
+        order_id = await orders.create(order, calc, call.from_user, chat_id=call.message.chat.id)
 
         if order['payment'] == 'yookassa':
             await call.message.answer("Создаём счёт в ЮKassa...")
             try:
-                # Берём URL из окружения как есть
-                web_url = settings.payments_base_url
-                
-                async with httpx.AsyncClient(timeout=15) as client:
-                    print(f"Creating payment via: {web_url}/api/yookassa/create")
-                    resp = await client.post(
-                        f"{web_url}/api/yookassa/create",
-                        json={
-                            # initData не используется в боте — прокинем user id в заказ
-                            "order": {
-                                "service": order['service'],
-                                "login": order['login'],
-                                "password": order['password'],
-                                "creatorUrl": order['creator'],
-                                "plan": order['plan'],
-                                "monthlyPriceUsd": order['price'],
-                                "notes": order['notes'],
-                                "paymentMethod": 'yookassa',
-                                "telegramUserId": call.from_user.id,
-                                "telegramUser": {
-                                    "id": call.from_user.id,
-                                    "first_name": getattr(call.from_user, 'first_name', None),
-                                    "last_name": getattr(call.from_user, 'last_name', None),
-                                    "username": getattr(call.from_user, 'username', None),
-                                },
-                            }
-                        },
-                        headers={"Content-Type": "application/json"}
-                    )
-                print(f"Payment creation response: {resp.status_code}")
-                data_resp = resp.json()
-                print(f"Payment creation data: {data_resp}")
-                if resp.status_code >= 400:
-                    raise RuntimeError(data_resp.get('error') or 'Не удалось создать платёж')
-                payment_id = data_resp.get('paymentId')
-                confirmation_url = data_resp.get('confirmationUrl')
-                if not payment_id or not confirmation_url:
-                    raise RuntimeError('Некорректный ответ ЮKassa')
+                invoice = await invoices.create(invoice_key(await orders.get(order_id)), {
+                    "service": order['service'],
+                    "login": order['login'],
+                    "password": order['password'],
+                    "creatorUrl": order['creator'],
+                    "plan": order['plan'],
+                    "monthlyPriceUsd": order['price'],
+                    "notes": order['notes'],
+                    "paymentMethod": 'yookassa',
+                    # initData не используется в боте — прокинем user id в заказ
+                    "telegramUserId": call.from_user.id,
+                    "telegramUser": {
+                        "id": call.from_user.id,
+                        "first_name": getattr(call.from_user, 'first_name', None),
+                        "last_name": getattr(call.from_user, 'last_name', None),
+                        "username": getattr(call.from_user, 'username', None),
+                    },
+                })
+                payment_id = invoice.payment_id
+                log.info("Invoice created", extra={"order_id": order_id, "payment_id": payment_id})
 
                 await call.message.answer(
                     f"Счёт на {int(calc['total_rub'])} ₽ создан. Оплатите по кнопке ниже — после оплаты мы уведомим менеджера.",
                     reply_markup=InlineKeyboardMarkup(
-                        inline_keyboard=[[InlineKeyboardButton(text="Оплатить через ЮKassa", url=confirmation_url)]]
+                        inline_keyboard=[[InlineKeyboardButton(text="Оплатить через ЮKassa", url=invoice.confirmation_url)]]
                     ),
                 )
 
-                async def poll_status():
-                    try:
-                        async with httpx.AsyncClient(timeout=15) as client:
-                            attempts = 0
-                            max_attempts = 24  # ~2 minutes at 5s interval
-                            while True:
-                                await asyncio.sleep(5)
-                                print(f"Checking payment status: {payment_id}")
-                                status_resp = await client.get(
-                                    f"{web_url}/api/yookassa/{payment_id}",
-                                    headers={"Content-Type": "application/json"}
-                                )
-                                print(f"Status check response: {status_resp.status_code}")
-                                data_status = status_resp.json()
-                                print(f"Status data: {data_status}")
-                                if status_resp.status_code >= 400:
-                                    print("Status check failed, breaking")
-                                    break
-                                status = data_status.get('status')
-                                print(f"Payment status: {status}")
-                                if status in {'succeeded', 'waiting_for_capture'}:
-                                    admin_text = build_paid_message(order, calc, call.from_user)
-                                    total_amount = int(calc.get('total_rub') or 0)
-                                    keyboard = InlineKeyboardMarkup(
-                                        inline_keyboard=[
-                                            [InlineKeyboardButton(
-                                                text="✅ Подписка активирована",
-                                                callback_data=f"subscribed:{call.from_user.id}:{total_amount}"
-                                            )],
-                                            [InlineKeyboardButton(
-                                                text="⚠️ Возникли проблемы",
-                                                callback_data=f"issue:{call.from_user.id}"
-                                            )]
-                                        ]
-                                    )
-                                    await call.bot.send_message(
-                                        settings.admin_chat_id,
-                                        admin_text,
-                                        parse_mode="HTML",
-                                        reply_markup=keyboard
-                                    )
-                                    await call.message.answer(
-                                        "✅ Оплата получена!\nВ течение 15–60 минут мы оформим подписку."
-                                    )
-                                    break
-                                if status == 'canceled':
-                                    await call.message.answer("Платёж отменён. Если хотите попробовать снова, создайте заказ заново.")
-                                    break
-                                attempts += 1
-                                if attempts >= max_attempts:
-                                    # Останавливаем опрос — решение придёт через вебхук
-                                    await call.message.answer(
-                                        "ℹ️ Статус оплаты обновится через несколько минут автоматически."
-                                    )
-                                    break
-                    finally:
-                        pending_payments.pop(payment_id, None)
-
-                pending_payments[payment_id] = asyncio.create_task(poll_status())
+                invoiced = await orders.transition(order_id, INVOICED, payment_id=payment_id)
+
+                # При включённом канале событий опрос — только запасной путь после дедлайна
+                first_check = settings.payment_event_deadline if settings.bot_events_token else None
+                poller.add(payment_id, payment_handler(invoiced), delay=first_check)
             except Exception as exc:  # noqa: BLE001
+                log.warning("Invoice creation failed", extra={"order_id": order_id, "error": repr(exc)})
+                with contextlib.suppress(InvalidTransition):
+                    await orders.transition(order_id, CANCELED)
                 await call.message.answer(f"Не удалось создать счёт: {exc}")
             return
 
-        # Остальные методы — сразу отправляем админу с кнопками действий
-        admin_text = build_paid_message(order, calc, call.from_user)
-        keyboard = InlineKeyboardMarkup(
-            inline_keyboard=[
-                [InlineKeyboardButton(
-                    text="✅ Подписка активирована",
-                    callback_data=f"subscribed:{call.from_user.id}:{int(calc['total_rub'])}"
-                )],
-                [InlineKeyboardButton(
-                    text="⚠️ Возникли проблемы",
-                    callback_data=f"issue:{call.from_user.id}"
-                )]
-            ]
-        )
-        await call.bot.send_message(
+        # Остальные методы — сразу отправляем админу с кнопками действий;
+        # в outbox уходит шаблон, пароль подставится из хранилища при отправке
+        vault.put(secret_key(order_id), password)
+        await orders.enqueue([OutgoingMessage(
             settings.admin_chat_id,
-            admin_text,
+            build_paid_message({**order, "password": SECRET_MARK}, calc, call.from_user),
             parse_mode="HTML",
-            reply_markup=keyboard
-        )
+            reply_markup=order_actions_keyboard(order_id).model_dump(exclude_none=True),
+            dedup_key=f"order:{order_id}",
+        )], order_id=order_id)
+        outbox.wake()
         await call.message.answer(
             f"Заказ принят! Итог к оплате: {calc['total_rub']:.0f} ₽. Менеджер свяжется с вами после обработки."
         )
@@ -599,7 +666,7 @@ async def main():
         await start_chat_flow(call, state)
 
     @dp.callback_query(F.data.startswith("paidnotify:"))
-    async def paid_notify_legacy(call: CallbackQuery):
+    async def paid_notify_legacy(call: CallbackQuery, sender: SendQueue, admin_feed: AdminFeed):
         with contextlib.suppress(Exception):
             await call.answer()
         payload = call.data.split(":")
@@ -629,74 +696,215 @@ async def main():
                     "⏰ Доступ будет предоставлен в течение 15–60 минут."
                 )
             try:
-                await call.bot.send_message(user_id, message_text, parse_mode="HTML")
+                await sender.send(user_id, message_text, PRIORITY_CUSTOMER, parse_mode="HTML")
                 sent = True
             except Exception:
                 sent = False
 
-        base_text = call.message.html_text or call.message.text or ''
         status_line = '✅ Клиент уведомлён об успешной оплате.' if sent else '⚠️ Не удалось уведомить клиента (проверьте, писал ли он боту).'
-        try:
-            await call.message.edit_text(
-                base_text + '\n\n' + status_line,
-                parse_mode='HTML'
-            )
-        except Exception:
-            pass
+        admin_feed.resolve(call.message, call.data, status_line)
 
         if not sent:
-            await call.message.answer('⚠️ Сообщение клиенту не доставлено. Клиент должен сначала написать боту в личные сообщения.')
+            sender.submit(call.message.chat.id, '⚠️ Сообщение клиенту не доставлено. Клиент должен сначала написать боту в личные сообщения.', PRIORITY_ADMIN)
+
+    @dp.callback_query(F.data.startswith("order:"))
+    async def order_action_cb(
+        call: CallbackQuery, orders: OrderRepository, outbox: OutboxWorker, admin_feed: AdminFeed
+    ):
+        _, action, raw_id = call.data.split(":", 2)
+        order = await orders.get(int(raw_id)) if raw_id.isdigit() else None
+        if order is None:
+            with contextlib.suppress(Exception):
+                await call.answer("Заказ не найден", show_alert=True)
+            return
+        if action == "activate":
+            status, text, status_line = ACTIVATED, activated_text(order.total_rub), "✅ Клиент уведомлён."
+        else:
+            status, text, status_line = ISSUE, ISSUE_TEXT, "⚠️ Клиенту отправлена просьба связаться с менеджером."
+        recipient = order.chat_id or order.user_id
+        messages = [OutgoingMessage(recipient, text, parse_mode="HTML")] if recipient else []
+        try:
+            await orders.transition(order.id, status, messages=messages)
+        except InvalidTransition as exc:
+            with contextlib.suppress(Exception):
+                await call.answer(str(exc), show_alert=True)
+            return
+        outbox.wake()
+        with contextlib.suppress(Exception):
+            await call.answer()
+        admin_feed.resolve(call.message, call.data, status_line)
 
+    # Сообщения из веб-вебхука и старые сообщения в чате менеджера несут user id в callback_data
     @dp.callback_query(F.data.startswith("subscribed:"))
-    async def subscribed_cb(call: CallbackQuery):
+    async def subscribed_cb(call: CallbackQuery, sender: SendQueue, admin_feed: AdminFeed):
         with contextlib.suppress(Exception):
             await call.answer()
         parts = call.data.split(":")
         user_id = int(parts[1]) if len(parts) > 1 else None
         total = int(parts[2]) if len(parts) > 2 and parts[2].isdigit() else None
         if user_id:
-            text = (
-                "🎉 <b>Подписка оформлена!</b>\n\n"
-                + (f"💰 Сумма: {total} ₽\n" if total else "")
-                + "Хорошего пользования! Если будут вопросы — отвечайте в этом чате."
-            )
-            with contextlib.suppress(Exception):
-                await call.bot.send_message(user_id, text, parse_mode="HTML")
-        with contextlib.suppress(Exception):
-            await call.message.edit_text((call.message.html_text or call.message.text or '') + "\n\n✅ Клиент уведомлён.", parse_mode='HTML')
+            sender.submit(user_id, activated_text(total), PRIORITY_CUSTOMER, parse_mode="HTML")
+        admin_feed.resolve(call.message, call.data, "✅ Клиент уведомлён.")
 
     @dp.callback_query(F.data.startswith("issue:"))
-    async def issue_cb(call: CallbackQuery):
+    async def issue_cb(call: CallbackQuery, sender: SendQueue, admin_feed: AdminFeed):
         with contextlib.suppress(Exception):
             await call.answer()
         parts = call.data.split(":")
         user_id = int(parts[1]) if len(parts) > 1 else None
         if user_id:
-            text = (
-                "⚠️ <b>Возникла проблема с оформлением</b>\n\n"
-                "Пожалуйста, свяжитесь с менеджером, ответив в этом чате, — мы быстро поможем."
-            )
-            with contextlib.suppress(Exception):
-                await call.bot.send_message(user_id, text, parse_mode="HTML")
-        with contextlib.suppress(Exception):
-            await call.message.edit_text((call.message.html_text or call.message.text or '') + "\n\n⚠️ Клиенту отправлена просьба связаться с менеджером.", parse_mode='HTML')
+            sender.submit(user_id, ISSUE_TEXT, PRIORITY_CUSTOMER, parse_mode="HTML")
+        admin_feed.resolve(call.message, call.data, "⚠️ Клиенту отправлена просьба связаться с менеджером.")
 
     @dp.message(OrderForm.payment)
     async def payment_text_prompt(m: Message):
         await m.answer("Выберите способ оплаты кнопками ниже.", reply_markup=payment_keyboard())
 
+    register_admin_handlers(dp)
+
     @dp.message()
     async def fallback(m: Message, state: FSMContext):
         if await state.get_state() is not None:
             await m.answer("Пожалуйста, следуйте инструкциям. Чтобы отменить, используйте /cancel.")
         else:
-            await send_start_card(m, settings)
+            await render.send_start_card(m)
+
+    def apply_settings(new: Settings) -> None:
+        # Обработчики читают settings и pricing из замыкания — подменяем их целиком
+        nonlocal settings, pricing
+        settings = new
+        configure_logging(new.log_level, new.log_sample_rate, new.slow_span_seconds)
+        loop_monitor.threshold = new.loop_lag_threshold
+        profiler.output_dir = new.profile_dir
+        render.refresh(new)
+        retarget_http_client(http, new.payments_base_url)
+        guard.configure(new.throttle_rate, new.throttle_burst)
+        lifecycle.timeout = new.shutdown_timeout
+        outbox.admin_chat_id = str(new.admin_chat_id)
+        admin_feed.admin_chat_id = str(new.admin_chat_id)
+        admin_feed.window = new.admin_digest_window
+        broadcaster.admin_chat_id = str(new.admin_chat_id)
+        broadcaster.bucket.rate = new.broadcast_rate
+        renewals.lead = new.renewal_remind_days * DAY
+        renewals.wake()
+        poller.first_delay = new.payment_poll_first_delay
+        poller.max_delay = new.payment_poll_max_delay
+        poller.max_age = new.payment_poll_max_age
+        poller.use_batch = new.payment_status_batch
+        providers.hedge_delay = new.rate_hedge_delay
+        rate_cache.ttl = rate_cache.refresh_interval = new.rate_ttl
+        rate_cache.max_staleness = new.rate_max_staleness
+        rate_cache.fallback = new.usd_rub_rate_fallback
+        vault.ttl = new.secret_ttl
+        catalog.path = new.service_catalog_path
+        catalog.wake()
+        pricing = PricingParams(
+            delta_rate=new.pricing_delta_rate,
+            fixed_fee=new.pricing_fixed_fee,
+            base_commission=new.pricing_base_commission,
+            commission_per_usd=new.pricing_commission_per_usd,
+        )
+        quotes.update(params=pricing)
+
+    watcher = SettingsWatcher(settings.settings_reload_interval)
+    watcher.subscribe(apply_settings)
+
+    events = None
+    if settings.bot_events_token and settings.shard_index is None:
+        events = AppServer(
+            build_events_app(poller, settings.bot_events_token, orders, outbox, payment_handler),
+            settings.bot_events_host,
+            settings.bot_events_port,
+        )
+
+    metrics = None
+    if settings.metrics_port:
+        metrics_port = settings.metrics_port + (settings.shard_index or 0)
+        metrics = AppServer(build_metrics_app(), settings.metrics_host, metrics_port)
+
+    async def resume_payments() -> None:
+        owns = None
+        if settings.shard_index is not None:
+            ring = HashRing(settings.bot_shards)
+            owns = lambda order: ring.node(order.user_id or order.chat_id or 0) == settings.shard_index  # noqa: E731
+        resumed = await resume_pending(
+            poller, orders, payment_handler, rate=settings.payment_resume_rate / shards, owns=owns
+        )
+        if resumed:
+            log.info("Resumed pending payments", extra={"payments": resumed})
+
+    # Запуск по порядку, остановка — в обратном: сначала приём событий, в конце соединения и базы
+    lifecycle.add("orders", stop=orders.close)
+    lifecycle.add("storage", stop=storage.close)
+    lifecycle.add("http", stop=http.aclose)
+    lifecycle.add("bot", stop=bot.session.close)
+    lifecycle.add("quotes", stop=quotes.stop)
+    lifecycle.add("rates", rate_cache.start, rate_cache.stop)
+    lifecycle.add("catalog", catalog.start, catalog.stop)
+    lifecycle.add("sender", sender.start, sender.stop)
+    lifecycle.add("outbox", outbox.start, outbox.stop)
+    # Останавливается раньше outbox: накопленный дайджест уходит, и outbox успевает отметить доставку
+    lifecycle.add("admin_feed", stop=admin_feed.stop)
+    lifecycle.add("broadcast", broadcaster.start, broadcaster.stop)
+    lifecycle.add("renewals", renewals.start, renewals.stop)
+    lifecycle.add("loop_monitor", loop_monitor.start, loop_monitor.stop)
+    lifecycle.add("profiler", profiler.start, profiler.stop)
+    lifecycle.add("poller", poller.start, poller.stop)
+    sweeper = Sweeper(storage, vault)
+    lifecycle.add("sweeper", sweeper.start, sweeper.stop)
+    lifecycle.add("resume", resume_payments)
+    if events:
+        lifecycle.add("events", events.start, events.stop)
+    if metrics:
+        lifecycle.add("metrics", metrics.start, metrics.stop)
+    lifecycle.add("settings", watcher.start, watcher.stop)
+    return dp, lifecycle
+
+
+async def main():
+    setup_started = time.perf_counter()
+    settings = get_settings()
+    log_listener = setup_logging(settings.log_level, settings.log_sample_rate, settings.slow_span_seconds)
+    bot = Bot(settings.bot_token)
+    bot.session.middleware(TelegramTimingMiddleware())
+    dp, lifecycle = build_app(settings, bot)
+    try:
+        registered_at = time.perf_counter()
+        await lifecycle.start()
+        log.info("Bot started", extra={
+            "import_seconds": round(setup_started - STARTED_AT, 3),
+            "setup_seconds": round(registered_at - setup_started, 3),
+            "start_seconds": round(time.perf_counter() - registered_at, 3),
+        })
+        if settings.shard_index is not None:
+            await run_shard_worker(dp, bot, dp["poller"], settings)
+        elif settings.bot_mode == "webhook":
+            await run_webhook(dp, bot, settings)
+        else:
+            # getUpdates не работает, пока у бота установлен вебхук
+            await bot.delete_webhook()
+            # Сессию закрывает lifecycle — после того как допишутся обработчики и очередь отправки
+            await dp.start_polling(bot, close_bot_session=False)
+    finally:
+        await lifecycle.shutdown()
+        log_listener.stop()
+
 
-    await dp.start_polling(bot)
+def install_uvloop() -> None:
+    try:
+        import uvloop
+    except ImportError:  # Windows / PyPy — остаёмся на стандартном цикле
+        return
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
 
 
 if __name__ == "__main__":
+    install_uvloop()
     try:
-        asyncio.run(main())
+        settings = get_settings()
+        if settings.bot_shards > 1 and settings.shard_index is None:
+            asyncio.run(run_sharded(settings))
+        else:
+            asyncio.run(main())
     except (KeyboardInterrupt, SystemExit):
         pass
@@ -0,0 +1,119 @@
+import asyncio
+import contextlib
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, Update
+
+from instrumentation import Counter
+from sender import TokenBucket
+
+
+UPDATES_DROPPED = Counter("bot_updates_dropped_total", "Updates dropped before reaching a handler.", ("reason",))
+
+Handler = Callable[[Any, Dict[str, Any]], Awaitable[Any]]
+
+
+class LRUSet:
+    """Bounded set that forgets the least recently added keys."""
+
+    def __init__(self, maxsize: int) -> None:
+        self.maxsize = maxsize
+        self._keys: "OrderedDict[Hashable, None]" = OrderedDict()
+
+    def add(self, key: Hashable) -> bool:
+        """Remember ``key``; False if it was already there."""
+        if key in self._keys:
+            self._keys.move_to_end(key)
+            return False
+        self._keys[key] = None
+        if len(self._keys) > self.maxsize:
+            self._keys.popitem(last=False)
+        return True
+
+
+class DedupMiddleware(BaseMiddleware):
+    """Outer ``update`` middleware: drops redelivered updates and repeated callback queries."""
+
+    def __init__(self, maxsize: int = 10000) -> None:
+        self._seen = LRUSet(maxsize)
+
+    async def __call__(self, handler: Handler, event: Update, data: Dict[str, Any]) -> Any:
+        keys = [("update", event.update_id)]
+        if event.callback_query is not None:
+            keys.append(("callback", event.callback_query.id))
+        # Все ключи запоминаем сразу, чтобы повтор по любому из них отсекался
+        fresh = [self._seen.add(key) for key in keys]
+        if not all(fresh):
+            UPDATES_DROPPED.inc("duplicate")
+            return None
+        return await handler(event, data)
+
+
+class UserGuardMiddleware(BaseMiddleware):
+    """Outer ``message``/``callback_query`` middleware: per-user throttling and in-flight lock.
+
+    Each user gets a token bucket (``rate`` per second, ``burst`` at once);
+    updates beyond it are dropped. Messages of one user are handled one at a
+    time in arrival order. A button press while the same user's previous
+    update is still being handled is dropped — that is what absorbs repeated
+    taps on "Оплатить" before they reach the web API.
+    """
+
+    MAX_USERS = 10000
+
+    def __init__(self, rate: float = 2.0, burst: float = 5.0) -> None:
+        self.rate = rate
+        self.burst = burst
+        self._buckets: "OrderedDict[int, TokenBucket]" = OrderedDict()
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self._waiters: Dict[int, int] = {}
+
+    def configure(self, rate: float, burst: float) -> None:
+        """New limits apply to every user from the next update."""
+        self.rate = rate
+        self.burst = burst
+        self._buckets.clear()
+
+    def _bucket(self, user_id: int) -> TokenBucket:
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = self._buckets[user_id] = TokenBucket(self.rate, self.burst)
+            if len(self._buckets) > self.MAX_USERS:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(user_id)
+        return bucket
+
+    async def _drop(self, event: Any, reason: str, text: str) -> None:
+        UPDATES_DROPPED.inc(reason)
+        if isinstance(event, CallbackQuery):
+            # Снимаем «часики» с кнопки, иначе клиент будет ждать ответа
+            with contextlib.suppress(Exception):
+                await event.answer(text)
+
+    async def __call__(self, handler: Handler, event: Any, data: Dict[str, Any]) -> Any:
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+        bucket = self._bucket(user.id)
+        if bucket.delay() > 0:
+            await self._drop(event, "throttled", "Слишком часто, подождите немного")
+            return None
+        bucket.take()
+        lock = self._locks.get(user.id)
+        if lock is None:
+            lock = self._locks[user.id] = asyncio.Lock()
+        if isinstance(event, CallbackQuery) and lock.locked():
+            await self._drop(event, "busy", "Обрабатываем предыдущее действие…")
+            return None
+        self._waiters[user.id] = self._waiters.get(user.id, 0) + 1
+        try:
+            async with lock:
+                return await handler(event, data)
+        finally:
+            self._waiters[user.id] -= 1
+            if not self._waiters[user.id]:
+                del self._waiters[user.id]
+                del self._locks[user.id]
@@ -0,0 +1,756 @@
+import asyncio
+import calendar
+import json
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence
+
+from instrumentation import FUNNEL_TOTAL
+from pricing import PLAN_MONTHS
+
+
+CREATED = "created"
+INVOICED = "invoiced"
+PAID = "paid"
+ACTIVATED = "activated"
+ISSUE = "issue"
+CANCELED = "canceled"
+EXPIRED = "expired"
+
+BROADCAST_DRAFT = "draft"
+BROADCAST_RUNNING = "running"
+BROADCAST_DONE = "done"
+BROADCAST_CANCELED = "canceled"
+
+# Допустимые переходы статусов заказа
+TRANSITIONS = {
+    CREATED: {INVOICED, PAID, ACTIVATED, ISSUE, CANCELED},
+    INVOICED: {PAID, CANCELED, EXPIRED, ISSUE},
+    EXPIRED: {PAID, CANCELED},
+    PAID: {ACTIVATED, ISSUE},
+    ISSUE: {ACTIVATED, ISSUE},
+    ACTIVATED: set(),
+    CANCELED: set(),
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS orders (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER,
+    chat_id INTEGER,
+    username TEXT,
+    full_name TEXT,
+    service TEXT NOT NULL,
+    creator TEXT,
+    login TEXT,
+    plan TEXT NOT NULL,
+    price_usd REAL NOT NULL,
+    total_rub INTEGER NOT NULL,
+    calc TEXT NOT NULL,
+    payment_method TEXT,
+    payment_id TEXT UNIQUE,
+    notes TEXT,
+    status TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    paid_at REAL,
+    activated_at REAL,
+    login_key TEXT,
+    service_key TEXT
+);
+CREATE TABLE IF NOT EXISTS order_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    order_id INTEGER NOT NULL REFERENCES orders(id),
+    status TEXT NOT NULL,
+    at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS order_events_order_id ON order_events (order_id);
+CREATE INDEX IF NOT EXISTS orders_status ON orders (status, id);
+CREATE INDEX IF NOT EXISTS orders_user ON orders (user_id, id);
+CREATE INDEX IF NOT EXISTS orders_paid_at ON orders (paid_at) WHERE paid_at IS NOT NULL;
+CREATE INDEX IF NOT EXISTS orders_login ON orders (login_key, id);
+CREATE INDEX IF NOT EXISTS orders_service ON orders (service_key, id);
+CREATE INDEX IF NOT EXISTS orders_payment ON orders (payment_id) WHERE payment_id IS NOT NULL;
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    order_id INTEGER,
+    chat_id TEXT NOT NULL,
+    text TEXT NOT NULL,
+    parse_mode TEXT,
+    reply_markup TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    sent_at REAL,
+    dead INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    dedup_key TEXT
+);
+CREATE INDEX IF NOT EXISTS outbox_due ON outbox (next_attempt_at) WHERE sent_at IS NULL AND dead = 0;
+CREATE UNIQUE INDEX IF NOT EXISTS outbox_dedup ON outbox (dedup_key) WHERE dedup_key IS NOT NULL;
+CREATE TABLE IF NOT EXISTS broadcasts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    text TEXT NOT NULL,
+    status TEXT NOT NULL,
+    cursor INTEGER NOT NULL DEFAULT 0,
+    total INTEGER NOT NULL DEFAULT 0,
+    sent INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    blocked INTEGER NOT NULL DEFAULT 0,
+    lease_until REAL NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS renewals (
+    order_id INTEGER PRIMARY KEY REFERENCES orders(id),
+    user_id INTEGER,
+    months INTEGER NOT NULL,
+    activated_at REAL NOT NULL,
+    expires_at REAL NOT NULL,
+    reminded_at REAL
+);
+CREATE INDEX IF NOT EXISTS renewals_due ON renewals (expires_at) WHERE reminded_at IS NULL;
+CREATE TABLE IF NOT EXISTS blocked_chats (
+    chat_id INTEGER PRIMARY KEY,
+    blocked_at REAL NOT NULL,
+    error TEXT
+);
+"""
+
+
+@dataclass
+class Order:
+    id: int
+    user_id: Optional[int]
+    chat_id: Optional[int]
+    username: Optional[str]
+    full_name: Optional[str]
+    service: str
+    creator: Optional[str]
+    login: Optional[str]
+    plan: str
+    price_usd: float
+    total_rub: int
+    calc: Dict[str, Any]
+    payment_method: Optional[str]
+    payment_id: Optional[str]
+    notes: Optional[str]
+    status: str
+    created_at: float
+    updated_at: float
+    paid_at: Optional[float]
+    activated_at: Optional[float]
+
+
+@dataclass
+class OutgoingMessage:
+    chat_id: str
+    text: str
+    parse_mode: Optional[str] = None
+    reply_markup: Optional[Dict[str, Any]] = None
+    # Одно уведомление на ключ (например, payment:<id>): повтор из бота или веб-вебхука не ставится в очередь
+    dedup_key: Optional[str] = None
+
+
+@dataclass
+class OutboxItem(OutgoingMessage):
+    id: int = 0
+    order_id: Optional[int] = None
+    attempts: int = 0
+
+
+@dataclass
+class Broadcast:
+    id: int
+    text: str
+    status: str
+    cursor: int
+    total: int
+    sent: int
+    failed: int
+    blocked: int
+    lease_until: float
+    created_at: float
+    updated_at: float
+
+
+class InvalidTransition(RuntimeError):
+    pass
+
+
+def add_months(ts: float, months: int) -> float:
+    """``ts`` plus calendar months; the 31st falls back to the last day of a shorter month."""
+    start = datetime.fromtimestamp(ts)
+    month_index = start.month - 1 + months
+    year, month = start.year + month_index // 12, month_index % 12 + 1
+    day = min(start.day, calendar.monthrange(year, month)[1])
+    return start.replace(year=year, month=month, day=day).timestamp()
+
+
+def _plan_months(order: Order) -> int:
+    return int(order.calc.get('months') or PLAN_MONTHS.get(order.plan, 1))
+
+
+def search_key(text: Optional[str]) -> Optional[str]:
+    """Case-folded form of a login or service for search: SQLite's lower() folds ASCII only."""
+    if text is None:
+        return None
+    return unicodedata.normalize("NFKC", text).casefold().replace("ё", "е")
+
+
+def _order(row: sqlite3.Row) -> Order:
+    data = dict(row)
+    del data['login_key'], data['service_key']
+    data['calc'] = json.loads(data['calc'])
+    return Order(**data)
+
+
+class OrderRepository:
+    """Durable orders with status history and a transactional outbox.
+
+    Status changes and the notifications they cause are written in the same
+    SQLite transaction, so a crash can never leave a paid order without its
+    pending admin/customer messages. Пароль от аккаунта здесь не хранится:
+    в тексте уведомления вместо него метка ``outbox.SECRET_MARK``.
+    """
+
+    def __init__(self, path: str) -> None:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._migrate()
+        self._db.executescript(SCHEMA)
+        self._backfill_renewals()
+
+    def _tx(self, fn, *args):
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(*args)
+                self._db.execute("COMMIT")
+                return result
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+    async def _run(self, fn, *args):
+        return await asyncio.to_thread(self._tx, fn, *args)
+
+    def _migrate(self) -> None:
+        # Базы, созданные до появления dedup_key: колонка нужна раньше индекса из SCHEMA
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(outbox)")}
+        if columns and "dedup_key" not in columns:
+            self._db.execute("ALTER TABLE outbox ADD COLUMN dedup_key TEXT")
+        # Поиск по lower(...) не находил кириллицу в другом регистре: ключи считаются в Python
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(orders)")}
+        if columns and "login_key" not in columns:
+            self._db.execute("BEGIN")
+            self._db.execute("ALTER TABLE orders ADD COLUMN login_key TEXT")
+            self._db.execute("ALTER TABLE orders ADD COLUMN service_key TEXT")
+            self._db.execute("DROP INDEX IF EXISTS orders_login")
+            self._db.execute("DROP INDEX IF EXISTS orders_service")
+            rows = self._db.execute("SELECT id, login, service FROM orders").fetchall()
+            self._db.executemany(
+                "UPDATE orders SET login_key = ?, service_key = ? WHERE id = ?",
+                [(search_key(row['login']), search_key(row['service']), row['id']) for row in rows],
+            )
+            self._db.execute("COMMIT")
+
+    def _backfill_renewals(self) -> None:
+        # Заказы, активированные до появления продлений, — один раз при первом запуске
+        if self._db.execute("SELECT 1 FROM renewals LIMIT 1").fetchone():
+            return
+        self._db.execute("BEGIN")
+        rows = self._db.execute(
+            "SELECT * FROM orders WHERE status = ? AND activated_at IS NOT NULL", (ACTIVATED,)
+        )
+        for row in rows:
+            self._schedule_renewal(_order(row))
+        self._db.execute("COMMIT")
+
+    # --- orders ---
+
+    def _insert(self, order: Dict[str, Any], calc: Dict[str, Any], tg_user, chat_id: Optional[int]) -> int:
+        now = time.time()
+        cur = self._db.execute(
+            "INSERT INTO orders (user_id, chat_id, username, full_name, service, creator, login, plan,"
+            " price_usd, total_rub, calc, payment_method, notes, status, created_at, updated_at, login_key, service_key)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                tg_user.id if tg_user else None,
+                chat_id,
+                tg_user.username if tg_user else None,
+                tg_user.full_name if tg_user else None,
+                order['service'],
+                order.get('creator'),
+                order.get('login'),
+                order['plan'],
+                float(order['price']),
+                int(calc.get('total_rub') or 0),
+                json.dumps(calc),
+                order.get('payment'),
+                order.get('notes') or None,
+                CREATED,
+                now,
+                now,
+                search_key(order.get('login')),
+                search_key(order['service']),
+            ),
+        )
+        order_id = cur.lastrowid
+        self._db.execute(
+            "INSERT INTO order_events (order_id, status, at) VALUES (?, ?, ?)", (order_id, CREATED, now)
+        )
+        if tg_user:
+            # Пользователь снова пишет боту — значит, больше не блокирует его
+            self._db.execute("DELETE FROM blocked_chats WHERE chat_id = ?", (tg_user.id,))
+        return order_id
+
+    async def create(self, order: Dict[str, Any], calc: Dict[str, Any], tg_user, chat_id: Optional[int] = None) -> int:
+        order_id = await self._run(self._insert, order, calc, tg_user, chat_id)
+        FUNNEL_TOTAL.inc(CREATED)
+        return order_id
+
+    def _select(self, order_id: int) -> Optional[Order]:
+        row = self._db.execute("SELECT * FROM orders WHERE id = ?", (order_id,)).fetchone()
+        return _order(row) if row is not None else None
+
+    async def get(self, order_id: int) -> Optional[Order]:
+        return await self._run(self._select, order_id)
+
+    def _by_payment(self, payment_id: str) -> Optional[Order]:
+        row = self._db.execute("SELECT * FROM orders WHERE payment_id = ?", (payment_id,)).fetchone()
+        return _order(row) if row is not None else None
+
+    async def by_payment(self, payment_id: str) -> Optional[Order]:
+        return await self._run(self._by_payment, payment_id)
+
+    def _pending_payments(self, after_id: int, limit: int) -> List[Order]:
+        rows = self._db.execute(
+            "SELECT * FROM orders WHERE status = ? AND payment_id IS NOT NULL AND id > ? ORDER BY id LIMIT ?",
+            (INVOICED, after_id, limit),
+        ).fetchall()
+        return [_order(row) for row in rows]
+
+    async def pending_payments(self, after_id: int = 0, limit: int = 200) -> List[Order]:
+        """Invoiced orders still waiting for payment, by id after ``after_id``."""
+        return await self._run(self._pending_payments, after_id, limit)
+
+    def _by_status(self, status: str, before_id: Optional[int], limit: int) -> List[Order]:
+        rows = self._db.execute(
+            "SELECT * FROM orders WHERE status = ? AND id < ? ORDER BY id DESC LIMIT ?",
+            (status, before_id or 2 ** 63 - 1, limit),
+        ).fetchall()
+        return [_order(row) for row in rows]
+
+    async def by_status(self, status: str, before_id: Optional[int] = None, limit: int = 10) -> List[Order]:
+        """Newest first; pass the last id of a page as ``before_id`` for the next one."""
+        return await self._run(self._by_status, status, before_id, limit)
+
+    def _find(self, term: str, before_id: Optional[int], limit: int) -> List[Order]:
+        term = search_key(term.strip())
+        before_id = before_id or 2 ** 63 - 1
+        if term.lstrip("@").isdigit():
+            rows = self._db.execute(
+                "SELECT * FROM orders WHERE user_id = ? AND id < ? ORDER BY id DESC LIMIT ?",
+                (int(term.lstrip("@")), before_id, limit),
+            ).fetchall()
+            return [_order(row) for row in rows]
+        # Префиксный поиск диапазоном по индексам login_key / service_key
+        upper = term + "\uffff"
+        rows = self._db.execute(
+            "SELECT * FROM orders WHERE id IN ("
+            " SELECT id FROM orders WHERE login_key >= ? AND login_key < ? AND id < ?"
+            " UNION ALL"
+            " SELECT id FROM orders WHERE service_key >= ? AND service_key < ? AND id < ?"
+            ") ORDER BY id DESC LIMIT ?",
+            (term, upper, before_id, term, upper, before_id, limit),
+        ).fetchall()
+        return [_order(row) for row in rows]
+
+    async def find(self, term: str, before_id: Optional[int] = None, limit: int = 10) -> List[Order]:
+        """Orders whose login or service starts with ``term`` (or of user id ``term``), newest first."""
+        return await self._run(self._find, term, before_id, limit)
+
+    def _stats(self, since: Sequence[float]) -> Dict[str, Any]:
+        by_status = dict(self._db.execute("SELECT status, COUNT(*) FROM orders GROUP BY status").fetchall())
+        paid = [
+            tuple(self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(total_rub), 0) FROM orders WHERE paid_at >= ?", (ts,)
+            ).fetchone())
+            for ts in since
+        ]
+        return {"by_status": by_status, "paid": paid}
+
+    async def stats(self, since: Sequence[float]) -> Dict[str, Any]:
+        """Order counts by status and (count, RUB) paid since each timestamp in ``since``."""
+        return await self._run(self._stats, list(since))
+
+    def _transition(
+        self,
+        order_id: int,
+        status: str,
+        payment_id: Optional[str],
+        messages: Iterable[OutgoingMessage],
+    ) -> Order:
+        order = self._select(order_id)
+        if order is None:
+            raise InvalidTransition(f"Заказ #{order_id} не найден")
+        if status not in TRANSITIONS.get(order.status, set()):
+            raise InvalidTransition(f"Заказ #{order_id}: {order.status} → {status} недопустимо")
+        now = time.time()
+        fields = {"status": status, "updated_at": now}
+        if payment_id:
+            fields["payment_id"] = payment_id
+        if status == PAID:
+            fields["paid_at"] = now
+        if status == ACTIVATED:
+            fields["activated_at"] = now
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        self._db.execute(f"UPDATE orders SET {assignments} WHERE id = ?", (*fields.values(), order_id))
+        self._db.execute(
+            "INSERT INTO order_events (order_id, status, at) VALUES (?, ?, ?)", (order_id, status, now)
+        )
+        for message in messages:
+            self._enqueue(message, order_id, now)
+        updated = self._select(order_id)
+        if status == ACTIVATED:
+            self._schedule_renewal(updated)
+        return updated
+
+    async def transition(
+        self,
+        order_id: int,
+        status: str,
+        payment_id: Optional[str] = None,
+        messages: Iterable[OutgoingMessage] = (),
+    ) -> Order:
+        """Move the order to ``status`` and enqueue ``messages`` atomically."""
+        updated = await self._run(self._transition, order_id, status, payment_id, list(messages))
+        FUNNEL_TOTAL.inc(status)
+        return updated
+
+    def _transition_many(
+        self,
+        order_ids: Iterable[int],
+        status: str,
+        make_messages: Callable[[Order], Iterable[OutgoingMessage]],
+    ) -> List[Order]:
+        done: List[Order] = []
+        for order_id in order_ids:
+            order = self._select(order_id)
+            if order is None or status not in TRANSITIONS.get(order.status, set()):
+                continue
+            done.append(self._transition(order_id, status, None, list(make_messages(order))))
+        return done
+
+    async def transition_many(
+        self,
+        order_ids: Iterable[int],
+        status: str,
+        make_messages: Callable[[Order], Iterable[OutgoingMessage]] = lambda order: (),
+    ) -> List[Order]:
+        """Move several orders in one transaction; orders that cannot move are skipped."""
+        updated = await self._run(self._transition_many, list(order_ids), status, make_messages)
+        FUNNEL_TOTAL.inc(status, amount=len(updated))
+        return updated
+
+    # --- outbox ---
+
+    def _enqueue(self, message: OutgoingMessage, order_id: Optional[int], now: float) -> bool:
+        cursor = self._db.execute(
+            "INSERT OR IGNORE INTO outbox (order_id, chat_id, text, parse_mode, reply_markup, next_attempt_at, dedup_key)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                order_id,
+                str(message.chat_id),
+                message.text,
+                message.parse_mode,
+                json.dumps(message.reply_markup) if message.reply_markup else None,
+                now,
+                message.dedup_key,
+            ),
+        )
+        return cursor.rowcount > 0
+
+    async def enqueue(self, messages: Iterable[OutgoingMessage], order_id: Optional[int] = None) -> int:
+        """Queue messages; returns how many were new (duplicates by ``dedup_key`` are skipped)."""
+        def _enqueue_all(items: List[OutgoingMessage]) -> int:
+            now = time.time()
+            return sum(self._enqueue(message, order_id, now) for message in items)
+
+        return await self._run(_enqueue_all, list(messages))
+
+    def _due(self, limit: int, lease: float) -> List[OutboxItem]:
+        now = time.time()
+        rows = self._db.execute(
+            "SELECT id, order_id, chat_id, text, parse_mode, reply_markup, dedup_key, attempts FROM outbox"
+            " WHERE sent_at IS NULL AND dead = 0 AND next_attempt_at <= ? ORDER BY id LIMIT ?",
+            (now, limit),
+        ).fetchall()
+        # Захват на время отправки: другой процесс (шард) не возьмёт те же сообщения,
+        # а после падения отправителя они снова станут доступны через lease секунд
+        self._db.executemany(
+            "UPDATE outbox SET next_attempt_at = ? WHERE id = ?", [(now + lease, row['id']) for row in rows]
+        )
+        return [
+            OutboxItem(
+                id=row['id'],
+                order_id=row['order_id'],
+                chat_id=row['chat_id'],
+                text=row['text'],
+                parse_mode=row['parse_mode'],
+                reply_markup=json.loads(row['reply_markup']) if row['reply_markup'] else None,
+                dedup_key=row['dedup_key'],
+                attempts=row['attempts'],
+            )
+            for row in rows
+        ]
+
+    async def due_messages(self, limit: int = 20, lease: float = 60.0) -> List[OutboxItem]:
+        """Claim up to ``limit`` due messages for ``lease`` seconds."""
+        return await self._run(self._due, limit, lease)
+
+    def _next_due_at(self) -> Optional[float]:
+        row = self._db.execute(
+            "SELECT MIN(next_attempt_at) FROM outbox WHERE sent_at IS NULL AND dead = 0"
+        ).fetchone()
+        return row[0]
+
+    async def next_due_at(self) -> Optional[float]:
+        return await self._run(self._next_due_at)
+
+    def _mark_sent(self, ids: List[int]) -> None:
+        # Текст с логином после доставки больше не нужен
+        self._db.executemany(
+            "UPDATE outbox SET sent_at = ?, text = '' WHERE id = ?", [(time.time(), i) for i in ids]
+        )
+
+    async def mark_sent(self, ids: List[int]) -> None:
+        if ids:
+            await self._run(self._mark_sent, ids)
+
+    def _mark_failed(self, item_id: int, error: str, retry_at: Optional[float]) -> None:
+        if retry_at is None:
+            self._db.execute(
+                "UPDATE outbox SET attempts = attempts + 1, dead = 1, last_error = ? WHERE id = ?",
+                (error, item_id),
+            )
+        else:
+            self._db.execute(
+                "UPDATE outbox SET attempts = attempts + 1, next_attempt_at = ?, last_error = ? WHERE id = ?",
+                (retry_at, error, item_id),
+            )
+
+    async def mark_failed(self, item_id: int, error: str, retry_at: Optional[float]) -> None:
+        """Schedule a retry at ``retry_at`` or give up on the message when it is None."""
+        await self._run(self._mark_failed, item_id, error, retry_at)
+
+    # --- renewals ---
+
+    def _schedule_renewal(self, order: Order) -> None:
+        months = _plan_months(order)
+        self._db.execute(
+            "INSERT OR REPLACE INTO renewals (order_id, user_id, months, activated_at, expires_at)"
+            " VALUES (?, ?, ?, ?, ?)",
+            (order.id, order.user_id, months, order.activated_at, add_months(order.activated_at, months)),
+        )
+
+    def _claim_renewals(
+        self,
+        horizon: float,
+        limit: int,
+        make_messages: Callable[[Order, float], Iterable[OutgoingMessage]],
+    ) -> int:
+        now = time.time()
+        rows = self._db.execute(
+            "SELECT order_id, expires_at FROM renewals WHERE reminded_at IS NULL AND expires_at <= ?"
+            " ORDER BY expires_at LIMIT ?",
+            (horizon, limit),
+        ).fetchall()
+        reminded = 0
+        for row in rows:
+            order = self._select(row['order_id'])
+            # Без напоминания: подписка уже кончилась (старые заказы) или клиент продлил сам
+            renewed = order is None or row['expires_at'] <= now or self._db.execute(
+                "SELECT 1 FROM orders WHERE user_id = ? AND id > ? AND service_key = ?"
+                " AND status IN (?, ?) LIMIT 1",
+                (order.user_id, order.id, search_key(order.service), PAID, ACTIVATED),
+            ).fetchone()
+            if not renewed:
+                for message in make_messages(order, row['expires_at']):
+                    self._enqueue(message, order.id, now)
+                reminded += 1
+            self._db.execute("UPDATE renewals SET reminded_at = ? WHERE order_id = ?", (now, row['order_id']))
+        return reminded
+
+    async def claim_renewals(
+        self,
+        horizon: float,
+        make_messages: Callable[[Order, float], Iterable[OutgoingMessage]],
+        limit: int = 100,
+    ) -> int:
+        """Enqueue reminders for subscriptions expiring before ``horizon``.
+
+        Each subscription is reminded once; the reminder is written to the
+        outbox in the same transaction that marks it, so restarts and
+        several processes never send it twice. Returns the number enqueued.
+        """
+        return await self._run(self._claim_renewals, horizon, limit, make_messages)
+
+    def _next_renewal_at(self) -> Optional[float]:
+        return self._db.execute("SELECT MIN(expires_at) FROM renewals WHERE reminded_at IS NULL").fetchone()[0]
+
+    async def next_renewal_at(self) -> Optional[float]:
+        """Expiry of the next subscription not yet reminded (partial index, O(log n))."""
+        return await self._run(self._next_renewal_at)
+
+    # --- broadcasts ---
+
+    def _count_recipients(self) -> int:
+        return self._db.execute(
+            "SELECT COUNT(DISTINCT user_id) FROM orders WHERE user_id IS NOT NULL"
+            " AND user_id NOT IN (SELECT chat_id FROM blocked_chats)"
+        ).fetchone()[0]
+
+    def _select_broadcast(self, broadcast_id: int) -> Optional[Broadcast]:
+        row = self._db.execute("SELECT * FROM broadcasts WHERE id = ?", (broadcast_id,)).fetchone()
+        return Broadcast(**dict(row)) if row is not None else None
+
+    def _create_broadcast(self, text: str) -> Broadcast:
+        now = time.time()
+        cur = self._db.execute(
+            "INSERT INTO broadcasts (text, status, total, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+            (text, BROADCAST_DRAFT, self._count_recipients(), now, now),
+        )
+        return self._select_broadcast(cur.lastrowid)
+
+    async def create_broadcast(self, text: str) -> Broadcast:
+        """Draft announcement to every customer who is not known to block the bot."""
+        return await self._run(self._create_broadcast, text)
+
+    async def get_broadcast(self, broadcast_id: int) -> Optional[Broadcast]:
+        return await self._run(self._select_broadcast, broadcast_id)
+
+    def _latest_broadcast(self) -> Optional[Broadcast]:
+        row = self._db.execute(
+            "SELECT * FROM broadcasts WHERE status != ? ORDER BY id DESC LIMIT 1", (BROADCAST_DRAFT,)
+        ).fetchone()
+        return Broadcast(**dict(row)) if row is not None else None
+
+    async def latest_broadcast(self) -> Optional[Broadcast]:
+        """The last started broadcast (running or finished)."""
+        return await self._run(self._latest_broadcast)
+
+    def _set_broadcast_status(self, broadcast_id: int, status: str, allowed: Sequence[str]) -> Optional[Broadcast]:
+        if status == BROADCAST_RUNNING and self._db.execute(
+            "SELECT 1 FROM broadcasts WHERE status = ?", (BROADCAST_RUNNING,)
+        ).fetchone():
+            # Одновременно идёт только одна рассылка
+            return None
+        placeholders = ", ".join("?" for _ in allowed)
+        cur = self._db.execute(
+            f"UPDATE broadcasts SET status = ?, updated_at = ? WHERE id = ? AND status IN ({placeholders})",
+            (status, time.time(), broadcast_id, *allowed),
+        )
+        return self._select_broadcast(broadcast_id) if cur.rowcount else None
+
+    async def start_broadcast(self, broadcast_id: int) -> Optional[Broadcast]:
+        """Draft → running; None if it is not a draft or another broadcast is running."""
+        return await self._run(self._set_broadcast_status, broadcast_id, BROADCAST_RUNNING, [BROADCAST_DRAFT])
+
+    async def cancel_broadcast(self, broadcast_id: int) -> Optional[Broadcast]:
+        return await self._run(
+            self._set_broadcast_status, broadcast_id, BROADCAST_CANCELED, [BROADCAST_DRAFT, BROADCAST_RUNNING]
+        )
+
+    def _claim_broadcast(self, lease: float) -> Optional[Broadcast]:
+        now = time.time()
+        row = self._db.execute(
+            "SELECT id FROM broadcasts WHERE status = ? AND lease_until <= ? ORDER BY id LIMIT 1",
+            (BROADCAST_RUNNING, now),
+        ).fetchone()
+        if row is None:
+            return None
+        self._db.execute("UPDATE broadcasts SET lease_until = ? WHERE id = ?", (now + lease, row['id']))
+        return self._select_broadcast(row['id'])
+
+    async def claim_broadcast(self, lease: float = 120.0) -> Optional[Broadcast]:
+        """Take a running broadcast nobody else holds; the lease is renewed on every checkpoint."""
+        return await self._run(self._claim_broadcast, lease)
+
+    def _broadcast_recipients(self, after: int, limit: int) -> List[int]:
+        # Обход по индексу orders_user: память не зависит от числа получателей
+        rows = self._db.execute(
+            "SELECT user_id FROM orders WHERE user_id > ?"
+            " AND user_id NOT IN (SELECT chat_id FROM blocked_chats)"
+            " GROUP BY user_id ORDER BY user_id LIMIT ?",
+            (after, limit),
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    async def broadcast_recipients(self, after: int, limit: int = 100) -> List[int]:
+        """Next ``limit`` customer chat ids above ``after``, in id order."""
+        return await self._run(self._broadcast_recipients, after, limit)
+
+    def _checkpoint_broadcast(
+        self,
+        broadcast_id: int,
+        cursor: int,
+        sent: int,
+        failed: int,
+        blocked: Dict[int, str],
+        lease: float,
+        messages: List[OutgoingMessage],
+    ) -> Broadcast:
+        now = time.time()
+        self._db.executemany(
+            "INSERT OR REPLACE INTO blocked_chats (chat_id, blocked_at, error) VALUES (?, ?, ?)",
+            [(chat_id, now, error) for chat_id, error in blocked.items()],
+        )
+        self._db.execute(
+            "UPDATE broadcasts SET cursor = MAX(cursor, ?), sent = sent + ?, failed = failed + ?,"
+            " blocked = blocked + ?, lease_until = ?, updated_at = ? WHERE id = ?",
+            (cursor, sent, failed, len(blocked), now + lease, now, broadcast_id),
+        )
+        if messages:
+            self._db.execute(
+                "UPDATE broadcasts SET status = ?, lease_until = 0 WHERE id = ? AND status = ?",
+                (BROADCAST_DONE, broadcast_id, BROADCAST_RUNNING),
+            )
+            for message in messages:
+                self._enqueue(message, None, now)
+        return self._select_broadcast(broadcast_id)
+
+    async def checkpoint_broadcast(
+        self,
+        broadcast_id: int,
+        cursor: int,
+        sent: int = 0,
+        failed: int = 0,
+        blocked: Optional[Dict[int, str]] = None,
+        lease: float = 120.0,
+        finish: Iterable[OutgoingMessage] = (),
+    ) -> Broadcast:
+        """Record a delivered chunk and renew the lease in one transaction.
+
+        Chats that blocked the bot are remembered and skipped by later
+        broadcasts. Passing ``finish`` messages marks the broadcast done and
+        enqueues them (the admin summary) atomically.
+        """
+        return await self._run(
+            self._checkpoint_broadcast, broadcast_id, cursor, sent, failed, dict(blocked or {}), lease, list(finish)
+        )
+
+    async def close(self) -> None:
+        with self._lock:
+            self._db.close()
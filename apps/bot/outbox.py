@@ -0,0 +1,147 @@
+import asyncio
+import contextlib
+import html
+import logging
+import time
+from dataclasses import replace
+from typing import List, Optional
+
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
+from aiogram.types import InlineKeyboardMarkup
+
+from adminfeed import AdminFeed
+from orders import OrderRepository, OutboxItem
+from sender import PRIORITY_ADMIN, PRIORITY_CUSTOMER, SendQueue
+from sessions import SecretVault
+
+
+log = logging.getLogger(__name__)
+
+# Место пароля в тексте из outbox: в базу пишется метка, сам пароль подставляется при отправке.
+# NUL не приходит в сообщениях Telegram, так что клиент не может подделать метку
+SECRET_MARK = "\x00password\x00"
+SECRET_MISSING = "не сохранился (бот перезапускался) — уточните у клиента"
+
+
+def secret_key(order_id: int) -> tuple:
+    """Vault key of the password that an order's outbox message is rendered with."""
+    return ("outbox", order_id)
+
+
+class OutboxWorker:
+    """Delivers messages from the order outbox with retries.
+
+    Due messages are claimed in batches and handed to the rate-limited
+    send queue (admin chat in the admin lane); keyed admin notifications go
+    through ``feed`` and are coalesced into digests. A failed send is retried
+    with exponential backoff (Telegram's ``retry_after`` wins when given)
+    until ``max_attempts``. Users who blocked the bot are not retried.
+
+    Texts with :data:`SECRET_MARK` are stored as templates: the password is
+    taken from ``secrets`` (the in-memory vault) only when the message is
+    sent and dropped from it once the message is delivered or given up on.
+    """
+
+    def __init__(
+        self,
+        sender: SendQueue,
+        orders: OrderRepository,
+        admin_chat_id: str,
+        batch_size: int = 20,
+        max_attempts: int = 8,
+        base_delay: float = 2.0,
+        max_delay: float = 600.0,
+        idle_interval: float = 30.0,
+        feed: Optional[AdminFeed] = None,
+        secrets: Optional[SecretVault] = None,
+    ) -> None:
+        self.sender = sender
+        self.orders = orders
+        self.admin_chat_id = str(admin_chat_id)
+        self.feed = feed
+        self.secrets = secrets
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.idle_interval = idle_interval
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def wake(self) -> None:
+        self._wakeup.set()
+
+    def _render(self, item: OutboxItem) -> OutboxItem:
+        if SECRET_MARK not in item.text:
+            return item
+        secret = self.secrets.peek(secret_key(item.order_id)) if self.secrets is not None else None
+        return replace(item, text=item.text.replace(SECRET_MARK, html.escape(secret) if secret else SECRET_MISSING))
+
+    def _forget(self, item: OutboxItem) -> None:
+        if self.secrets is not None and SECRET_MARK in item.text:
+            self.secrets.discard(secret_key(item.order_id))
+
+    def _send(self, item: OutboxItem) -> asyncio.Future:
+        item = self._render(item)
+        if self.feed is not None and self.feed.accepts(item):
+            return self.feed.submit(item)
+        markup = InlineKeyboardMarkup.model_validate(item.reply_markup) if item.reply_markup else None
+        priority = PRIORITY_ADMIN if str(item.chat_id) == self.admin_chat_id else PRIORITY_CUSTOMER
+        return self.sender.submit(
+            item.chat_id,
+            item.text,
+            priority,
+            parse_mode=item.parse_mode,
+            reply_markup=markup,
+        )
+
+    def _retry_at(self, item: OutboxItem, exc: Exception) -> Optional[float]:
+        if isinstance(exc, TelegramForbiddenError) or item.attempts + 1 >= self.max_attempts:
+            return None
+        if isinstance(exc, TelegramRetryAfter):
+            return time.time() + exc.retry_after
+        return time.time() + min(self.max_delay, self.base_delay * (2 ** item.attempts))
+
+    async def deliver_due(self) -> int:
+        batch: List[OutboxItem] = await self.orders.due_messages(self.batch_size)
+        results = await asyncio.gather(*(self._send(item) for item in batch), return_exceptions=True)
+        sent: List[int] = []
+        for item, result in zip(batch, results):
+            if isinstance(result, Exception):
+                log.warning("Outbox message failed", extra={"outbox_id": item.id, "error": repr(result)})
+                retry_at = self._retry_at(item, result)
+                await self.orders.mark_failed(item.id, str(result), retry_at)
+                if retry_at is None:
+                    self._forget(item)
+            else:
+                sent.append(item.id)
+                self._forget(item)
+        await self.orders.mark_sent(sent)
+        return len(batch)
+
+    async def _run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            try:
+                if await self.deliver_due() >= self.batch_size:
+                    continue
+                next_due = await self.orders.next_due_at()
+            except Exception:  # noqa: BLE001
+                log.exception("Outbox worker error")
+                next_due = None
+            timeout = self.idle_interval
+            if next_due is not None:
+                timeout = max(0.0, min(timeout, next_due - time.time()))
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
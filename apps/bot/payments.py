@@ -0,0 +1,222 @@
+import asyncio
+import contextlib
+import heapq
+import itertools
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+from http_client import TIMEOUTS
+from orders import Order, OrderRepository
+
+
+log = logging.getLogger(__name__)
+
+
+PAID_STATUSES = {"succeeded", "waiting_for_capture"}
+FINAL_STATUSES = PAID_STATUSES | {"canceled"}
+# Статус, с которым вызывается обработчик, когда опрос прекращён по таймауту
+EXPIRED = "expired"
+
+StatusHandler = Callable[[str], Awaitable[None]]
+
+
+@dataclass
+class PendingPayment:
+    payment_id: str
+    on_final: StatusHandler
+    created_at: float = field(default_factory=time.monotonic)
+    attempts: int = 0
+
+
+class PaymentPoller:
+    """Single scheduler for all pending YooKassa payments.
+
+    Payments sit in a heap keyed by their next check time. Checks start fast
+    and back off geometrically up to ``max_delay``; due payments are checked
+    together through the batch status endpoint (or one request each, capped
+    by ``concurrency``). ``on_final`` is awaited once with the final status,
+    or with ``EXPIRED`` when the payment outlives ``max_age``.
+    """
+
+    def __init__(
+        self,
+        http: httpx.AsyncClient,
+        first_delay: float = 3.0,
+        backoff: float = 1.5,
+        max_delay: float = 60.0,
+        max_age: float = 900.0,
+        concurrency: int = 8,
+        batch_size: int = 50,
+        use_batch: bool = True,
+    ) -> None:
+        self.http = http
+        self.first_delay = first_delay
+        self.backoff = backoff
+        self.max_delay = max_delay
+        self.max_age = max_age
+        self.batch_size = batch_size
+        self.use_batch = use_batch
+        self._sem = asyncio.Semaphore(concurrency)
+        self._heap: List[Tuple[float, int, str]] = []
+        self._pending: Dict[str, PendingPayment] = {}
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._checks: set = set()
+
+    def __contains__(self, payment_id: str) -> bool:
+        return payment_id in self._pending
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def add(self, payment_id: str, on_final: StatusHandler, delay: float | None = None, age: float = 0.0) -> None:
+        """Start monitoring ``payment_id``; ``age`` counts time already spent pending (e.g. before a restart)."""
+        self._pending[payment_id] = PendingPayment(payment_id, on_final, created_at=time.monotonic() - age)
+        self._schedule(payment_id, self.first_delay if delay is None else delay)
+
+    def discard(self, payment_id: str) -> Optional[PendingPayment]:
+        # Запись в куче останется и будет пропущена при извлечении
+        return self._pending.pop(payment_id, None)
+
+    async def resolve(self, payment_id: str, status: str) -> bool:
+        """Finish a payment from a pushed event; False if it is not pending here."""
+        if payment_id not in self._pending:
+            return False
+        await self._finish(payment_id, status)
+        return True
+
+    def _schedule(self, payment_id: str, delay: float) -> None:
+        due = time.monotonic() + delay
+        heapq.heappush(self._heap, (due, next(self._seq), payment_id))
+        if self._heap[0][2] == payment_id:
+            self._wakeup.set()
+
+    def _next_delay(self, entry: PendingPayment) -> float:
+        return min(self.max_delay, self.first_delay * (self.backoff ** entry.attempts))
+
+    def _pop_due(self) -> List[str]:
+        now = time.monotonic()
+        due: List[str] = []
+        while self._heap and self._heap[0][0] <= now and len(due) < self.batch_size:
+            _, _, payment_id = heapq.heappop(self._heap)
+            if payment_id in self._pending and payment_id not in due:
+                due.append(payment_id)
+        return due
+
+    async def _fetch_one(self, payment_id: str) -> Optional[dict]:
+        async with self._sem:
+            resp = await self.http.get(f"/api/yookassa/{payment_id}", timeout=TIMEOUTS["status"])
+        data = resp.json()
+        if resp.status_code >= 400:
+            return {"error": data.get("error") or resp.status_code}
+        return data
+
+    async def _fetch_statuses(self, ids: List[str]) -> Dict[str, dict]:
+        if self.use_batch:
+            async with self._sem:
+                resp = await self.http.post(
+                    "/api/yookassa/status", json={"ids": ids}, timeout=TIMEOUTS["status"]
+                )
+            resp.raise_for_status()
+            return resp.json().get("payments") or {}
+        results = await asyncio.gather(*(self._fetch_one(pid) for pid in ids), return_exceptions=True)
+        return {pid: res for pid, res in zip(ids, results) if isinstance(res, dict)}
+
+    async def _finish(self, payment_id: str, status: str) -> None:
+        entry = self._pending.pop(payment_id, None)
+        if entry is None:
+            return
+        try:
+            await entry.on_final(status)
+        except Exception:  # noqa: BLE001
+            log.exception("Payment handler failed", extra={"payment_id": payment_id})
+
+    async def _check(self, ids: List[str]) -> None:
+        try:
+            statuses = await self._fetch_statuses(ids)
+        except Exception as exc:  # noqa: BLE001
+            log.warning("Status check failed", extra={"payments": len(ids), "error": repr(exc)})
+            statuses = {}
+        now = time.monotonic()
+        for payment_id in ids:
+            entry = self._pending.get(payment_id)
+            if entry is None:
+                continue
+            info = statuses.get(payment_id) or {}
+            status = info.get("status")
+            if info.get("error"):
+                # Ошибку проверки не считаем финальной: повторим с бэкоффом до max_age
+                log.warning("Status check failed", extra={"payment_id": payment_id, "error": info["error"]})
+            if status in FINAL_STATUSES:
+                await self._finish(payment_id, status)
+                continue
+            entry.attempts += 1
+            if now - entry.created_at >= self.max_age:
+                await self._finish(payment_id, EXPIRED)
+                continue
+            self._schedule(payment_id, self._next_delay(entry))
+
+    async def _run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            due = self._pop_due()
+            if due:
+                task = asyncio.create_task(self._check(due))
+                self._checks.add(task)
+                task.add_done_callback(self._checks.discard)
+                continue
+            timeout = self._heap[0][0] - time.monotonic() if self._heap else None
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = 5.0) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+        # Даём начатым проверкам дописать финальный статус; остальное подхватит resume_pending
+        if self._checks:
+            await asyncio.wait(list(self._checks), timeout=timeout)
+        for task in list(self._checks):
+            task.cancel()
+
+
+async def resume_pending(
+    poller: PaymentPoller,
+    orders: OrderRepository,
+    make_handler: Callable[[Order], StatusHandler],
+    rate: float = 20.0,
+    page_size: int = 200,
+    owns: Optional[Callable[[Order], bool]] = None,
+) -> int:
+    """Re-register invoices a previous run left unresolved.
+
+    First checks are spread at ``rate`` payments per second, so a restart
+    with thousands of open invoices does not hit the web API at once; the
+    time each invoice already spent pending counts towards ``max_age``.
+    With ``owns`` only the orders it accepts are resumed (this shard's users).
+    """
+    now = time.time()
+    resumed = 0
+    after_id = 0
+    while True:
+        page = await orders.pending_payments(after_id, page_size)
+        if not page:
+            return resumed
+        for order in page:
+            if order.payment_id in poller or (owns is not None and not owns(order)):
+                continue
+            delay = poller.first_delay + resumed / rate
+            poller.add(order.payment_id, make_handler(order), delay=delay, age=max(0.0, now - order.updated_at))
+            resumed += 1
+        after_id = page[-1].id
@@ -0,0 +1,181 @@
+import asyncio
+import contextlib
+import logging
+import math
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+
+log = logging.getLogger(__name__)
+
+
+PLAN_MONTHS = {
+    "1m": 1,
+    "3m": 3,
+    "9m": 9,
+    "12m": 12,
+}
+
+
+@dataclass(frozen=True)
+class PricingParams:
+    """Formula parameters shared with the web app (``apps/web/lib/pricing.ts``).
+
+    Both surfaces read the same PRICING_* environment variables with the
+    same defaults, so a quote in the chat and in the mini app always match.
+    """
+
+    delta_rate: float = 4
+    fixed_fee: float = 750
+    base_commission: float = 0.03
+    commission_per_usd: float = 0.001
+
+
+DEFAULT_PRICING = PricingParams()
+
+
+def calc_totals(
+    price_usd: float,
+    plan: str,
+    rate: float,
+    params: PricingParams = DEFAULT_PRICING,
+    quotes: Optional["QuoteTable"] = None,
+) -> Dict[str, float]:
+    """Replicates mini-app pricing:
+    final = ceil( ( usd * (fx + delta) * (1 + base + per_usd*usd) + fee ) / 10 ) * 10
+    where usd is total USD for the chosen plan (price_usd * months).
+
+    The total comes from ``quotes`` when the table was built for this price,
+    rate and formula.
+    """
+    months_num = PLAN_MONTHS.get(plan, 1)
+    total_usd = max(0.0, price_usd) * months_num
+    base_rub = total_usd * (rate + params.delta_rate)
+    final_rub = quotes.total(price_usd, plan, rate, params) if quotes is not None else None
+    if final_rub is None:
+        commission = params.base_commission + params.commission_per_usd * total_usd
+        price_with_commission = base_rub * (1.0 + commission)
+        final_rub = math.ceil((price_with_commission + params.fixed_fee) / 10.0) * 10
+    commission_rub = max(0, int(final_rub - base_rub))
+    return {
+        "months": months_num,
+        "rate": rate,
+        "base_usd": total_usd,
+        "base_rub": base_rub,
+        "commission_rub": commission_rub,
+        "total_rub": int(final_rub),
+    }
+
+
+def price_batch(prices_usd, plans: Sequence[str], rate: float, params: PricingParams = DEFAULT_PRICING):
+    """Total RUB for many (price_usd, plan) pairs in one NumPy pass.
+
+    Same operations in the same order as :func:`calc_totals`, so every
+    element is bit-for-bit equal to the scalar result.
+    """
+    import numpy as np  # тяжёлый импорт нужен только для пакетного расчёта
+
+    months = np.fromiter((PLAN_MONTHS.get(plan, 1) for plan in plans), dtype=np.float64, count=len(plans))
+    total_usd = np.maximum(0.0, np.asarray(prices_usd, dtype=np.float64)) * months
+    commission = params.base_commission + params.commission_per_usd * total_usd
+    base_rub = total_usd * (rate + params.delta_rate)
+    price_with_commission = base_rub * (1.0 + commission)
+    return (np.ceil((price_with_commission + params.fixed_fee) / 10.0) * 10).astype(np.int64)
+
+
+def quote_table(rate: float, prices_usd, params: PricingParams = DEFAULT_PRICING) -> Dict[str, Any]:
+    """Precomputed totals per plan for a grid of monthly USD prices at ``rate``."""
+    import numpy as np
+
+    prices = np.asarray(prices_usd, dtype=np.float64)
+    return {
+        plan: price_batch(prices, [plan] * len(prices), rate, params)
+        for plan in PLAN_MONTHS
+    }
+
+
+class QuoteTable:
+    """Totals per plan for a set of monthly USD prices at one rate, one NumPy pass per plan."""
+
+    def __init__(self, rate: float, prices_usd: Iterable[float], params: PricingParams = DEFAULT_PRICING) -> None:
+        self.rate = rate
+        self.params = params
+        self.prices = tuple(sorted({float(price) for price in prices_usd if price and price > 0}))
+        self._index = {price: index for index, price in enumerate(self.prices)}
+        totals = quote_table(rate, self.prices, params) if self.prices else {}
+        self._totals: Dict[str, List[int]] = {plan: column.tolist() for plan, column in totals.items()}
+
+    def total(
+        self, price_usd: float, plan: str, rate: Optional[float] = None, params: Optional[PricingParams] = None
+    ) -> Optional[int]:
+        """Precomputed total; None if the price, plan, rate or formula is not the table's."""
+        if (rate is not None and rate != self.rate) or (params is not None and params != self.params):
+            return None
+        index = self._index.get(price_usd)
+        column = self._totals.get(plan)
+        if index is None or column is None:
+            return None
+        return column[index]
+
+
+class QuoteBook:
+    """The current :class:`QuoteTable` for the catalog's typical prices.
+
+    ``update()`` is called when the rate is refreshed, the catalog reloads
+    or the formula changes; the table is rebuilt in a worker thread (the
+    first build imports NumPy) and replaces the previous one in a single
+    assignment. Until the first rate arrives there is no table and callers
+    fall back to :func:`calc_totals`.
+    """
+
+    def __init__(self, params: PricingParams = DEFAULT_PRICING) -> None:
+        self.params = params
+        self.rate: Optional[float] = None
+        self.prices: tuple = ()
+        self.table: Optional[QuoteTable] = None
+        self._stale = False
+        self._task: Optional[asyncio.Task] = None
+
+    def update(
+        self,
+        rate: Optional[float] = None,
+        prices: Optional[Iterable[float]] = None,
+        params: Optional[PricingParams] = None,
+    ) -> None:
+        if rate is not None:
+            self.rate = rate
+        if prices is not None:
+            self.prices = tuple(prices)
+        if params is not None:
+            self.params = params
+        if self.rate is None:
+            return
+        if self._task is not None and not self._task.done():
+            # Идёт пересборка — она повторится с новыми входными данными
+            self._stale = True
+            return
+        self._task = asyncio.create_task(self._rebuild())
+
+    async def _rebuild(self) -> None:
+        while True:
+            self._stale = False
+            try:
+                table = await asyncio.to_thread(QuoteTable, self.rate, self.prices, self.params)
+            except Exception:  # noqa: BLE001
+                log.exception("Quote table rebuild failed")
+                return
+            self.table = table
+            if not self._stale:
+                return
+
+    def total(self, price_usd: float, plan: str) -> Optional[int]:
+        """Total at the table's rate, e.g. for a price button; None if not precomputed."""
+        table = self.table
+        return table.total(price_usd, plan, params=self.params) if table is not None else None
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
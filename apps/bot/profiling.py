@@ -0,0 +1,236 @@
+import asyncio
+import contextlib
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+from collections import Counter as Tally
+from typing import Any, Dict, List, Optional, Tuple
+
+from instrumentation import Counter, Histogram
+
+
+log = logging.getLogger(__name__)
+
+LOOP_LAG_SECONDS = Histogram(
+    "bot_event_loop_lag_seconds",
+    "How late the event loop ran a scheduled wake-up.",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+LOOP_BLOCKED_TOTAL = Counter("bot_event_loop_blocked_total", "Event loop stalls longer than LOOP_LAG_THRESHOLD.")
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_qualname} ({os.path.basename(code.co_filename)})".replace(";", ",")
+
+
+def _stack(frame, limit: int = 96) -> List[str]:
+    """Frame names from the outermost call to ``frame``."""
+    names = []
+    while frame is not None and len(names) < limit:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    names.reverse()
+    return names
+
+
+def _culprit(frame) -> Optional[str]:
+    # Самый глубокий кадр кода бота — обычно это обработчик или функция, которая держит цикл
+    while frame is not None:
+        if frame.f_code.co_filename.startswith(APP_DIR):
+            return f"{frame.f_code.co_qualname} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno})"
+        frame = frame.f_back
+    return None
+
+
+def _task_name(task: Optional[asyncio.Task]) -> Optional[str]:
+    if task is None:
+        return None
+    coro = task.get_coro()
+    return f"{task.get_name()} {getattr(coro, '__qualname__', coro)}"
+
+
+class LoopLagMonitor:
+    """Measures event loop scheduling delay and names the code that blocks it.
+
+    A task wakes up every ``interval`` seconds and records how late it ran
+    in ``bot_event_loop_lag_seconds``. A daemon thread watches those wake-ups.
+    When the loop misses one by more than ``threshold``, the thread takes the
+    loop thread's stack and current task. Once the loop resumes, the stall is
+    logged with its duration and the bot function that held the loop.
+    """
+
+    def __init__(self, threshold: float = 0.1, interval: float = 0.25) -> None:
+        self.threshold = threshold
+        self.interval = interval
+        self._beat = time.monotonic()
+        self._stall: Optional[Dict[str, Any]] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread_id = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def _watch(self) -> None:
+        while not self._stop.wait(min(self.interval, self.threshold or self.interval) / 2):
+            if (
+                self.threshold <= 0
+                or self._stall is not None
+                or time.monotonic() - self._beat <= self.interval + self.threshold
+            ):
+                continue
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is None:
+                continue
+            self._stall = {
+                "task": _task_name(asyncio.current_task(self._loop)),
+                "where": _culprit(frame),
+                "stack": _stack(frame)[-20:],
+            }
+            del frame
+
+    async def _tick(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            scheduled = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - scheduled)
+            self._beat = time.monotonic()
+            LOOP_LAG_SECONDS.observe(lag)
+            stall, self._stall = self._stall, None
+            if self.threshold > 0 and lag >= self.threshold:
+                LOOP_BLOCKED_TOTAL.inc()
+                log.warning("Event loop blocked", extra={"lag": round(lag, 3), **(stall or {})})
+
+    def start(self) -> None:
+        if self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._task = asyncio.create_task(self._tick())
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    async def stop(self) -> None:
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+        self._thread = None
+
+
+class SamplingProfiler:
+    """Time-boxed sampling profile of the running bot in folded-stack format.
+
+    Two views go into one file, told apart by their root frame:
+
+    * ``[cpu]`` — stacks of the event loop thread sampled every
+      ``cpu_interval`` by a helper thread: where the loop spends its time,
+      including time spent blocked (idle time ends in the selector);
+    * ``[await]`` — await chains of all tasks sampled every
+      ``task_interval`` on the loop: where handlers and workers wait.
+
+    The result opens in speedscope.app or ``flamegraph.pl``. Nothing runs
+    between profiles; SIGUSR1 writes a profile to ``output_dir``.
+    """
+
+    def __init__(
+        self,
+        output_dir: str = "data/profiles",
+        signal_seconds: float = 10.0,
+        cpu_interval: float = 0.005,
+        task_interval: float = 0.05,
+    ) -> None:
+        self.output_dir = output_dir
+        self.signal_seconds = signal_seconds
+        self.cpu_interval = cpu_interval
+        self.task_interval = task_interval
+        self._busy = False
+        self._signal_task: Optional[asyncio.Task] = None
+
+    @property
+    def busy(self) -> bool:
+        return self._busy
+
+    def _sample_cpu(self, thread_id: int, samples: Tally, stop: threading.Event) -> None:
+        while not stop.wait(self.cpu_interval):
+            frame = sys._current_frames().get(thread_id)
+            if frame is not None:
+                samples[("[cpu]", *_stack(frame))] += 1
+            del frame
+
+    def _sample_tasks(self, samples: Tally) -> None:
+        current = asyncio.current_task()
+        for task in asyncio.all_tasks():
+            if task is current or task.done():
+                continue
+            coro = task.get_coro()
+            root = getattr(coro, "__qualname__", type(coro).__name__)
+            stack = tuple(_frame_name(frame) for frame in task.get_stack())
+            samples[("[await]", root, *stack)] += 1
+
+    async def profile(self, seconds: float) -> Tuple[str, Dict[str, int]]:
+        """Sample for ``seconds``; returns folded stacks and sample counts."""
+        if self._busy:
+            raise RuntimeError("Профилирование уже идёт")
+        self._busy = True
+        cpu: Tally = Tally()
+        tasks: Tally = Tally()
+        stop = threading.Event()
+        sampler = threading.Thread(
+            target=self._sample_cpu, args=(threading.get_ident(), cpu, stop), name="profiler", daemon=True
+        )
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + seconds
+        sampler.start()
+        try:
+            while loop.time() < deadline:
+                self._sample_tasks(tasks)
+                await asyncio.sleep(self.task_interval)
+        finally:
+            stop.set()
+            await asyncio.to_thread(sampler.join)
+            self._busy = False
+        lines = [f"{';'.join(stack)} {count}" for stack, count in (cpu + tasks).most_common()]
+        return "\n".join(lines) + "\n", {"cpu": sum(cpu.values()), "await": sum(tasks.values())}
+
+    async def profile_to_file(self, seconds: float) -> str:
+        folded, counts = await self.profile(seconds)
+        os.makedirs(self.output_dir, exist_ok=True)
+        path = os.path.join(self.output_dir, f"profile-{os.getpid()}-{time.strftime('%Y%m%d-%H%M%S')}.folded")
+        await asyncio.to_thread(_write, path, folded)
+        log.info("Profile written", extra={"path": path, "seconds": seconds, **counts})
+        return path
+
+    def _on_signal(self) -> None:
+        if self._busy or (self._signal_task is not None and not self._signal_task.done()):
+            log.warning("Profile already running, SIGUSR1 ignored")
+            return
+        self._signal_task = asyncio.create_task(self.profile_to_file(self.signal_seconds))
+
+    def start(self) -> None:
+        with contextlib.suppress(NotImplementedError, AttributeError):
+            asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, self._on_signal)
+
+    async def stop(self) -> None:
+        with contextlib.suppress(NotImplementedError, AttributeError):
+            asyncio.get_running_loop().remove_signal_handler(signal.SIGUSR1)
+        if self._signal_task is not None:
+            self._signal_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._signal_task
+            self._signal_task = None
+
+
+def _write(path: str, text: str) -> None:
+    with open(path, "w", encoding="utf-8") as fh:
+        fh.write(text)
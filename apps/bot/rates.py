@@ -0,0 +1,257 @@
+import asyncio
+import contextlib
+import logging
+import math
+import time
+from typing import Any, Awaitable, Callable, List, Optional, Set, Tuple
+
+import httpx
+
+from http_client import TIMEOUTS
+
+
+RATE_URLS = [
+    "https://api.exchangerate.host/latest?base=USD&symbols=RUB",
+    "https://open.er-api.com/v6/latest/USD",
+]
+
+log = logging.getLogger(__name__)
+
+
+def parse_usd_rub(data: dict) -> float:
+    if "rates" in data and "RUB" in data["rates"]:
+        rate = float(data["rates"]["RUB"])
+    else:
+        rate = float(data.get("result"))
+    if not rate > 0:
+        raise ValueError(f"Некорректный курс: {rate}")
+    return rate
+
+
+class CircuitBreaker:
+    """Closed → open after ``threshold`` consecutive failures; after
+    ``reset_timeout`` one trial call is let through (half-open) and its
+    outcome closes or reopens the circuit."""
+
+    def __init__(self, threshold: int = 3, reset_timeout: float = 30.0) -> None:
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self._trial:
+            self._trial = True
+            return True
+        return False
+
+    def release(self) -> None:
+        """The allowed call was abandoned without an outcome."""
+        self._trial = False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._trial = False
+        if self.opened_at is not None or self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+
+
+class RateProvider:
+    """One exchange-rate URL with its breaker and a moving average of latency."""
+
+    def __init__(self, url: str, breaker: Optional[CircuitBreaker] = None, latency: float = 1.0) -> None:
+        self.url = url
+        self.breaker = breaker or CircuitBreaker()
+        self.latency = latency
+
+    async def fetch(self, client: httpx.AsyncClient) -> float:
+        started = time.monotonic()
+        try:
+            res = await client.get(self.url, timeout=TIMEOUTS["rates"])
+            res.raise_for_status()
+            rate = parse_usd_rub(res.json())
+        except asyncio.CancelledError:
+            # Проигравший хедж — это не отказ провайдера, но он был как минимум так медленен
+            self.latency = max(self.latency, time.monotonic() - started)
+            self.breaker.release()
+            raise
+        except Exception:
+            self.latency = 0.8 * self.latency + 0.2 * (time.monotonic() - started)
+            self.breaker.record_failure()
+            if self.breaker.state != "closed":
+                log.warning("Rate provider circuit open", extra={"url": self.url})
+            raise
+        self.latency = 0.8 * self.latency + 0.2 * (time.monotonic() - started)
+        self.breaker.record_success()
+        return rate
+
+
+class RateProviders:
+    """Hedged USD/RUB fetch across providers.
+
+    Providers with a closed (or trial) circuit are tried fastest first; if
+    the leader has not answered within ``hedge_delay`` the next one starts
+    too, and the first valid rate wins — the rest are cancelled.
+    """
+
+    def __init__(self, client: httpx.AsyncClient, urls=RATE_URLS, hedge_delay: float = 0.5) -> None:
+        self.client = client
+        self.providers: List[RateProvider] = [RateProvider(url) for url in urls]
+        self.hedge_delay = hedge_delay
+
+    async def fetch(self) -> float:
+        candidates = sorted((p for p in self.providers if p.breaker.state != "open"), key=lambda p: p.latency)
+        pending: Set[asyncio.Task] = set()
+        errors: List[BaseException] = []
+        try:
+            for provider in candidates:
+                if not provider.breaker.allow():
+                    continue
+                pending.add(asyncio.create_task(provider.fetch(self.client)))
+                # Ждём лидера не дольше hedge_delay, затем подключаем следующего
+                rate, pending = await self._first_rate(pending, self.hedge_delay, errors)
+                if rate is not None:
+                    return rate
+            while pending:
+                rate, pending = await self._first_rate(pending, None, errors)
+                if rate is not None:
+                    return rate
+        finally:
+            for task in pending:
+                task.cancel()
+        reason = errors[-1] if errors else "все провайдеры недоступны"
+        raise RuntimeError(f"Не удалось получить курс USD/RUB: {reason}")
+
+    @staticmethod
+    async def _first_rate(
+        pending: Set[asyncio.Task], timeout: Optional[float], errors: List[BaseException]
+    ) -> Tuple[Optional[float], Set[asyncio.Task]]:
+        done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        rate = None
+        # Ошибки забираем у всех завершившихся, даже если рядом есть успех:
+        # иначе asyncio пишет в лог «Task exception was never retrieved»
+        for task in done:
+            error = task.exception()
+            if error is not None:
+                errors.append(error)
+            elif rate is None:
+                rate = task.result()
+        return rate, pending
+
+
+class RateCache:
+    """USD/RUB rate with TTL and stale-while-revalidate.
+
+    ``get()`` returns a fresh rate immediately, returns a stale one (not older
+    than ``max_staleness``) while a refresh runs in the background, and only
+    waits for the network when there is nothing usable. Concurrent refreshes
+    share a single in-flight request. If that fails and ``fallback`` is set,
+    the fallback rate is returned (but not cached).
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[[], Awaitable[float]],
+        ttl: float = 300.0,
+        max_staleness: float = 3600.0,
+        refresh_interval: float | None = None,
+        fallback: Optional[float] = None,
+    ) -> None:
+        self._fetch = fetch
+        self.fallback = fallback
+        self.ttl = ttl
+        self.max_staleness = max_staleness
+        self.refresh_interval = refresh_interval or ttl
+        self._rate: Optional[float] = None
+        self._fetched_at = 0.0
+        self._inflight: Optional[asyncio.Future] = None
+        self._task: Optional[asyncio.Task] = None
+        self._subscribers: List[Callable[[float], Any]] = []
+
+    def subscribe(self, callback: Callable[[float], Any]) -> None:
+        """Call ``callback(rate)`` after every successful refresh (e.g. to rebuild quote tables)."""
+        self._subscribers.append(callback)
+
+    @property
+    def age(self) -> float:
+        if self._rate is None:
+            return math.inf
+        return time.monotonic() - self._fetched_at
+
+    async def get(self) -> float:
+        age = self.age
+        if age <= self.ttl:
+            return self._rate  # type: ignore[return-value]
+        if age <= self.max_staleness:
+            self._refresh_in_background()
+            return self._rate  # type: ignore[return-value]
+        try:
+            return await self.refresh()
+        except Exception:
+            if not self.fallback:
+                raise
+            log.warning("Using fallback USD/RUB rate", extra={"rate": self.fallback})
+            return self.fallback
+
+    async def refresh(self) -> float:
+        # shield: отмена одного ожидающего не должна отменять общий запрос
+        return await asyncio.shield(self._start_refresh())
+
+    def _start_refresh(self) -> asyncio.Future:
+        if self._inflight is None:
+            self._inflight = asyncio.ensure_future(self._do_refresh())
+        return self._inflight
+
+    async def _do_refresh(self) -> float:
+        try:
+            rate = await self._fetch()
+            self._rate = rate
+            self._fetched_at = time.monotonic()
+            for callback in self._subscribers:
+                try:
+                    callback(rate)
+                except Exception:  # noqa: BLE001
+                    log.exception("Rate subscriber failed")
+            return rate
+        finally:
+            self._inflight = None
+
+    def _refresh_in_background(self) -> None:
+        fut = self._start_refresh()
+        # Ошибка фонового обновления не должна всплывать как "never retrieved"
+        fut.add_done_callback(lambda f: f.cancelled() or f.exception())
+
+    async def _run(self) -> None:
+        while True:
+            with contextlib.suppress(Exception):
+                await self.refresh()
+            await asyncio.sleep(self.refresh_interval)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+
@@ -0,0 +1,99 @@
+import asyncio
+import contextlib
+import html
+import logging
+import time
+from datetime import datetime
+from typing import List, Optional
+
+from keyboards import renewal_keyboard
+from orders import Order, OrderRepository, OutgoingMessage
+from outbox import OutboxWorker
+
+
+log = logging.getLogger(__name__)
+
+DAY = 86400.0
+
+
+def renewal_messages(order: Order, expires_at: float) -> List[OutgoingMessage]:
+    recipient = order.chat_id or order.user_id
+    if not recipient:
+        return []
+    days = max(1, round((expires_at - time.time()) / DAY))
+    text = (
+        f"⏰ <b>Подписка {html.escape(order.service)} заканчивается через {days} дн.</b> "
+        f"({datetime.fromtimestamp(expires_at).strftime('%d.%m.%Y')})\n\n"
+        f"Логин: <code>{html.escape(order.login or '—')}</code>\n"
+        f"Цена: {order.price_usd:g} USD/мес\n\n"
+        "Продлить можно в один тап — сервис, автор, тариф и цена подставятся из прошлого заказа."
+    )
+    return [OutgoingMessage(
+        recipient, text, parse_mode="HTML", reply_markup=renewal_keyboard(order.id).model_dump(exclude_none=True),
+    )]
+
+
+class RenewalScheduler:
+    """Sends "subscription expires soon" reminders for activated orders.
+
+    Expiry dates live in the ``renewals`` table behind a partial index, so
+    there is one task for all subscriptions: it sleeps until the nearest
+    expiry minus ``lead``, hands due reminders to the outbox and goes back
+    to sleep. Idle cost does not depend on how many reminders are scheduled.
+    """
+
+    def __init__(
+        self,
+        orders: OrderRepository,
+        outbox: OutboxWorker,
+        lead: float = 3 * DAY,
+        batch_size: int = 100,
+        idle_interval: float = 3600.0,
+    ) -> None:
+        self.orders = orders
+        self.outbox = outbox
+        self.lead = lead
+        self.batch_size = batch_size
+        self.idle_interval = idle_interval
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def wake(self) -> None:
+        self._wakeup.set()
+
+    async def remind_due(self) -> Optional[float]:
+        """Enqueue every due reminder; returns when the next one is due."""
+        if self.lead <= 0:
+            return None
+        while True:
+            horizon = time.time() + self.lead
+            if await self.orders.claim_renewals(horizon, renewal_messages, self.batch_size):
+                self.outbox.wake()
+            next_expiry = await self.orders.next_renewal_at()
+            if next_expiry is None or next_expiry > horizon:
+                return None if next_expiry is None else next_expiry - self.lead
+
+    async def _run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            try:
+                next_due = await self.remind_due()
+            except Exception:  # noqa: BLE001
+                log.exception("Renewal scheduler error")
+                next_due = None
+            timeout = self.idle_interval
+            if next_due is not None:
+                timeout = max(0.0, min(timeout, next_due - time.time()))
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
@@ -0,0 +1,305 @@
+import asyncio
+import contextlib
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, List, Optional, Tuple, Union
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter
+
+
+log = logging.getLogger(__name__)
+
+
+# Полосы приоритета: меньше — раньше
+PRIORITY_CUSTOMER = 0
+PRIORITY_ADMIN = 1
+PRIORITY_BULK = 2
+LANES = {PRIORITY_CUSTOMER: "customer", PRIORITY_ADMIN: "admin", PRIORITY_BULK: "bulk"}
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+ChatId = Union[int, str]
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self) -> float:
+        """Seconds until one token is available (0 if available now)."""
+        now = time.monotonic()
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        self._refill(time.monotonic())
+        self.tokens -= 1
+
+
+class SendQueueClosed(RuntimeError):
+    """The queue stopped before the message went out."""
+
+
+@dataclass
+class SendJob:
+    chat_id: ChatId
+    text: str
+    kwargs: Dict[str, Any]
+    priority: int
+    future: asyncio.Future
+    enqueued_at: float = field(default_factory=time.monotonic)
+    attempts: int = 0
+
+
+class SendQueue:
+    """Outbound Telegram message scheduler.
+
+    Messages to one chat go out strictly in order, one at a time; different
+    chats are sent concurrently. Every send takes a token from the global
+    bucket and from the chat's bucket (groups and channels get the slower
+    group rate), chats whose head message is more urgent go first, and a
+    ``retry_after`` from Telegram pauses the whole queue for that long.
+    """
+
+    # Полные бакеты неактивных чатов выбрасываются, когда их становится слишком много
+    MAX_BUCKETS = 10000
+
+    def __init__(
+        self,
+        bot: Bot,
+        global_rate: float = 30.0,
+        chat_rate: float = 1.0,
+        group_rate: float = 20 / 60,
+        concurrency: int = 8,
+        max_attempts: int = 5,
+    ) -> None:
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.max_attempts = max_attempts
+        self._global = TokenBucket(global_rate, global_rate)
+        self._buckets: Dict[ChatId, TokenBucket] = {}
+        self._chats: Dict[ChatId, Deque[SendJob]] = {}
+        self._busy: set = set()
+        self._ready: List[Tuple[int, int, ChatId]] = []
+        self._delayed: List[Tuple[float, int, ChatId]] = []
+        self._seq = itertools.count()
+        self._sem = asyncio.Semaphore(concurrency)
+        self._wakeup = asyncio.Event()
+        # Установлено, когда нет ни ждущих, ни отправляемых сообщений
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._paused_until = 0.0
+        self._task: Optional[asyncio.Task] = None
+        self._sends: set = set()
+        self.stats: Dict[str, Any] = {
+            "sent": 0,
+            "failed": 0,
+            "retry_after": 0,
+            "latency_buckets": [0] * (len(LATENCY_BUCKETS) + 1),
+            "latency_sum": 0.0,
+        }
+
+    # --- public API ---
+
+    def submit(self, chat_id: ChatId, text: str, priority: int = PRIORITY_CUSTOMER, **kwargs: Any) -> asyncio.Future:
+        """Queue a ``send_message``; the future resolves to the sent Message."""
+        if isinstance(chat_id, str) and chat_id.lstrip("-").isdigit():
+            chat_id = int(chat_id)
+        future = asyncio.get_running_loop().create_future()
+        job = SendJob(chat_id, text, kwargs, priority, future)
+        jobs = self._chats.get(chat_id)
+        if jobs is None:
+            jobs = self._chats[chat_id] = deque()
+        jobs.append(job)
+        self._idle.clear()
+        if len(jobs) == 1 and chat_id not in self._busy:
+            self._push_ready(chat_id)
+        return future
+
+    async def send(self, chat_id: ChatId, text: str, priority: int = PRIORITY_CUSTOMER, **kwargs: Any):
+        return await self.submit(chat_id, text, priority, **kwargs)
+
+    def depth(self) -> Dict[str, int]:
+        lanes = {name: 0 for name in LANES.values()}
+        for jobs in self._chats.values():
+            for job in jobs:
+                lanes[LANES.get(job.priority, "bulk")] += 1
+        return lanes
+
+    def metrics(self) -> Dict[str, Any]:
+        return {**self.stats, "depth": self.depth(), "inflight": len(self._busy)}
+
+    # --- scheduling ---
+
+    def _bucket(self, chat_id: ChatId) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            if len(self._buckets) >= self.MAX_BUCKETS:
+                self._prune_buckets()
+            # Отрицательные id и @username — группы/каналы с более строгим лимитом
+            is_group = isinstance(chat_id, str) or chat_id < 0
+            rate = self.group_rate if is_group else self.chat_rate
+            bucket = self._buckets[chat_id] = TokenBucket(rate, 1)
+        return bucket
+
+    def _prune_buckets(self) -> None:
+        for chat_id in [c for c, b in self._buckets.items() if c not in self._chats and b.delay() == 0]:
+            del self._buckets[chat_id]
+
+    def _push_ready(self, chat_id: ChatId) -> None:
+        head = self._chats[chat_id][0]
+        heapq.heappush(self._ready, (head.priority, next(self._seq), chat_id))
+        self._wakeup.set()
+
+    def _release(self, chat_id: ChatId) -> None:
+        self._busy.discard(chat_id)
+        jobs = self._chats.get(chat_id)
+        if jobs:
+            self._push_ready(chat_id)
+        else:
+            self._chats.pop(chat_id, None)
+            if not self._chats:
+                self._idle.set()
+
+    def _observe(self, job: SendJob) -> None:
+        latency = time.monotonic() - job.enqueued_at
+        self.stats["latency_sum"] += latency
+        for i, le in enumerate(LATENCY_BUCKETS):
+            if latency <= le:
+                self.stats["latency_buckets"][i] += 1
+                break
+        else:
+            self.stats["latency_buckets"][-1] += 1
+
+    async def _deliver(self, chat_id: ChatId, job: SendJob) -> None:
+        try:
+            async with self._sem:
+                result = await self.bot.send_message(chat_id, job.text, **job.kwargs)
+        except TelegramRetryAfter as exc:
+            self.stats["retry_after"] += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + exc.retry_after)
+            self._requeue(chat_id, job, exc)
+        except TelegramNetworkError as exc:
+            self._requeue(chat_id, job, exc)
+        except asyncio.CancelledError:
+            self._abandon(job)
+            raise
+        except Exception as exc:  # noqa: BLE001
+            self._fail(job, exc)
+        else:
+            self.stats["sent"] += 1
+            self._observe(job)
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            self._release(chat_id)
+
+    def _requeue(self, chat_id: ChatId, job: SendJob, exc: Exception) -> None:
+        job.attempts += 1
+        if job.attempts >= self.max_attempts:
+            self._fail(job, exc)
+            return
+        self._chats.setdefault(chat_id, deque()).appendleft(job)
+
+    def _fail(self, job: SendJob, exc: Exception) -> None:
+        self.stats["failed"] += 1
+        log.warning("Telegram send failed", extra={"chat_id": job.chat_id, "error": repr(exc)})
+        if not job.future.done():
+            job.future.set_exception(exc)
+            # Не все вызывающие ждут результат — не даём исключению потеряться с предупреждением
+            job.future.add_done_callback(lambda f: f.exception())
+
+    def _abandon(self, job: SendJob) -> None:
+        self.stats["failed"] += 1
+        if not job.future.done():
+            job.future.set_exception(SendQueueClosed("Очередь отправки остановлена"))
+            job.future.add_done_callback(lambda f: f.exception())
+
+    def _promote_delayed(self, now: float) -> None:
+        while self._delayed and self._delayed[0][0] <= now:
+            _, _, chat_id = heapq.heappop(self._delayed)
+            if self._chats.get(chat_id):
+                self._push_ready(chat_id)
+
+    async def _run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            now = time.monotonic()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+            self._promote_delayed(now)
+            if not self._ready:
+                timeout = self._delayed[0][0] - now if self._delayed else None
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                continue
+            global_delay = self._global.delay()
+            if global_delay > 0:
+                await asyncio.sleep(global_delay)
+                continue
+            _, _, chat_id = heapq.heappop(self._ready)
+            jobs = self._chats.get(chat_id)
+            if not jobs or chat_id in self._busy:
+                continue
+            chat_delay = self._bucket(chat_id).delay()
+            if chat_delay > 0:
+                heapq.heappush(self._delayed, (now + chat_delay, next(self._seq), chat_id))
+                continue
+            self._global.take()
+            self._bucket(chat_id).take()
+            self._busy.add(chat_id)
+            task = asyncio.create_task(self._deliver(chat_id, jobs.popleft()))
+            self._sends.add(task)
+            task.add_done_callback(self._sends.discard)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = 5.0) -> None:
+        """Send what is queued for up to ``timeout`` seconds, then give up.
+
+        Messages still queued or in flight at the deadline fail with
+        :class:`SendQueueClosed`, so nobody awaits them forever; outbox items
+        among them are sent again after their lease expires.
+        """
+        try:
+            if self._task is not None:
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self._idle.wait(), timeout)
+        finally:
+            # Синхронно: даже если саму остановку отменили, future всех сообщений завершаются
+            abandoned = self._close()
+        if abandoned:
+            log.warning("Send queue stopped with messages left", extra={"abandoned": abandoned})
+        tasks = [task for task in (self._task, *self._sends) if task is not None]
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
+
+    def _close(self) -> int:
+        if self._task is not None:
+            self._task.cancel()
+        abandoned = len(self._sends)
+        for task in self._sends:
+            task.cancel()
+        for jobs in self._chats.values():
+            abandoned += len(jobs)
+            while jobs:
+                self._abandon(jobs.popleft())
+        return abandoned
@@ -0,0 +1,166 @@
+import asyncio
+import contextlib
+import logging
+import os
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+from aiogram.fsm.storage.base import StorageKey
+
+from pricing import PricingParams, QuoteTable, calc_totals
+
+
+log = logging.getLogger(__name__)
+
+
+def session_key(key: StorageKey) -> tuple:
+    """``StorageKey`` as a plain tuple: a fraction of the dataclass's memory."""
+    return (key.bot_id, key.chat_id, key.user_id, key.thread_id, key.business_connection_id, key.destiny)
+
+
+@dataclass(slots=True)
+class OrderDraft:
+    """The chat wizard's order as it sits in FSM data: plain fields only.
+
+    The password is kept in :class:`SecretVault`, and the RUB calculation
+    is recomputed from ``rate`` instead of being stored with the session.
+    """
+
+    service: str
+    login: str
+    creator: str
+    plan: str
+    price: float
+    notes: str = ""
+    rate: float = 0.0
+
+    @classmethod
+    def from_data(cls, data: Dict[str, Any]) -> "OrderDraft":
+        # Сессии, начатые до перехода на компактный формат, хранили calc целиком
+        rate = data.get("rate") or (data.get("calc") or {}).get("rate") or 0.0
+        return cls(
+            service=data["service"],
+            login=data["login"],
+            creator=data["creator"],
+            plan=data["plan"],
+            price=data["price"],
+            notes=data.get("notes") or "",
+            rate=rate,
+        )
+
+    def calc(self, pricing: PricingParams, quotes: Optional[QuoteTable] = None) -> Dict[str, Any]:
+        return calc_totals(self.price, self.plan, self.rate, pricing, quotes)
+
+    def as_order(self, payment: str, password: Optional[str]) -> Dict[str, Any]:
+        """Order dict in the shape ``OrderRepository.create`` and the messages expect."""
+        return {
+            "service": self.service,
+            "login": self.login,
+            "password": password,
+            "creator": self.creator,
+            "plan": self.plan,
+            "price": self.price,
+            "payment": payment,
+            "notes": self.notes,
+        }
+
+
+class SecretVault:
+    """Short-lived in-memory store for secrets such as the account password.
+
+    Secrets are kept out of FSM storage and the database, for ``ttl``
+    seconds at most. Each value is XOR-masked with a random pad so the
+    plain text does not sit in the buffer between steps, and the buffer is
+    zeroed when the entry is taken, discarded or expires.
+
+    This is obfuscation, not encryption: the pad lives in the same buffer,
+    and :meth:`peek`/:meth:`take` return ordinary ``str`` copies that stay
+    in memory until the garbage collector reuses it. The vault limits where
+    and how long a password lives; it does not protect against someone who
+    can read the process memory.
+    """
+
+    def __init__(self, ttl: float = 1800.0) -> None:
+        self.ttl = ttl
+        # Один буфер на секрет: первая половина — значение под XOR-маской, вторая — сама маска
+        self._entries: Dict[Hashable, Tuple[bytearray, float]] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def put(self, key: Hashable, secret: str, ttl: Optional[float] = None) -> None:
+        self.discard(key)
+        raw = secret.encode()
+        buffer = bytearray(os.urandom(len(raw)) * 2)
+        for index, byte in enumerate(raw):
+            buffer[index] ^= byte
+        self._entries[key] = (buffer, time.monotonic() + (ttl or self.ttl))
+
+    def peek(self, key: Hashable) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        buffer, expires_at = entry
+        if expires_at <= time.monotonic():
+            self.discard(key)
+            return None
+        half = len(buffer) // 2
+        return bytes(a ^ b for a, b in zip(buffer[:half], buffer[half:])).decode()
+
+    def take(self, key: Hashable) -> Optional[str]:
+        """Return the secret and wipe it from the vault."""
+        secret = self.peek(key)
+        self.discard(key)
+        return secret
+
+    def discard(self, key: Hashable) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            buffer = entry[0]
+            buffer[:] = bytes(len(buffer))
+
+    def sweep(self) -> int:
+        now = time.monotonic()
+        expired = [key for key, (_, expires_at) in self._entries.items() if expires_at <= now]
+        for key in expired:
+            self.discard(key)
+        return len(expired)
+
+
+class Sweeper:
+    """Periodically calls ``sweep()`` on idle-session stores (FSM storage, vault)."""
+
+    def __init__(self, *targets: Any, interval: float = 60.0) -> None:
+        self.targets = [target for target in targets if hasattr(target, "sweep")]
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def sweep(self) -> int:
+        evicted = 0
+        for target in self.targets:
+            result = target.sweep()
+            evicted += await result if asyncio.iscoroutine(result) else result
+        return evicted
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                evicted = await self.sweep()
+            except Exception:  # noqa: BLE001
+                log.exception("Session sweep failed")
+                continue
+            if evicted:
+                log.info("Idle sessions evicted", extra={"evicted": evicted})
+
+    def start(self) -> None:
+        if self.targets and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
@@ -0,0 +1,334 @@
+import asyncio
+import bisect
+import contextlib
+import hashlib
+import hmac
+import logging
+import os
+import secrets
+import signal
+import sys
+from typing import List, Optional
+
+import httpx
+from aiogram import Bot, Dispatcher
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.types import Update
+from aiohttp import web
+
+from events import EVENTS_TOKEN_HEADER, build_events_app
+from instrumentation import setup_logging
+from payments import PaymentPoller
+from server import AppServer
+from webhook import SECRET_HEADER, WebhookIntake, update_user_id, wait_for_shutdown_signal
+
+
+log = logging.getLogger(__name__)
+
+# Апдейты, на которые подписаны обработчики бота (intake-процесс не строит диспетчер)
+ALLOWED_UPDATES = ["message", "callback_query", "inline_query"]
+UPDATE_PATH = "/update"
+EVENTS_PREFIX = "/shard"
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent hashing of user ids onto ``nodes`` shards.
+
+    Every process builds the same ring, so the intake and the workers agree
+    on the owner of a user without talking to each other; changing the shard
+    count moves only about 1/N of the users.
+    """
+
+    def __init__(self, nodes: int, replicas: int = 160) -> None:
+        points = sorted((_hash(f"shard-{node}-{replica}"), node) for node in range(nodes) for replica in range(replicas))
+        self._keys = [key for key, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def node(self, key: int) -> int:
+        index = bisect.bisect(self._keys, _hash(str(key))) % len(self._keys)
+        return self._nodes[index]
+
+
+def shard_url(settings, index: int) -> str:
+    return f"http://127.0.0.1:{settings.shard_base_port + index}"
+
+
+class ShardRouter(WebhookIntake):
+    """Intake lanes that forward updates to the owning worker process.
+
+    A user always maps to the same lane and the same worker, and a lane
+    forwards one update at a time (retrying until the worker accepts), so
+    per-user order is kept end to end. Telegram's requests are checked
+    against ``secret`` (``WEBHOOK_SECRET``); the internal ``token`` only
+    signs the forwarding to the workers.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        urls: List[str],
+        token: str,
+        secret: str = "",
+        lanes: int = 16,
+        queue_size: int = 256,
+    ) -> None:
+        super().__init__(None, bot, secret, workers=lanes, queue_size=queue_size)  # type: ignore[arg-type]
+        self.urls = urls
+        self.ring = HashRing(len(urls))
+        self.http = httpx.AsyncClient(timeout=httpx.Timeout(10.0, connect=2.0), headers={SECRET_HEADER: token})
+
+    async def process(self, update: Update) -> None:
+        url = self.urls[self.ring.node(update_user_id(update))] + UPDATE_PATH
+        body = update.model_dump(mode="json", exclude_unset=True, by_alias=True)
+        delay = 0.1
+        while True:
+            try:
+                resp = await self.http.post(url, json=body)
+                if resp.status_code < 500:
+                    return
+            except httpx.TransportError:
+                pass
+            # Воркер перезапускается или перегружен (503) — ждём, не нарушая порядок в полосе
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 5.0)
+
+    async def stop(self, timeout: Optional[float] = 10.0) -> None:
+        await super().stop(timeout)
+        await self.http.aclose()
+
+
+def _handled(resp: httpx.Response) -> bool:
+    try:
+        return resp.status_code == 200 and bool(resp.json().get("handled"))
+    except ValueError:
+        return False
+
+
+def build_events_fanout_app(urls: List[str], token: str, internal_token: str) -> web.Application:
+    """Public event endpoints of the intake: a payment event goes to every worker and the owner
+    answers ``handled``; an admin notification goes to the first worker that takes it."""
+
+    async def payment_event(request: web.Request) -> web.Response:
+        if not hmac.compare_digest(request.headers.get(EVENTS_TOKEN_HEADER, ""), token):
+            return web.json_response({"error": "unauthorized"}, status=401)
+        body = await request.read()
+        async with httpx.AsyncClient(timeout=10.0) as client:
+            results = await asyncio.gather(
+                *(
+                    client.post(
+                        url + EVENTS_PREFIX + "/events/payment",
+                        content=body,
+                        headers={EVENTS_TOKEN_HEADER: internal_token, "Content-Type": "application/json"},
+                    )
+                    for url in urls
+                ),
+                return_exceptions=True,
+            )
+        handled = any(isinstance(res, httpx.Response) and _handled(res) for res in results)
+        return web.json_response({"handled": handled})
+
+    async def admin_event(request: web.Request) -> web.Response:
+        # Воркеры делят одну базу заказов — уведомление может поставить любой, дубли отсечёт ключ
+        if not hmac.compare_digest(request.headers.get(EVENTS_TOKEN_HEADER, ""), token):
+            return web.json_response({"error": "unauthorized"}, status=401)
+        body = await request.read()
+        async with httpx.AsyncClient(timeout=10.0) as client:
+            for url in urls:
+                try:
+                    resp = await client.post(
+                        url + EVENTS_PREFIX + "/events/admin",
+                        content=body,
+                        headers={EVENTS_TOKEN_HEADER: internal_token, "Content-Type": "application/json"},
+                    )
+                except httpx.HTTPError:
+                    continue
+                if resp.status_code < 500:
+                    return web.Response(body=resp.content, status=resp.status_code, content_type="application/json")
+        return web.json_response({"error": "no worker available"}, status=503)
+
+    app = web.Application()
+    app.router.add_post("/events/payment", payment_event)
+    app.router.add_post("/events/admin", admin_event)
+    return app
+
+
+async def run_shard_worker(dp: Dispatcher, bot: Bot, poller: PaymentPoller, settings) -> None:
+    """Worker side: updates and payment events arrive from the intake over localhost."""
+    intake = WebhookIntake(
+        dp,
+        bot,
+        settings.shard_token,
+        workers=settings.webhook_workers,
+        queue_size=settings.webhook_queue_size,
+    )
+    app = intake.build_app(UPDATE_PATH)
+    app.add_subapp(EVENTS_PREFIX, build_events_app(
+        poller, settings.shard_token, dp["orders"], dp["outbox"], dp["payment_handler"]
+    ))
+    server = AppServer(app, "127.0.0.1", settings.shard_base_port + settings.shard_index)
+    intake.start()
+    await server.start()
+    await dp.emit_startup(bot=bot)
+    try:
+        await wait_for_shutdown_signal()
+    finally:
+        await server.stop()
+        await intake.stop(settings.shutdown_timeout)
+        await dp.emit_shutdown(bot=bot)
+
+
+class UpdatePoller:
+    """getUpdates loop of the intake in polling mode.
+
+    Any error backs off exponentially from ``MIN_BACKOFF`` up to
+    ``MAX_BACKOFF`` seconds, and a ``retry_after`` from Telegram is waited
+    out as given. If the loop dies anyway, its done-callback logs why and
+    starts it again after ``RESTART_DELAY``; the offset survives the restart.
+    """
+
+    MIN_BACKOFF = 1.0
+    MAX_BACKOFF = 30.0
+    RESTART_DELAY = 1.0
+
+    def __init__(self, bot: Bot, router: ShardRouter) -> None:
+        self.bot = bot
+        self.router = router
+        self.offset: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    async def _run(self, delay: float = 0.0) -> None:
+        await asyncio.sleep(delay)
+        backoff = self.MIN_BACKOFF
+        while True:
+            try:
+                updates = await self.bot.get_updates(offset=self.offset, timeout=30, allowed_updates=ALLOWED_UPDATES)
+            except TelegramRetryAfter as exc:
+                log.warning("getUpdates throttled", extra={"retry_after": exc.retry_after})
+                await asyncio.sleep(exc.retry_after)
+                continue
+            except Exception as exc:  # noqa: BLE001
+                log.warning("getUpdates failed", extra={"error": repr(exc), "retry_in": backoff})
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, self.MAX_BACKOFF)
+                continue
+            backoff = self.MIN_BACKOFF
+            for update in updates:
+                await self.router.put(update)
+                self.offset = update.update_id + 1
+
+    def _spawn(self, delay: float = 0.0) -> None:
+        self._task = asyncio.create_task(self._run(delay))
+        self._task.add_done_callback(self._on_done)
+
+    def _on_done(self, task: asyncio.Task) -> None:
+        if task.cancelled() or self._stopping:
+            return
+        log.error("Update poller died, restarting", exc_info=task.exception())
+        self._spawn(self.RESTART_DELAY)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._stopping = False
+            self._spawn()
+
+    async def stop(self) -> None:
+        self._stopping = True
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+
+
+async def _spawn_worker(index: int, token: str) -> asyncio.subprocess.Process:
+    env = {**os.environ, "BOT_SHARD_INDEX": str(index), "BOT_SHARD_TOKEN": token}
+    main_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+    return await asyncio.create_subprocess_exec(sys.executable, main_path, env=env)
+
+
+async def _supervise(index: int, token: str, procs: List[Optional[asyncio.subprocess.Process]], stopping: asyncio.Event) -> None:
+    # Упавший воркер перезапускается; его апдейты ждут в полосах роутера
+    while not stopping.is_set():
+        proc = procs[index] = await _spawn_worker(index, token)
+        code = await proc.wait()
+        if not stopping.is_set():
+            log.error("Shard worker exited, restarting", extra={"shard": index, "code": code})
+            await asyncio.sleep(1)
+
+
+def _signal_workers(procs: List[Optional[asyncio.subprocess.Process]], sig: int) -> None:
+    for proc in procs:
+        if proc is not None and proc.returncode is None:
+            proc.send_signal(sig)
+
+
+async def run_sharded(settings) -> None:
+    """Intake process for ``BOT_SHARDS`` > 1: receives updates once and routes them to workers."""
+    log_listener = setup_logging(settings.log_level, settings.log_sample_rate, settings.slow_span_seconds)
+    token = settings.shard_token or secrets.token_urlsafe(32)
+    urls = [shard_url(settings, index) for index in range(settings.bot_shards)]
+    procs: List[Optional[asyncio.subprocess.Process]] = [None] * settings.bot_shards
+    stopping = asyncio.Event()
+    supervisors = [asyncio.create_task(_supervise(i, token, procs, stopping)) for i in range(settings.bot_shards)]
+
+    bot = Bot(settings.bot_token)
+    router = ShardRouter(
+        bot,
+        urls,
+        token,
+        settings.webhook_secret,
+        lanes=settings.webhook_workers,
+        queue_size=settings.webhook_queue_size,
+    )
+    router.start()
+    # Настройки перечитывает и профиль снимает каждый воркер; intake только передаёт им сигнал
+    with contextlib.suppress(NotImplementedError):
+        for sig in (signal.SIGHUP, signal.SIGUSR1):
+            asyncio.get_running_loop().add_signal_handler(sig, _signal_workers, procs, sig)
+    servers: List[AppServer] = []
+    if settings.bot_events_token:
+        servers.append(AppServer(
+            build_events_fanout_app(urls, settings.bot_events_token, token),
+            settings.bot_events_host,
+            settings.bot_events_port,
+        ))
+    poller: Optional[UpdatePoller] = None
+    if settings.bot_mode == "webhook":
+        servers.append(AppServer(router.build_app(settings.webhook_path), settings.webhook_host, settings.webhook_port))
+    for server in servers:
+        await server.start()
+    if settings.bot_mode == "webhook":
+        await bot.set_webhook(
+            settings.webhook_url.rstrip("/") + settings.webhook_path,
+            secret_token=settings.webhook_secret,
+            allowed_updates=ALLOWED_UPDATES,
+        )
+    else:
+        await bot.delete_webhook()
+        poller = UpdatePoller(bot, router)
+        poller.start()
+    log.info("Sharded bot started", extra={"shards": settings.bot_shards})
+    try:
+        await wait_for_shutdown_signal()
+    finally:
+        if poller is not None:
+            await poller.stop()
+        for server in servers:
+            await server.stop()
+        # Сначала доставляем принятые апдейты воркерам, затем останавливаем их
+        await router.stop(settings.shutdown_timeout)
+        stopping.set()
+        _signal_workers(procs, signal.SIGTERM)
+        _, pending = await asyncio.wait(supervisors, timeout=settings.shutdown_timeout + 5)
+        for proc in procs:
+            if proc is not None and proc.returncode is None:
+                proc.kill()
+        for task in pending:
+            task.cancel()
+        await bot.session.close()
+        log_listener.stop()
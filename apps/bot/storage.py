@@ -0,0 +1,284 @@
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from dataclasses import fields
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+
+from sessions import OrderDraft, session_key
+
+
+def _state_name(state: StateType) -> Optional[str]:
+    return state.state if isinstance(state, State) else state
+
+
+class SQLiteStorage(BaseStorage):
+    """FSM storage in a local SQLite database (WAL mode).
+
+    State and data of one chat live in a single row; rows untouched for
+    ``ttl`` seconds are treated as abandoned and purged. Queries run in a
+    worker thread so the event loop never waits on disk.
+    """
+
+    PURGE_EVERY = 1000
+
+    def __init__(self, path: str, ttl: float | None = None) -> None:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.ttl = ttl
+        self.key_builder = DefaultKeyBuilder(with_destiny=True)
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS fsm ("
+            " key TEXT PRIMARY KEY, state TEXT, data TEXT NOT NULL DEFAULT '{}', expires_at REAL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS fsm_expires_at ON fsm (expires_at)")
+
+    def _expires_at(self) -> Optional[float]:
+        return time.time() + self.ttl if self.ttl else None
+
+    def _read(self, key: str) -> tuple[Optional[str], Dict[str, Any]]:
+        row = self._db.execute(
+            "SELECT state, data, expires_at FROM fsm WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None or (row[2] is not None and row[2] < time.time()):
+            return None, {}
+        return row[0], json.loads(row[1])
+
+    def _write(self, key: str, state: Optional[str], data: Dict[str, Any]) -> None:
+        if state is None and not data:
+            self._db.execute("DELETE FROM fsm WHERE key = ?", (key,))
+        else:
+            self._db.execute(
+                "INSERT INTO fsm (key, state, data, expires_at) VALUES (?, ?, ?, ?)"
+                " ON CONFLICT(key) DO UPDATE SET state = excluded.state, data = excluded.data,"
+                " expires_at = excluded.expires_at",
+                (key, state, json.dumps(data, ensure_ascii=False), self._expires_at()),
+            )
+        self._writes += 1
+        if self.ttl and self._writes % self.PURGE_EVERY == 0:
+            self._db.execute("DELETE FROM fsm WHERE expires_at < ?", (time.time(),))
+
+    def _update(self, key: str, state: Any = ..., data: Optional[Dict[str, Any]] = None, merge: bool = True) -> Dict[str, Any]:
+        # Одна транзакция на чтение и запись: state и data меняются атомарно
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                cur_state, cur_data = self._read(key)
+                new_state = cur_state if state is ... else state
+                new_data = cur_data if data is None else ({**cur_data, **data} if merge else dict(data))
+                self._write(key, new_state, new_data)
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return new_data
+
+    def _get(self, key: str) -> tuple[Optional[str], Dict[str, Any]]:
+        with self._lock:
+            return self._read(key)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        await asyncio.to_thread(self._update, self.key_builder.build(key), _state_name(state))
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _ = await asyncio.to_thread(self._get, self.key_builder.build(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        await asyncio.to_thread(self._update, self.key_builder.build(key), ..., data, False)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data = await asyncio.to_thread(self._get, self.key_builder.build(key))
+        return data
+
+    async def update_data(self, key: StorageKey, data: Dict[str, Any]) -> Dict[str, Any]:
+        return await asyncio.to_thread(self._update, self.key_builder.build(key), ..., data)
+
+    async def advance(self, key: StorageKey, state: StateType, data: Dict[str, Any]) -> None:
+        await asyncio.to_thread(self._update, self.key_builder.build(key), _state_name(state), data)
+
+    def _purge(self) -> int:
+        with self._lock:
+            return self._db.execute("DELETE FROM fsm WHERE expires_at < ?", (time.time(),)).rowcount
+
+    async def sweep(self) -> int:
+        if not self.ttl:
+            return 0
+        return await asyncio.to_thread(self._purge)
+
+    async def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+# Поля черновика заказа лежат в кортеже по позициям, без словаря на каждую сессию
+PACKED_FIELDS = tuple(field.name for field in fields(OrderDraft))
+_ABSENT = object()
+
+
+class _Session:
+    __slots__ = ("state", "values", "extra", "touched_at")
+
+    def __init__(self) -> None:
+        self.state: Optional[str] = None
+        self.values: tuple = ()
+        self.extra: Optional[Dict[str, Any]] = None
+        self.touched_at = time.monotonic()
+
+    def data(self) -> Dict[str, Any]:
+        data = {name: value for name, value in zip(PACKED_FIELDS, self.values) if value is not _ABSENT}
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+    def store(self, data: Dict[str, Any]) -> None:
+        values = tuple(data.get(name, _ABSENT) for name in PACKED_FIELDS)
+        self.values = () if all(value is _ABSENT for value in values) else values
+        self.extra = {name: value for name, value in data.items() if name not in PACKED_FIELDS} or None
+
+
+class MemoryOrderStorage(BaseStorage):
+    """In-process FSM storage for ``FSM_STORAGE=memory``.
+
+    A session is a slotted record keyed by a plain tuple: the order draft
+    fields (:class:`sessions.OrderDraft`) are packed into a tuple, and only
+    unknown keys fall back to a dict. Cleared sessions are dropped at once,
+    and ``sweep()`` evicts sessions idle for longer than ``ttl``.
+    """
+
+    def __init__(self, ttl: Optional[float] = None) -> None:
+        self.ttl = ttl
+        self._sessions: Dict[tuple, _Session] = {}
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def __bool__(self) -> bool:
+        # Dispatcher подставляет MemoryStorage вместо «ложного» хранилища, а пустое — ложно из-за __len__
+        return True
+
+    def _get(self, key: tuple) -> Optional[_Session]:
+        session = self._sessions.get(key)
+        if session is not None and self.ttl and time.monotonic() - session.touched_at > self.ttl:
+            del self._sessions[key]
+            return None
+        return session
+
+    def _put(self, key: StorageKey, state: Any, data: Optional[Dict[str, Any]], merge: bool) -> Dict[str, Any]:
+        packed = session_key(key)
+        session = self._get(packed) or _Session()
+        if state is not ...:
+            # aiogram собирает имя состояния заново при каждом обращении — держим одну копию
+            name = _state_name(state)
+            session.state = sys.intern(name) if name else None
+        if data is not None:
+            session.store({**session.data(), **data} if merge else data)
+        session.touched_at = time.monotonic()
+        if session.state is None and not session.values and not session.extra:
+            self._sessions.pop(packed, None)
+        else:
+            self._sessions[packed] = session
+        return session.data()
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        self._put(key, state, None, False)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        session = self._get(session_key(key))
+        return session.state if session else None
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        self._put(key, ..., data, False)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        session = self._get(session_key(key))
+        return session.data() if session else {}
+
+    async def update_data(self, key: StorageKey, data: Dict[str, Any]) -> Dict[str, Any]:
+        return self._put(key, ..., data, True)
+
+    async def advance(self, key: StorageKey, state: StateType, data: Dict[str, Any]) -> None:
+        self._put(key, state, data, True)
+
+    def sweep(self) -> int:
+        if not self.ttl:
+            return 0
+        deadline = time.monotonic() - self.ttl
+        idle = [key for key, session in self._sessions.items() if session.touched_at < deadline]
+        for key in idle:
+            del self._sessions[key]
+        return len(idle)
+
+    async def close(self) -> None:
+        self._sessions.clear()
+
+
+def build_redis_storage(url: str, ttl: float | None = None) -> BaseStorage:
+    # redis — опциональная зависимость, импортируем только при выборе этого бэкенда
+    from aiogram.fsm.storage.redis import RedisStorage
+
+    from redis.exceptions import WatchError
+
+    class RedisOrderStorage(RedisStorage):
+        async def _merge(self, key: StorageKey, state: Any, data: Dict[str, Any]) -> Dict[str, Any]:
+            # WATCH/MULTI: если data изменили между чтением и записью, повторяем — поле не теряется
+            state_key = self.key_builder.build(key, "state")
+            data_key = self.key_builder.build(key, "data")
+            async with self.redis.pipeline(transaction=True) as pipe:
+                while True:
+                    try:
+                        await pipe.watch(data_key)
+                        raw = await pipe.get(data_key)
+                        if isinstance(raw, bytes):
+                            raw = raw.decode()
+                        merged = {**(self.json_loads(raw) if raw else {}), **data}
+                        pipe.multi()
+                        if state is None:
+                            pipe.delete(state_key)
+                        elif state is not ...:
+                            pipe.set(state_key, _state_name(state), ex=self.state_ttl)
+                        pipe.set(data_key, self.json_dumps(merged), ex=self.data_ttl)
+                        await pipe.execute()
+                        return merged
+                    except WatchError:
+                        continue
+
+        async def update_data(self, key: StorageKey, data: Dict[str, Any]) -> Dict[str, Any]:
+            return await self._merge(key, ..., data)
+
+        async def advance(self, key: StorageKey, state: StateType, data: Dict[str, Any]) -> None:
+            await self._merge(key, state, data)
+
+    expiry = int(ttl) if ttl else None
+    return RedisOrderStorage.from_url(url, state_ttl=expiry, data_ttl=expiry)
+
+
+def build_storage(settings) -> BaseStorage:
+    if settings.fsm_storage == "sqlite":
+        return SQLiteStorage(settings.fsm_sqlite_path, ttl=settings.fsm_ttl)
+    if settings.fsm_storage == "redis":
+        return build_redis_storage(settings.redis_url, ttl=settings.fsm_ttl)
+    return MemoryOrderStorage(ttl=settings.fsm_ttl)
+
+
+async def advance(state: FSMContext, next_state: StateType, **data: Any) -> None:
+    """Move the wizard to ``next_state`` and merge ``data`` in one storage write."""
+    storage_advance = getattr(state.storage, "advance", None)
+    if storage_advance is not None:
+        await storage_advance(state.key, next_state, data)
+        return
+    await state.update_data(**data)
+    await state.set_state(next_state)
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# Модули бота лежат плоско в apps/bot и импортируются по имени, как в main.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "123456:TEST")
+os.environ.setdefault("ADMIN_CHAT_ID", "-100")
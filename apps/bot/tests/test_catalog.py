@@ -0,0 +1,21 @@
+import os
+
+from catalog import ServiceCatalog
+
+SERVICES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "services.json")
+
+
+def test_empty_catalog_is_still_truthy(tmp_path):
+    catalog = ServiceCatalog(str(tmp_path / "missing.json"))
+    catalog.load()
+    assert len(catalog) == 0
+    assert catalog
+    assert catalog.match("Patreon") is None
+
+
+def test_catalog_matches_aliases_and_typos():
+    catalog = ServiceCatalog(SERVICES)
+    assert catalog.load()
+    assert len(catalog) > 0
+    assert catalog.match("Чат GPT").id == "chatgptplus"
+    assert catalog.search("chatgtp plus")[0].id == "chatgptplus"
@@ -0,0 +1,10 @@
+import os
+
+from loadtest import cold_start
+
+
+def test_cold_start_within_budget():
+    # Бюджет с запасом для медленных CI-машин; локально холодный старт около 4 с, из них 3 с — импорт aiogram
+    budget = float(os.environ.get("COLD_START_BUDGET", "10"))
+    result = cold_start(1)
+    assert result["process_seconds"] < budget, result
@@ -0,0 +1,61 @@
+import asyncio
+
+import pytest
+
+import config
+
+
+@pytest.fixture
+def env_file(tmp_path, monkeypatch):
+    """A .env file the environment was started from, as with ``env_file`` in docker-compose."""
+    path = tmp_path / ".env"
+    path.write_text("BROADCAST_RATE=20\nLOG_LEVEL=INFO\nSUPPORT_URL=https://t.me/first\n")
+    monkeypatch.setattr(config, "_env_path", str(path))
+    monkeypatch.setattr(config, "_startup_dotenv", None)
+    monkeypatch.setattr(config, "_current", None)
+    for key, value in (("BROADCAST_RATE", "20"), ("LOG_LEVEL", "INFO"), ("SUPPORT_URL", "https://t.me/first")):
+        monkeypatch.setenv(key, value)
+    config.get_settings()
+    return path
+
+
+def _reload() -> config.Settings:
+    assert asyncio.run(config.SettingsWatcher(interval=0).reload())
+    return config.get_settings()
+
+
+def test_reload_follows_env_file_copied_into_environment(env_file):
+    env_file.write_text("BROADCAST_RATE=5\nLOG_LEVEL=DEBUG\n")
+    settings = _reload()
+    assert settings.broadcast_rate == 5.0
+    assert settings.log_level == "DEBUG"
+    # Ключ убран из .env — значение по умолчанию, а не копия из окружения
+    assert settings.support_url == "https://t.me/aibazaru"
+
+
+def test_explicit_environment_still_overrides_env_file(env_file, monkeypatch):
+    # Перезапуск процесса с явно заданной переменной
+    monkeypatch.setenv("LOG_LEVEL", "WARNING")
+    monkeypatch.setattr(config, "_startup_dotenv", None)
+    monkeypatch.setattr(config, "_current", None)
+    assert config.get_settings().log_level == "WARNING"
+    env_file.write_text("BROADCAST_RATE=5\nLOG_LEVEL=DEBUG\nSUPPORT_URL=https://t.me/first\n")
+    settings = _reload()
+    assert settings.broadcast_rate == 5.0
+    assert settings.log_level == "WARNING"
+
+
+def test_reload_keeps_settings_when_env_file_is_broken(env_file):
+    before = config.get_settings()
+    env_file.write_text("BROADCAST_RATE=fast\n")
+    assert not asyncio.run(config.SettingsWatcher(interval=0).reload())
+    assert config.get_settings() is before
+
+
+def test_secret_ttl_defaults_to_minutes_regardless_of_fsm_ttl(env_file, monkeypatch):
+    monkeypatch.delenv("SECRET_TTL", raising=False)
+    monkeypatch.setenv("FSM_TTL", "604800")
+    env_file.write_text("")
+    settings = _reload()
+    assert settings.fsm_ttl == 604800.0
+    assert settings.secret_ttl == 1800.0
@@ -0,0 +1,57 @@
+import argparse
+import asyncio
+import dataclasses
+import itertools
+
+from aiogram import Bot
+from aiogram.fsm.storage.base import StorageKey
+from aiohttp.test_utils import TestServer
+
+from loadtest import BOT_ID, FUNNEL, FakeSession, _update, bench_settings, build_fake_web
+from main import OrderForm, build_app
+
+USER_ID = 42
+
+
+def test_lost_password_is_asked_again_at_payment(tmp_path):
+    """A restart or an expired SECRET_TTL before payment keeps the order and asks only for the password."""
+
+    async def scenario():
+        server = TestServer(build_fake_web(paid_after=60), host="127.0.0.1")
+        await server.start_server()
+        args = argparse.Namespace(web_port=server.port, fsm_storage="memory", no_keepalive=False)
+        settings = dataclasses.replace(bench_settings(args, str(tmp_path)), secret_ttl=0.2)
+        bot = Bot(settings.bot_token, session=FakeSession())
+        dp, lifecycle = build_app(settings, bot)
+        await lifecycle.start()
+        update_ids = itertools.count(1)
+        key = StorageKey(bot_id=BOT_ID, chat_id=USER_ID, user_id=USER_ID)
+
+        async def step(kind: str, value: str) -> None:
+            await dp.feed_update(bot, _update(next(update_ids), USER_ID, kind, value))
+
+        try:
+            for name, kind, value in FUNNEL:
+                if name == "payment":
+                    break
+                await step(kind, value)
+            assert await dp.storage.get_state(key) == OrderForm.payment.state
+
+            await asyncio.sleep(0.3)
+            await step("callback", "chat:payment:yookassa")
+            assert await dp.storage.get_state(key) == OrderForm.password.state
+            data = await dp.storage.get_data(key)
+            assert data["service"] == "Patreon" and data["plan"] == "3m"
+            assert (await dp["orders"].stats([0.0]))["by_status"] == {}
+
+            await step("message", "secret-again")
+            assert await dp.storage.get_state(key) == OrderForm.confirm.state
+            await step("callback", "chat:confirm")
+            await step("callback", "chat:payment:yookassa")
+            assert await dp.storage.get_state(key) is None
+            assert (await dp["orders"].stats([0.0]))["by_status"] == {"invoiced": 1}
+        finally:
+            await lifecycle.shutdown()
+            await server.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,26 @@
+import asyncio
+import dataclasses
+
+from aiogram import Bot
+
+from config import get_settings
+from instrumentation import COLLECTORS, render_metrics
+from main import build_app
+
+
+def test_rebuilding_app_keeps_one_sender_collector(tmp_path):
+    settings = dataclasses.replace(
+        get_settings(),
+        orders_db_path=str(tmp_path / "orders.sqlite3"),
+        fsm_sqlite_path=str(tmp_path / "fsm.sqlite3"),
+    )
+
+    async def build_twice():
+        for _ in range(2):
+            bot = Bot("42:TEST")
+            build_app(settings, bot)
+            await bot.session.close()
+
+    asyncio.run(build_twice())
+    assert list(COLLECTORS) == ["sender"]
+    assert render_metrics().count("# TYPE bot_send_total counter") == 1
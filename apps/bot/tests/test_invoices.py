@@ -0,0 +1,77 @@
+import asyncio
+
+import httpx
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from invoices import InvoiceClient
+from loadtest import build_fake_web
+
+ORDER = {"service": "Patreon", "plan": "3m", "price": 9.99}
+
+
+async def _with_stub(scenario, fail_first: int = 0):
+    """Run ``scenario(invoice_client, http)`` against loadtest's web API stub and return its counters.
+
+    The first ``fail_first`` create requests answer 503 before reaching the
+    stub, as a web app that is restarting would.
+    """
+    app = build_fake_web(paid_after=60)
+    failures = {"left": fail_first}
+
+    @web.middleware
+    async def flaky(request: web.Request, handler):
+        if request.path == "/api/yookassa/create" and failures["left"] > 0:
+            failures["left"] -= 1
+            return web.json_response({"error": "unavailable"}, status=503)
+        return await handler(request)
+
+    app.middlewares.insert(0, flaky)
+    server = TestServer(app, host="127.0.0.1")
+    await server.start_server()
+    try:
+        async with httpx.AsyncClient(base_url=str(server.make_url(""))) as http:
+            await scenario(InvoiceClient(http), http)
+            counters = (await http.get("/_stats")).json()
+    finally:
+        await server.close()
+    counters["rejected"] = fail_first - failures["left"]
+    return counters
+
+
+def test_concurrent_calls_share_one_upstream_create():
+    results = []
+
+    async def scenario(client, http):
+        results.extend(await asyncio.gather(*(client.create("key-1", ORDER) for _ in range(20))))
+
+    counters = asyncio.run(_with_stub(scenario))
+    assert counters["create"] == 1
+    assert counters["payments"] == 1
+    assert len(set(results)) == 1
+
+
+def test_retries_after_5xx_create_one_payment_per_key():
+    results = []
+
+    async def scenario(client, http):
+        results.extend(await asyncio.gather(*(client.create("key-1", ORDER) for _ in range(20))))
+        # Перезапуск бота: кэша нет, но ключ тот же — ЮKassa вернёт уже созданный платёж
+        results.append(await InvoiceClient(http).create("key-1", ORDER))
+
+    counters = asyncio.run(_with_stub(scenario, fail_first=1))
+    assert counters["rejected"] == 1
+    assert counters["create"] == 2  # повтор после 503 и запрос после перезапуска
+    assert counters["payments"] == 1
+    assert len({invoice.payment_id for invoice in results}) == 1
+
+
+def test_different_keys_create_different_payments():
+    results = []
+
+    async def scenario(client, http):
+        results.extend(await asyncio.gather(*(client.create(f"key-{index}", ORDER) for index in range(10))))
+
+    counters = asyncio.run(_with_stub(scenario))
+    assert counters["payments"] == 10
+    assert len({invoice.payment_id for invoice in results}) == 10
@@ -0,0 +1,45 @@
+import asyncio
+import sqlite3
+from types import SimpleNamespace
+
+from orders import OrderRepository
+
+USER = SimpleNamespace(id=42, username="client", full_name="Клиент")
+
+
+def _order(service, login):
+    return {"service": service, "login": login, "plan": "1m", "price": 9.99, "payment": "later"}
+
+
+def test_find_folds_cyrillic_case(tmp_path):
+    async def scenario():
+        orders = OrderRepository(str(tmp_path / "orders.db"))
+        netflix = await orders.create(_order("Нетфликс", "Иван@Почта.рф"), {"total_rub": 1000}, USER)
+        await orders.create(_order("Patreon", "user@example.com"), {"total_rub": 1000}, USER)
+
+        assert [order.id for order in await orders.find("нетф")] == [netflix]
+        assert [order.id for order in await orders.find("НЕТФЛИКС")] == [netflix]
+        assert [order.id for order in await orders.find("иван@")] == [netflix]
+        assert [order.service for order in await orders.find("PAT")] == ["Patreon"]
+
+    asyncio.run(scenario())
+
+
+def test_search_keys_are_backfilled_for_old_databases(tmp_path):
+    path = str(tmp_path / "orders.db")
+    orders = OrderRepository(path)
+    asyncio.run(orders.create(_order("Нетфликс", "Иван"), {"total_rub": 1000}, USER))
+    # База до появления ключей поиска: без колонок, индексы по lower(...)
+    with sqlite3.connect(path) as db:
+        db.execute("DROP INDEX orders_login")
+        db.execute("DROP INDEX orders_service")
+        db.execute("ALTER TABLE orders DROP COLUMN login_key")
+        db.execute("ALTER TABLE orders DROP COLUMN service_key")
+        db.execute("CREATE INDEX orders_login ON orders (lower(login), id)")
+        db.execute("CREATE INDEX orders_service ON orders (lower(service), id)")
+
+    reopened = OrderRepository(path)
+    assert [order.login for order in asyncio.run(reopened.find("ИВАН"))] == ["Иван"]
+    with sqlite3.connect(path) as db:
+        sql = db.execute("SELECT sql FROM sqlite_master WHERE name = 'orders_service'").fetchone()[0]
+    assert "service_key" in sql
@@ -0,0 +1,75 @@
+import asyncio
+import sqlite3
+
+from aiogram.exceptions import TelegramForbiddenError
+from aiogram.methods import SendMessage
+
+from orders import OrderRepository, OutgoingMessage
+from outbox import SECRET_MARK, SECRET_MISSING, OutboxWorker, secret_key
+from sessions import SecretVault
+
+ADMIN = "1"
+
+
+class RecordingSender:
+    """Send queue stub: records texts, fails chats listed in ``blocked``."""
+
+    def __init__(self, blocked=()) -> None:
+        self.blocked = set(blocked)
+        self.texts = []
+
+    def submit(self, chat_id, text, priority, **kwargs) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        if str(chat_id) in self.blocked:
+            future.set_exception(TelegramForbiddenError(SendMessage(chat_id=chat_id, text=text), "blocked"))
+        else:
+            self.texts.append(text)
+            future.set_result(None)
+        return future
+
+
+def _stored_texts(path):
+    with sqlite3.connect(path) as db:
+        return [row[0] for row in db.execute("SELECT text FROM outbox ORDER BY id")]
+
+
+def test_password_is_rendered_at_send_time_and_never_stored(tmp_path):
+    async def scenario():
+        path = str(tmp_path / "orders.db")
+        orders = OrderRepository(path)
+        vault = SecretVault(60)
+        sender = RecordingSender()
+        outbox = OutboxWorker(sender, orders, ADMIN, secrets=vault)
+
+        vault.put(secret_key(7), "p<a>ss")
+        await orders.enqueue([OutgoingMessage(ADMIN, f"Пароль: <code>{SECRET_MARK}</code>")], order_id=7)
+        assert "p<a>ss" not in _stored_texts(path)[0]
+
+        assert await outbox.deliver_due() == 1
+        assert sender.texts == ["Пароль: <code>p&lt;a&gt;ss</code>"]
+        assert vault.peek(secret_key(7)) is None
+        assert _stored_texts(path) == [""]
+
+    asyncio.run(scenario())
+
+
+def test_lost_or_undeliverable_password_is_not_kept(tmp_path):
+    async def scenario():
+        path = str(tmp_path / "orders.db")
+        orders = OrderRepository(path)
+        vault = SecretVault(60)
+        sender = RecordingSender(blocked={"2"})
+        outbox = OutboxWorker(sender, orders, ADMIN, secrets=vault)
+
+        # После перезапуска пароля в хранилище нет: менеджер видит пометку вместо метки
+        await orders.enqueue([OutgoingMessage(ADMIN, f"Пароль: {SECRET_MARK}")], order_id=1)
+        # Недоставляемое сообщение уходит в dead, пароль из хранилища выбрасывается
+        vault.put(secret_key(2), "secret")
+        await orders.enqueue([OutgoingMessage("2", f"Пароль: {SECRET_MARK}")], order_id=2)
+
+        assert await outbox.deliver_due() == 2
+        assert sender.texts == [f"Пароль: {SECRET_MISSING}"]
+        assert len(vault) == 0
+        assert all("secret" not in text for text in _stored_texts(path))
+
+    asyncio.run(scenario())
@@ -0,0 +1,65 @@
+import asyncio
+import json
+import os
+
+import pytest
+
+from pricing import PLAN_MONTHS, PricingParams, QuoteBook, QuoteTable, calc_totals, price_batch
+
+
+GOLDEN_PATH = os.path.join(os.path.dirname(__file__), "pricing_golden.json")
+
+
+def golden_groups():
+    with open(GOLDEN_PATH, encoding="utf-8") as fh:
+        groups = json.load(fh)["groups"]
+    return [(PricingParams(**group["params"]), group["cases"]) for group in groups]
+
+
+@pytest.mark.parametrize("params, cases", golden_groups())
+def test_calc_totals_matches_golden(params, cases):
+    for case in cases:
+        assert PLAN_MONTHS[case["plan"]] == case["months"]
+        assert calc_totals(case["price_usd"], case["plan"], case["rate"], params)["total_rub"] == case["total_rub"], case
+
+
+@pytest.mark.parametrize("params, cases", golden_groups())
+def test_price_batch_matches_golden(params, cases):
+    for rate in {case["rate"] for case in cases}:
+        at_rate = [case for case in cases if case["rate"] == rate]
+        totals = price_batch([case["price_usd"] for case in at_rate], [case["plan"] for case in at_rate], rate, params)
+        assert totals.tolist() == [case["total_rub"] for case in at_rate]
+
+
+@pytest.mark.parametrize("params, cases", golden_groups())
+def test_quote_table_serves_golden_totals(params, cases):
+    for rate in {case["rate"] for case in cases}:
+        at_rate = [case for case in cases if case["rate"] == rate]
+        table = QuoteTable(rate, [case["price_usd"] for case in at_rate], params)
+        for case in at_rate:
+            assert table.total(case["price_usd"], case["plan"], rate, params) == case["total_rub"]
+            assert calc_totals(case["price_usd"], case["plan"], rate, params, table)["total_rub"] == case["total_rub"]
+
+
+def test_quote_table_misses_fall_back_to_formula():
+    table = QuoteTable(90.0, [9.99, 20])
+    assert table.total(15, "1m") is None
+    assert table.total(9.99, "1m", rate=91.0) is None
+    assert table.total(9.99, "1m", params=PricingParams(fixed_fee=0)) is None
+    assert calc_totals(9.99, "3m", 91.0, quotes=table) == calc_totals(9.99, "3m", 91.0)
+
+
+def test_quote_book_rebuilds_on_rate_and_prices():
+    async def scenario():
+        book = QuoteBook()
+        book.update(prices=[9.99, 20])
+        assert book.table is None
+        book.update(rate=90.0)
+        # Пересборка во время идущей сборки не теряется: итог — по последним данным
+        book.update(rate=95.0)
+        await book._task
+        assert book.table.rate == 95.0
+        assert book.total(20, "3m") == calc_totals(20, "3m", 95.0)["total_rub"]
+        await book.stop()
+
+    asyncio.run(scenario())
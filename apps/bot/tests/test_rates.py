@@ -0,0 +1,194 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from rates import CircuitBreaker, RateCache, RateProvider, RateProviders
+
+
+async def _with_providers(scenario):
+    """Run ``scenario(client, url, calls, state)`` against local rate providers.
+
+    ``/slow`` answers 90 after ``state["slow"]`` seconds, ``/fast`` answers 91
+    at once, ``/flaky`` answers 500 while ``state["fail"]`` is set and 92
+    otherwise, ``/zero`` answers an invalid rate of 0. ``calls`` records when
+    each path was requested.
+    """
+    calls = {}
+    state = {"slow": 0.5, "fail": True}
+
+    async def handle(request: web.Request) -> web.Response:
+        name = request.match_info["name"]
+        calls.setdefault(name, []).append(time.monotonic())
+        if name == "slow":
+            await asyncio.sleep(state["slow"])
+            return web.json_response({"rates": {"RUB": 90.0}})
+        if name == "zero":
+            return web.json_response({"rates": {"RUB": 0}})
+        if name == "flaky" and state["fail"]:
+            return web.json_response({"error": "down"}, status=500)
+        return web.json_response({"rates": {"RUB": 91.0 if name == "fast" else 92.0}})
+
+    app = web.Application()
+    app.router.add_get("/{name}", handle)
+    server = TestServer(app, host="127.0.0.1")
+    await server.start_server()
+    try:
+        async with httpx.AsyncClient() as client:
+            await scenario(client, lambda name: str(server.make_url(f"/{name}")), calls, state)
+    finally:
+        await server.close()
+
+
+def _providers(client, url, names, hedge_delay):
+    providers = RateProviders(client, [url(name) for name in names], hedge_delay=hedge_delay)
+    # Порядок опроса — по средней задержке: задаём его явно
+    for index, provider in enumerate(providers.providers):
+        provider.latency = 0.01 * (index + 1)
+        provider.breaker = CircuitBreaker(threshold=2, reset_timeout=0.2)
+    return providers
+
+
+def test_slow_leader_is_hedged_after_delay():
+    async def scenario(client, url, calls, state):
+        providers = _providers(client, url, ["slow", "fast"], hedge_delay=0.1)
+        started = time.monotonic()
+        rate = await providers.fetch()
+        elapsed = time.monotonic() - started
+        assert rate == 91.0
+        assert elapsed < state["slow"]
+        # Время прихода запросов на заглушку: допуск на задержку первого из них
+        hedged_after = calls["fast"][0] - calls["slow"][0]
+        assert 0.08 <= hedged_after < 0.3
+        # Проигравший хедж отменён, но отказом провайдера не считается
+        await asyncio.sleep(0.05)
+        slow = providers.providers[0]
+        assert slow.breaker.failures == 0
+        assert slow.latency >= 0.1
+
+    asyncio.run(_with_providers(scenario))
+
+
+def test_fast_leader_is_not_hedged():
+    async def scenario(client, url, calls, state):
+        providers = _providers(client, url, ["fast", "slow"], hedge_delay=0.1)
+        assert await providers.fetch() == 91.0
+        assert "slow" not in calls
+
+    asyncio.run(_with_providers(scenario))
+
+
+def test_failed_provider_falls_through_without_waiting_for_hedge():
+    async def scenario(client, url, calls, state):
+        providers = _providers(client, url, ["flaky", "fast"], hedge_delay=5.0)
+        started = time.monotonic()
+        assert await providers.fetch() == 91.0
+        assert time.monotonic() - started < 1.0
+        assert providers.providers[0].breaker.failures == 1
+
+    asyncio.run(_with_providers(scenario))
+
+
+def test_breaker_opens_then_half_open_trial_closes_it():
+    async def scenario(client, url, calls, state):
+        providers = _providers(client, url, ["flaky"], hedge_delay=0.1)
+        breaker = providers.providers[0].breaker
+        for _ in range(2):
+            with pytest.raises(RuntimeError):
+                await providers.fetch()
+        assert breaker.state == "open"
+
+        # Открытая цепь: провайдер не опрашивается вовсе
+        with pytest.raises(RuntimeError):
+            await providers.fetch()
+        assert len(calls["flaky"]) == 2
+
+        await asyncio.sleep(0.2)
+        assert breaker.state == "half-open"
+        state["fail"] = False
+        assert await providers.fetch() == 92.0
+        assert breaker.state == "closed"
+        assert breaker.failures == 0
+        assert len(calls["flaky"]) == 3
+
+    asyncio.run(_with_providers(scenario))
+
+
+def test_failed_half_open_trial_reopens_breaker():
+    async def scenario(client, url, calls, state):
+        providers = _providers(client, url, ["flaky"], hedge_delay=0.1)
+        breaker = providers.providers[0].breaker
+        for _ in range(2):
+            with pytest.raises(RuntimeError):
+                await providers.fetch()
+        await asyncio.sleep(0.2)
+        assert breaker.state == "half-open"
+        with pytest.raises(RuntimeError):
+            await providers.fetch()
+        assert breaker.state == "open"
+        assert len(calls["flaky"]) == 3
+
+    asyncio.run(_with_providers(scenario))
+
+
+def test_half_open_lets_one_trial_through():
+    breaker = CircuitBreaker(threshold=1, reset_timeout=0.0)
+    breaker.record_failure()
+    assert breaker.state == "half-open"
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.release()
+    assert breaker.allow()
+
+
+def test_cache_returns_fallback_when_every_provider_fails():
+    async def scenario(client, url, calls, state):
+        providers = _providers(client, url, ["flaky"], hedge_delay=0.1)
+        cache = RateCache(providers.fetch, fallback=95.0)
+        assert await cache.get() == 95.0
+        # Запасной курс не кэшируется: следующий get снова идёт к провайдерам
+        state["fail"] = False
+        await asyncio.sleep(0.2)
+        assert await cache.get() == 92.0
+
+    asyncio.run(_with_providers(scenario))
+
+
+def test_cache_without_fallback_raises():
+    async def scenario(client, url, calls, state):
+        cache = RateCache(_providers(client, url, ["flaky"], hedge_delay=0.1).fetch)
+        with pytest.raises(RuntimeError):
+            await cache.get()
+
+    asyncio.run(_with_providers(scenario))
+
+
+def test_provider_rejects_non_positive_rate():
+    async def scenario(client, url, calls, state):
+        provider = RateProvider(url("zero"))
+        with pytest.raises(ValueError):
+            await provider.fetch(client)
+        assert provider.breaker.failures == 1
+
+    asyncio.run(_with_providers(scenario))
+
+
+def test_failures_finished_alongside_a_success_are_retrieved():
+    async def scenario():
+        async def fail():
+            raise ValueError("down")
+
+        async def succeed():
+            return 91.0
+
+        tasks = {asyncio.create_task(fail()), asyncio.create_task(succeed())}
+        await asyncio.sleep(0)
+        errors = []
+        rate, pending = await RateProviders._first_rate(tasks, None, errors)
+        assert rate == 91.0 and not pending
+        assert [str(error) for error in errors] == ["down"]
+
+    asyncio.run(scenario())
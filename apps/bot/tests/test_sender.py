@@ -0,0 +1,91 @@
+import asyncio
+
+import pytest
+
+from sender import SendQueue, SendQueueClosed
+
+
+class FakeBot:
+    def __init__(self, delay: float = 0.0) -> None:
+        self.delay = delay
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await asyncio.sleep(self.delay)
+        self.sent.append((chat_id, text))
+        return text
+
+
+def _queue(bot, **kwargs):
+    return SendQueue(bot, **{"global_rate": 1000.0, "chat_rate": 1000.0, **kwargs})
+
+
+def test_stop_sends_queued_messages_before_closing():
+    async def scenario():
+        bot = FakeBot(delay=0.01)
+        queue = _queue(bot, concurrency=2)
+        queue.start()
+        futures = [queue.submit(chat_id, f"{chat_id}:{n}") for chat_id in (1, 2, 3) for n in range(3)]
+        await queue.stop(timeout=2.0)
+        assert [future.result() for future in futures] == [f"{chat_id}:{n}" for chat_id in (1, 2, 3) for n in range(3)]
+        assert len(bot.sent) == 9
+        assert queue.depth() == {"customer": 0, "admin": 0, "bulk": 0}
+
+    asyncio.run(scenario())
+
+
+def test_stop_fails_what_is_left_at_the_deadline():
+    async def scenario():
+        bot = FakeBot()
+        # Один чат, одно сообщение в секунду: за дедлайн уйдёт только первое
+        queue = _queue(bot, chat_rate=1.0)
+        queue.start()
+        futures = [queue.submit(1, str(n)) for n in range(5)]
+        await queue.stop(timeout=0.3)
+        assert all(future.done() for future in futures)
+        assert futures[0].result() == "0"
+        for future in futures[1:]:
+            with pytest.raises(SendQueueClosed):
+                future.result()
+        assert queue.stats["failed"] == 4
+
+    asyncio.run(scenario())
+
+
+def test_stop_cancels_send_in_flight_at_the_deadline():
+    async def scenario():
+        queue = _queue(FakeBot(delay=10.0))
+        queue.start()
+        future = queue.submit(1, "slow")
+        await asyncio.sleep(0.05)
+        await queue.stop(timeout=0.1)
+        with pytest.raises(SendQueueClosed):
+            future.result()
+
+    asyncio.run(scenario())
+
+
+def test_stop_of_a_queue_that_never_started():
+    async def scenario():
+        bot = FakeBot()
+        queue = _queue(bot)
+        future = queue.submit(1, "never")
+        await queue.stop()
+        with pytest.raises(SendQueueClosed):
+            future.result()
+        assert bot.sent == []
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_stop_still_resolves_futures():
+    async def scenario():
+        queue = _queue(FakeBot(), chat_rate=0.1)
+        queue.start()
+        futures = [queue.submit(1, str(n)) for n in range(3)]
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(queue.stop(timeout=5.0), 0.2)
+        await asyncio.sleep(0)
+        assert all(future.done() for future in futures)
+
+    asyncio.run(scenario())
@@ -0,0 +1,150 @@
+import asyncio
+import time
+
+import httpx
+from aiogram import Bot
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter
+from aiogram.methods import GetUpdates
+from aiogram.types import Update
+
+from sharding import UPDATE_PATH, HashRing, ShardRouter, UpdatePoller
+from webhook import SECRET_HEADER
+
+
+def _update(update_id: int) -> Update:
+    return Update.model_validate({"update_id": update_id})
+
+
+class FakeBot:
+    """``get_updates`` answers from a script: an exception is raised, a list is returned."""
+
+    def __init__(self, script) -> None:
+        self.script = list(script)
+        self.offsets = []
+        self.calls = []
+
+    async def get_updates(self, offset=None, timeout=None, allowed_updates=None):
+        self.offsets.append(offset)
+        self.calls.append(time.monotonic())
+        if not self.script:
+            await asyncio.sleep(3600)
+        step = self.script.pop(0)
+        if isinstance(step, BaseException):
+            raise step
+        return step
+
+
+class FakeRouter:
+    def __init__(self, fail_on=()) -> None:
+        self.fail_on = set(fail_on)
+        self.updates = []
+
+    async def put(self, update: Update) -> None:
+        if update.update_id in self.fail_on:
+            self.fail_on.discard(update.update_id)
+            raise RuntimeError("router broke")
+        self.updates.append(update.update_id)
+
+
+def _poller(bot, router) -> UpdatePoller:
+    poller = UpdatePoller(bot, router)
+    poller.MIN_BACKOFF = 0.02
+    poller.MAX_BACKOFF = 0.05
+    poller.RESTART_DELAY = 0.02
+    return poller
+
+
+async def _run(poller: UpdatePoller, seconds: float) -> None:
+    poller.start()
+    await asyncio.sleep(seconds)
+    await poller.stop()
+
+
+def test_poller_survives_any_error_with_capped_backoff(caplog):
+    bot = FakeBot([
+        TelegramNetworkError(GetUpdates(), "timeout"),
+        RuntimeError("unexpected"),
+        ValueError("bad json"),
+        RuntimeError("unexpected"),
+        [_update(1), _update(2)],
+        RuntimeError("unexpected"),
+        [_update(3)],
+    ])
+    router = FakeRouter()
+    asyncio.run(_run(_poller(bot, router), 0.5))
+    assert router.updates == [1, 2, 3]
+    assert bot.offsets[-1] == 4
+    # Удвоение до потолка, после удачного ответа — снова с минимума
+    delays = [record.retry_in for record in caplog.records if record.getMessage() == "getUpdates failed"]
+    assert delays == [0.02, 0.04, 0.05, 0.05, 0.02]
+
+
+def test_poller_waits_retry_after():
+    bot = FakeBot([TelegramRetryAfter(GetUpdates(), "flood", retry_after=1), [_update(7)]])
+    router = FakeRouter()
+    started = time.monotonic()
+    asyncio.run(_run(_poller(bot, router), 1.3))
+    assert router.updates == [7]
+    assert bot.calls[1] - bot.calls[0] >= 0.95
+    assert bot.calls[0] - started < 0.1
+
+
+def test_poller_restarts_after_dying_and_keeps_offset():
+    bot = FakeBot([[_update(1)], [_update(2), _update(3)], [_update(3)]])
+    router = FakeRouter(fail_on={2})
+    poller = _poller(bot, router)
+    asyncio.run(_run(poller, 0.3))
+    # Апдейт 2 не подтверждён — после перезапуска Telegram отдаёт его снова (здесь — уже как 3)
+    assert router.updates == [1, 3]
+    assert bot.offsets[:3] == [None, 2, 2]
+
+
+def test_hash_ring_is_stable_and_spreads_users():
+    ring, same, grown = HashRing(4), HashRing(4), HashRing(5)
+    owners = [ring.node(user_id) for user_id in range(10_000)]
+    assert owners == [same.node(user_id) for user_id in range(10_000)]
+    counts = [owners.count(node) for node in range(4)]
+    assert min(counts) > 1500
+    # Пятый шард забирает примерно пятую часть пользователей, остальные остаются на месте
+    moved = sum(owner != grown.node(user_id) for user_id, owner in enumerate(owners))
+    assert moved < 3000
+
+
+def test_router_accepts_telegram_secret_and_forwards_with_shard_token():
+    received = []
+
+    async def worker(request: web.Request) -> web.Response:
+        received.append((request.headers.get(SECRET_HEADER), (await request.json())["update_id"]))
+        return web.Response()
+
+    async def scenario():
+        worker_app = web.Application()
+        worker_app.router.add_post(UPDATE_PATH, worker)
+        worker_server = TestServer(worker_app, host="127.0.0.1")
+        await worker_server.start_server()
+        bot = Bot("42:TEST")
+        router = ShardRouter(bot, [str(worker_server.make_url("")).rstrip("/")], "shard-token", "tg-secret")
+        router.start()
+        intake_server = TestServer(router.build_app("/webhook"), host="127.0.0.1")
+        await intake_server.start_server()
+        try:
+            async with httpx.AsyncClient(base_url=str(intake_server.make_url(""))) as client:
+                update = {"update_id": 1, "message": {
+                    "message_id": 1, "date": 0, "chat": {"id": 7, "type": "private"},
+                    "from": {"id": 7, "is_bot": False, "first_name": "U"}, "text": "hi",
+                }}
+                accepted = await client.post("/webhook", json=update, headers={SECRET_HEADER: "tg-secret"})
+                internal = await client.post("/webhook", json=update, headers={SECRET_HEADER: "shard-token"})
+            await router.stop(5)
+        finally:
+            await intake_server.close()
+            await worker_server.close()
+            await bot.session.close()
+        return accepted.status_code, internal.status_code
+
+    accepted, internal = asyncio.run(scenario())
+    assert accepted == 200
+    assert internal == 401
+    assert received == [("shard-token", 1)]
@@ -0,0 +1,143 @@
+import asyncio
+import contextlib
+import hmac
+import logging
+import signal
+from typing import List, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from aiohttp import web
+
+from server import AppServer
+
+
+log = logging.getLogger(__name__)
+
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def update_user_id(update: Update) -> int:
+    """User (or chat) an update belongs to; used to keep per-user ordering."""
+    try:
+        event = update.event
+    except Exception:  # noqa: BLE001
+        return update.update_id
+    user = getattr(event, "from_user", None)
+    if user is not None:
+        return user.id
+    chat = getattr(event, "chat", None)
+    if chat is not None:
+        return chat.id
+    return update.update_id
+
+
+class WebhookIntake:
+    """Accepts Telegram webhook updates and feeds them to the dispatcher.
+
+    Updates are routed to ``workers`` queues by user id, so one user's
+    updates are handled in order while different users run concurrently.
+    When the target queue is full the request is answered with 503 and
+    Telegram redelivers it later — that is the backpressure.
+    """
+
+    def __init__(
+        self,
+        dp: Dispatcher,
+        bot: Bot,
+        secret: str,
+        workers: int = 16,
+        queue_size: int = 256,
+    ) -> None:
+        self.dp = dp
+        self.bot = bot
+        self.secret = secret
+        self._queues: List[asyncio.Queue] = [asyncio.Queue(maxsize=queue_size) for _ in range(workers)]
+        self._tasks: List[asyncio.Task] = []
+        self.rejected = 0
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret):
+            return web.Response(status=401)
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": self.bot})
+        except ValueError:
+            return web.Response(status=400)
+        try:
+            self._queue_for(update).put_nowait(update)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return web.Response(status=503)
+        return web.Response()
+
+    def _queue_for(self, update: Update) -> asyncio.Queue:
+        return self._queues[update_user_id(update) % len(self._queues)]
+
+    async def put(self, update: Update) -> None:
+        """Enqueue from a pull source (getUpdates); waits instead of rejecting when full."""
+        await self._queue_for(update).put(update)
+
+    async def process(self, update: Update) -> None:
+        await self.dp.feed_update(self.bot, update)
+
+    async def _worker(self, queue: asyncio.Queue) -> None:
+        while True:
+            update = await queue.get()
+            try:
+                await self.process(update)
+            except Exception:  # noqa: BLE001
+                log.exception("Update failed", extra={"update_id": update.update_id})
+            finally:
+                queue.task_done()
+
+    def build_app(self, path: str) -> web.Application:
+        app = web.Application()
+        app.router.add_post(path, self.handle)
+        return app
+
+    def start(self) -> None:
+        self._tasks = [asyncio.create_task(self._worker(q)) for q in self._queues]
+
+    async def stop(self, timeout: Optional[float] = 10.0) -> None:
+        # Дорабатываем уже принятые обновления, затем останавливаем воркеров
+        with contextlib.suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(asyncio.gather(*(q.join() for q in self._queues)), timeout)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+
+async def wait_for_shutdown_signal() -> None:
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        with contextlib.suppress(NotImplementedError):
+            loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, settings) -> None:
+    intake = WebhookIntake(
+        dp,
+        bot,
+        settings.webhook_secret,
+        workers=settings.webhook_workers,
+        queue_size=settings.webhook_queue_size,
+    )
+    server = AppServer(intake.build_app(settings.webhook_path), settings.webhook_host, settings.webhook_port)
+    intake.start()
+    await server.start()
+    await bot.set_webhook(
+        settings.webhook_url.rstrip("/") + settings.webhook_path,
+        secret_token=settings.webhook_secret,
+        allowed_updates=dp.resolve_used_update_types(),
+    )
+    await dp.emit_startup(bot=bot)
+    try:
+        await wait_for_shutdown_signal()
+    finally:
+        await server.stop()
+        await intake.stop(settings.shutdown_timeout)
+        await dp.emit_shutdown(bot=bot)
@@ -1,12 +1,13 @@
 import { NextResponse } from 'next/server'
 import { fetchUsdRubRate } from '@/lib/rates'
+import { getPricingParams } from '@/lib/pricing'
 
 export const runtime = 'nodejs'
 
 export async function GET() {
   try {
     const rate = await fetchUsdRubRate()
-    return NextResponse.json({ rate })
+    return NextResponse.json({ rate, pricing: getPricingParams() })
   } catch (e: any) {
     return NextResponse.json({ error: e?.message || 'rate unavailable' }, { status: 502 })
   }
@@ -1,5 +1,5 @@
 import { NextRequest, NextResponse } from 'next/server'
-import { getYooEnv, yooGetPayment, yooCapturePayment } from '@/lib/yookassa'
+import { getYooEnv, yooResolveStatus } from '@/lib/yookassa'
 
 export const runtime = 'nodejs'
 
@@ -7,18 +7,7 @@ export async function GET(_req: NextRequest, { params }: { params: { paymentId:
   try {
     const env = getYooEnv()
 
-    const d = await yooGetPayment(env, params.paymentId)
-    let status: string = d?.status
-    const paid: boolean = !!d?.paid
-
-    if ((status === 'waiting_for_capture') || (status === 'pending' && paid)) {
-      try {
-        const cd = await yooCapturePayment(env, params.paymentId, d?.amount)
-        if (cd?.status) status = cd.status
-      } catch {
-        // ignore capture failure in polling; status will be updated by webhook later
-      }
-    }
+    const { status, payment: d } = await yooResolveStatus(env, params.paymentId)
 
     return NextResponse.json({
       status,
@@ -31,4 +20,3 @@ export async function GET(_req: NextRequest, { params }: { params: { paymentId:
     return NextResponse.json({ error: e?.message || 'Server error' }, { status: 500 })
   }
 }
-
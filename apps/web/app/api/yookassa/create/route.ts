@@ -1,5 +1,5 @@
 import { NextRequest, NextResponse } from 'next/server'
-import { calcRubPrice } from '@/lib/pricing'
+import { calcRubPrice, getPricingParams } from '@/lib/pricing'
 import { fetchUsdRubRate } from '@/lib/rates'
 import { verifyWebAppInitData } from '@/lib/telegram'
 import { getYooEnv, yooCreatePayment } from '@/lib/yookassa'
@@ -8,8 +8,13 @@ export const runtime = 'nodejs'
 
 export async function POST(req: NextRequest) {
   try {
-    const { initData, order } = await req.json()
+    const { initData, order, idempotencyKey } = await req.json()
     if (!order) return NextResponse.json({ error: 'order обязателен' }, { status: 400 })
+    // Ключ идемпотентности от клиента (бот): повтор запроса вернёт тот же платёж ЮKassa
+    const idemKey = String(req.headers.get('idempotency-key') || idempotencyKey || '').trim() || undefined
+    if (idemKey && idemKey.length > 64) {
+      return NextResponse.json({ error: 'Idempotency-Key длиннее 64 символов' }, { status: 400 })
+    }
 
     let yooEnv
     try { yooEnv = getYooEnv() } catch (e: any) {
@@ -23,13 +28,14 @@ export async function POST(req: NextRequest) {
     if (!usd) return NextResponse.json({ error: 'Некорректная сумма' }, { status: 400 })
 
     let totalRub = 0
+    const pricing = getPricingParams()
     try {
       const rate = await fetchUsdRubRate()
-      totalRub = calcRubPrice(usd, { fx: rate })
+      totalRub = calcRubPrice(usd, { fx: rate, ...pricing })
     } catch (e) {
       const fallbackRate = Number(process.env.USD_RUB_RATE_FALLBACK || 0)
       if (fallbackRate > 0) {
-        totalRub = calcRubPrice(usd, { fx: fallbackRate })
+        totalRub = calcRubPrice(usd, { fx: fallbackRate, ...pricing })
       } else {
         return NextResponse.json({ error: 'Курс недоступен, задайте USD_RUB_RATE_FALLBACK' }, { status: 502 })
       }
@@ -140,7 +146,7 @@ export async function POST(req: NextRequest) {
     if (process.env.YOOKASSA_TEST_MODE === '1' || key.startsWith('test_')) payload.test = true
 
     try {
-      const data = await yooCreatePayment(yooEnv, payload)
+      const data = await yooCreatePayment(yooEnv, payload, idemKey)
       return NextResponse.json({ paymentId: data?.id, confirmationUrl: data?.confirmation?.confirmation_url })
     } catch (e: any) {
       const debug = process.env.DEBUG_YOOKASSA === '1'
@@ -0,0 +1,31 @@
+import { NextRequest, NextResponse } from 'next/server'
+import { getYooEnv, yooResolveStatus } from '@/lib/yookassa'
+
+export const runtime = 'nodejs'
+
+const MAX_IDS = 100
+
+// Пакетная проверка статусов: бот присылает все платежи, которые пора проверить, одним запросом
+export async function POST(req: NextRequest) {
+  try {
+    const body = await req.json().catch(() => ({}))
+    const ids: string[] = Array.isArray(body?.ids) ? body.ids.map(String).filter(Boolean) : []
+    if (!ids.length) return NextResponse.json({ error: 'ids обязателен' }, { status: 400 })
+    if (ids.length > MAX_IDS) return NextResponse.json({ error: `Не более ${MAX_IDS} ids за запрос` }, { status: 400 })
+
+    const env = getYooEnv()
+    const results = await Promise.allSettled(ids.map((id) => yooResolveStatus(env, id)))
+
+    const payments: Record<string, any> = {}
+    results.forEach((r, i) => {
+      if (r.status === 'fulfilled') {
+        payments[ids[i]] = { status: r.value.status, paid: r.value.payment?.paid ?? false }
+      } else {
+        payments[ids[i]] = { error: r.reason?.message || 'Server error' }
+      }
+    })
+    return NextResponse.json({ payments })
+  } catch (e: any) {
+    return NextResponse.json({ error: e?.message || 'Server error' }, { status: 500 })
+  }
+}
@@ -1,10 +1,51 @@
 import { NextRequest, NextResponse } from 'next/server'
-import { getYooEnv, yooCapturePayment } from '@/lib/yookassa'
+import { fetchWithTimeout, getYooEnv, safeJson, yooCapturePayment } from '@/lib/yookassa'
 import { sendTelegramMessage } from '@/lib/telegram'
 import { Buffer } from 'buffer'
 
 export const runtime = 'nodejs'
 
+async function forwardPaymentEvent(paymentId: string, status: string): Promise<boolean> {
+  const url = (process.env.BOT_EVENTS_URL || '').trim().replace(/\/+$/, '')
+  const token = process.env.BOT_EVENTS_TOKEN || ''
+  if (!url || !token || !paymentId) return false
+  try {
+    const res = await fetchWithTimeout(`${url}/events/payment`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json', 'X-Bot-Events-Token': token },
+      body: JSON.stringify({ paymentId, status }),
+      timeoutMs: 5000
+    })
+    if (!res.ok) return false
+    const data = await safeJson(res)
+    return data?.handled === true
+  } catch {
+    // бот недоступен — уведомим менеджера напрямую, как раньше
+    return false
+  }
+}
+
+// Уведомление менеджеру через бота: попадает в общий дайджест, повтор по тому же платежу отбрасывается
+async function forwardAdminNotification(paymentId: string, text: string, replyMarkup?: any): Promise<'queued' | 'duplicate' | 'failed'> {
+  const url = (process.env.BOT_EVENTS_URL || '').trim().replace(/\/+$/, '')
+  const token = process.env.BOT_EVENTS_TOKEN || ''
+  if (!url || !token || !paymentId) return 'failed'
+  try {
+    const res = await fetchWithTimeout(`${url}/events/admin`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json', 'X-Bot-Events-Token': token },
+      body: JSON.stringify({ paymentId, text, replyMarkup }),
+      timeoutMs: 5000
+    })
+    if (!res.ok) return 'failed'
+    const data = await safeJson(res)
+    if (data?.queued !== true) return 'failed'
+    return data?.duplicate === true ? 'duplicate' : 'queued'
+  } catch {
+    return 'failed'
+  }
+}
+
 export async function POST(req: NextRequest) {
   try {
     const env = getYooEnv()
@@ -31,7 +72,10 @@ export async function POST(req: NextRequest) {
       } catch {}
     }
 
-    if (finalStatus === 'succeeded') {
+    // Сначала отдаём событие боту: если платёж создан в чате, бот сам уведомит клиента и менеджера
+    const handledByBot = await forwardPaymentEvent(obj.id, finalStatus)
+
+    if (finalStatus === 'succeeded' && !handledByBot) {
       const botToken = process.env.BOT_TOKEN!
       const adminChatId = process.env.ADMIN_CHAT_ID!
       const md = obj?.metadata || {}
@@ -56,9 +100,12 @@ export async function POST(req: NextRequest) {
           [{ text: '⚠️ Возникли проблемы', callback_data: `issue:${md.userId}` }]
         ] }
       }
-      await sendTelegramMessage(botToken, adminChatId, payload)
+      const forwarded = await forwardAdminNotification(obj.id, lines, payload.reply_markup)
+      // Бот недоступен — пишем менеджеру напрямую, как раньше
+      if (forwarded === 'failed') await sendTelegramMessage(botToken, adminChatId, payload)
 
-      if (md.userId) {
+      // Повтор того же платежа (ЮKassa шлёт вебхук повторно) — клиент уже уведомлён
+      if (md.userId && forwarded !== 'duplicate') {
         const userMsg = (
           '✅ Оплата получена!\n' +
           'В течение 15–60 минут мы оформим подписку. Если будут вопросы пишите в поддержку.'
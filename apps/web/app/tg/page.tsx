@@ -1,6 +1,6 @@
 "use client"
 import { useEffect, useMemo, useRef, useState } from 'react'
-import { calcRubPrice } from '@/lib/pricing'
+import { DEFAULT_PRICING, PricingParams, calcRubPrice } from '@/lib/pricing'
 
 declare global {
   interface Window {
@@ -60,6 +60,7 @@ export default function TgPage() {
   const [paymentId, setPaymentId] = useState<string | null>(null)
   const [result, setResult] = useState<string>('')
   const [usdToRub, setUsdToRub] = useState<number | null>(null)
+  const [pricing, setPricing] = useState<PricingParams>(DEFAULT_PRICING)
   const paymentSlug = process.env.NEXT_PUBLIC_PAYMENT_SLUG
   const [telegramUserId, setTelegramUserId] = useState<number | undefined>(undefined)
   const [telegramUser, setTelegramUser] = useState<Order['telegramUser']>()
@@ -188,6 +189,7 @@ export default function TgPage() {
       try {
         const j = await r.json()
         if (j?.rate) setUsdToRub(Number(j.rate))
+        if (j?.pricing) setPricing({ ...DEFAULT_PRICING, ...j.pricing })
       } catch {}
     }).catch(() => {})
   }, [])
@@ -263,14 +265,12 @@ export default function TgPage() {
     const rate = usdToRub && usdToRub > 0 ? usdToRub : 0
     const monthlyUsd = Math.max(0, Number(order.monthlyPriceUsd) || 0)
     const totalUsd = monthlyUsd * months
-    const deltaRate = 4
-    const fixedFee = 750
-    const baseRub = totalUsd * (rate + deltaRate)
-    const totalRub = totalUsd > 0 && rate > 0 ? calcRubPrice(totalUsd, { fx: rate, deltaRate, fixedFee }) : 0
+    const baseRub = totalUsd * (rate + pricing.deltaRate)
+    const totalRub = totalUsd > 0 && rate > 0 ? calcRubPrice(totalUsd, { fx: rate, ...pricing }) : 0
     const commissionRub = Math.max(0, totalRub - baseRub)
     const commissionPctDisplay = baseRub > 0 ? (commissionRub / baseRub) : 0
     return { usdToRub: rate, commissionPct: commissionPctDisplay, months, baseUsd: totalUsd, baseRub, commissionRub, totalRub }
-  }, [order.monthlyPriceUsd, months, usdToRub])
+  }, [order.monthlyPriceUsd, months, usdToRub, pricing])
 
   const canInfo = useMemo(() => !!order.service && !!order.login && !!order.password && !!order.creatorUrl, [order])
   const canPrice = useMemo(() => Number((monthlyUsdInput || '').replace(',', '.')) > 0, [monthlyUsdInput])
@@ -1,17 +1,46 @@
-export type CalcRubOptions = {
-  fx: number
-  deltaRate?: number
-  fixedFee?: number
+export type PricingParams = {
+  deltaRate: number
+  fixedFee: number
+  baseCommission: number
+  commissionPerUsd: number
 }
 
-// Итог (₽) = ceil( ( startprice × (fx + deltaRate) × (1 + 0.03 + 0.001×startprice) + fixedFee ) / 10 ) × 10
+export type CalcRubOptions = { fx: number } & Partial<PricingParams>
+
+// Значения по умолчанию совпадают с ботом (apps/bot/pricing.py)
+export const DEFAULT_PRICING: PricingParams = {
+  deltaRate: 4,
+  fixedFee: 750,
+  baseCommission: 0.03,
+  commissionPerUsd: 0.001
+}
+
+function envNumber(value: string | undefined, fallback: number): number {
+  const n = Number(value)
+  return value !== undefined && value !== '' && isFinite(n) ? n : fallback
+}
+
+// Параметры формулы читаются из тех же переменных окружения, что и в боте (только на сервере).
+// Клиент получает их вместе с курсом из /api/rates/usd-rub.
+export function getPricingParams(): PricingParams {
+  return {
+    deltaRate: envNumber(process.env.PRICING_DELTA_RATE, DEFAULT_PRICING.deltaRate),
+    fixedFee: envNumber(process.env.PRICING_FIXED_FEE, DEFAULT_PRICING.fixedFee),
+    baseCommission: envNumber(process.env.PRICING_BASE_COMMISSION, DEFAULT_PRICING.baseCommission),
+    commissionPerUsd: envNumber(process.env.PRICING_COMMISSION_PER_USD, DEFAULT_PRICING.commissionPerUsd)
+  }
+}
+
+// Итог (₽) = ceil( ( startprice × (fx + deltaRate) × (1 + baseCommission + commissionPerUsd×startprice) + fixedFee ) / 10 ) × 10
 export function calcRubPrice(usd: number, options: CalcRubOptions): number {
   const fx = Number(options.fx)
   const start = Number(usd)
   if (!fx || fx <= 0 || !start || start <= 0) return 0
-  const deltaRate = options.deltaRate ?? 4
-  const fixedFee = options.fixedFee ?? 750
-  const commission = 0.03 + 0.001 * start
+  const deltaRate = options.deltaRate ?? DEFAULT_PRICING.deltaRate
+  const fixedFee = options.fixedFee ?? DEFAULT_PRICING.fixedFee
+  const baseCommission = options.baseCommission ?? DEFAULT_PRICING.baseCommission
+  const commissionPerUsd = options.commissionPerUsd ?? DEFAULT_PRICING.commissionPerUsd
+  const commission = baseCommission + commissionPerUsd * start
   const base = start * (fx + deltaRate)
   const priceWithCommission = base * (1 + commission)
   const final = priceWithCommission + fixedFee
@@ -87,6 +87,23 @@ export async function yooCapturePayment(env: YooEnv, id: string, amount?: any, i
   return data
 }
 
+// Текущий статус платежа; оплаченный, но не списанный платёж сразу подтверждаем (capture)
+export async function yooResolveStatus(env: YooEnv, id: string) {
+  const d = await yooGetPayment(env, id)
+  let status: string = d?.status
+  const paid: boolean = !!d?.paid
+
+  if ((status === 'waiting_for_capture') || (status === 'pending' && paid)) {
+    try {
+      const cd = await yooCapturePayment(env, id, d?.amount)
+      if (cd?.status) status = cd.status
+    } catch {
+      // ignore capture failure in polling; status will be updated by webhook later
+    }
+  }
+  return { status, payment: d }
+}
+
 export async function safeJson(res: Response) {
   try { return await res.json() } catch { return {} }
 }
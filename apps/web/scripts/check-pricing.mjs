@@ -0,0 +1,35 @@
+// Сверяет calcRubPrice (lib/pricing.ts) с эталонными итогами бота: apps/bot/tests/pricing_golden.json.
+// Запуск: npm run test:pricing (нужен devDependency typescript — им транспилируется lib/pricing.ts).
+import { readFile } from 'node:fs/promises'
+import ts from 'typescript'
+
+const source = await readFile(new URL('../lib/pricing.ts', import.meta.url), 'utf8')
+const { outputText } = ts.transpileModule(source, {
+  compilerOptions: { module: ts.ModuleKind.ESNext, target: ts.ScriptTarget.ES2020 }
+})
+const { calcRubPrice } = await import(`data:text/javascript;base64,${Buffer.from(outputText).toString('base64')}`)
+
+const golden = JSON.parse(await readFile(new URL('../../bot/tests/pricing_golden.json', import.meta.url), 'utf8'))
+let checked = 0
+const mismatches = []
+for (const { params, cases } of golden.groups) {
+  const options = {
+    deltaRate: params.delta_rate,
+    fixedFee: params.fixed_fee,
+    baseCommission: params.base_commission,
+    commissionPerUsd: params.commission_per_usd
+  }
+  for (const c of cases) {
+    // Как в мини-аппе: в формулу идёт сумма в USD за весь срок
+    const total = calcRubPrice(c.price_usd * c.months, { fx: c.rate, ...options })
+    checked += 1
+    if (total !== c.total_rub) mismatches.push({ ...c, params, got: total })
+  }
+}
+
+if (mismatches.length) {
+  console.error(`calcRubPrice differs from the bot in ${mismatches.length} of ${checked} cases:`)
+  for (const m of mismatches.slice(0, 20)) console.error(JSON.stringify(m))
+  process.exit(1)
+}
+console.log(`calcRubPrice matches the bot in all ${checked} cases`)